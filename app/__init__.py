@@ -1,5 +1,4 @@
 import atexit
-from datetime import date
 
 import os
 import uuid
@@ -7,7 +6,6 @@ import redis
 import logging
 from logging import Formatter
 from logging.handlers import TimedRotatingFileHandler, SMTPHandler
-from business_calendar import Calendar, MO, TU, WE, TH, FR
 from celery import Celery
 from flask import (
     Flask,
@@ -16,7 +14,6 @@ from flask import (
 )
 from flask_apscheduler import APScheduler
 from flask_bootstrap import Bootstrap
-from flask_elasticsearch import FlaskElasticsearch
 from flask_tracy import Tracy
 from flask_kvsession import KVSessionExtension
 from flask_login import LoginManager, current_user
@@ -30,6 +27,9 @@ from apscheduler.triggers.interval import IntervalTrigger
 from simplekv.decorator import PrefixDecorator
 from simplekv.memory.redisstore import RedisStore
 from app.lib import NYCHolidays, jinja_filters
+from app.lib.calendar_utils import BusinessCalendar
+from app.lib.es_client import ElasticsearchClient
+from app.lib.scheduler_utils import SchedulerLeader
 from app.constants import OPENRECORDS_DL_EMAIL
 
 from config import config, Config
@@ -37,7 +37,7 @@ from raven.contrib.flask import Sentry
 
 recaptcha = ReCaptcha()
 bootstrap = Bootstrap()
-es = FlaskElasticsearch()
+es = ElasticsearchClient()
 db = SQLAlchemy()
 csrf = CsrfProtect()
 moment = Moment()
@@ -52,12 +52,12 @@ sentry = Sentry()
 
 upload_redis = redis.StrictRedis(db=Config.UPLOAD_REDIS_DB, host=Config.REDIS_HOST, port=Config.REDIS_PORT)
 email_redis = redis.StrictRedis(db=Config.EMAIL_REDIS_DB, host=Config.REDIS_HOST, port=Config.REDIS_PORT)
+search_redis = redis.StrictRedis(db=Config.SEARCH_REDIS_DB, host=Config.REDIS_HOST, port=Config.REDIS_PORT)
+scheduler_redis = redis.StrictRedis(db=Config.SCHEDULER_REDIS_DB, host=Config.REDIS_HOST, port=Config.REDIS_PORT)
 
-holidays = NYCHolidays(years=[year for year in range(date.today().year, date.today().year + 5)])
-calendar = Calendar(
-    workdays=[MO, TU, WE, TH, FR],
-    holidays=[str(key) for key in holidays.keys()]
-)
+holidays = NYCHolidays(years=[year for year in range(Config.BUSINESS_CALENDAR_FIRST_YEAR,
+                                                      Config.BUSINESS_CALENDAR_LAST_YEAR + 1)])
+calendar = BusinessCalendar(holidays.keys(), Config.BUSINESS_CALENDAR_FIRST_YEAR, Config.BUSINESS_CALENDAR_LAST_YEAR)
 
 
 def create_app(config_name, jobs_enabled=True):
@@ -146,8 +146,19 @@ def create_app(config_name, jobs_enabled=True):
             # trigger=IntervalTrigger(minutes=1)  # TODO: switch to cron below after testing
             trigger=CronTrigger(hour=8)
         )
-
-        scheduler.start()
+        if app.config['ELASTICSEARCH_ENABLED']:
+            scheduler.add_job(
+                'send_saved_search_digests',
+                jobs.send_saved_search_digests,
+                name="Send saved search digests every {} minutes.".format(
+                    app.config['SAVED_SEARCH_DIGEST_INTERVAL']),
+                trigger=IntervalTrigger(minutes=app.config['SAVED_SEARCH_DIGEST_INTERVAL'])
+            )
+
+        # only the elected leader of all processes with jobs enabled runs them
+        scheduler_leader = SchedulerLeader(scheduler, scheduler_redis, app.config['SCHEDULER_LEADER_TTL'], app.logger)
+        app.extensions['scheduler_leader'] = scheduler_leader
+        scheduler_leader.start()
 
     # Error Handlers
     @app.errorhandler(400)
@@ -242,6 +253,6 @@ def create_app(config_name, jobs_enabled=True):
 
     # exit handling
     if jobs_enabled:
-        atexit.register(lambda: scheduler.shutdown())
+        atexit.register(lambda: app.extensions['scheduler_leader'].stop())
 
     return app
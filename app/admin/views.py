@@ -3,16 +3,18 @@
 
     :synopsis: Endpoints for Agency Adminstrator Interface
 """
+from app import scheduler_redis
 from app.admin import admin
 from app.models import Users, Agencies, AgencyUsers
 from app.admin.forms import (
     SelectAgencyForm,
     ActivateAgencyUserForm
 )
-from flask import render_template, abort
+from flask import render_template, abort, jsonify
 from flask_login import current_user
 from app.constants import user_type_auth
 from app.admin.utils import get_agency_active_users
+from app.lib.scheduler_utils import get_scheduler_leader
 
 
 # TODO: View function to handle updates to agency wide settings (see models.py:183
@@ -54,3 +56,16 @@ def main(agency_ein=None):
                                    user_form=form)
 
     return abort(404)
+
+
+@admin.route('/scheduler')
+def scheduler():
+    """
+    Returns the node running scheduled jobs (super users only).
+    See app.lib.scheduler_utils.get_scheduler_leader
+
+    :return: json object({"leader": {"node": ..., "since": ..., "heartbeat": ...} or null}), 200
+    """
+    if current_user.is_anonymous or not current_user.is_super:
+        return abort(403)
+    return jsonify({"leader": get_scheduler_leader(scheduler_redis)}), 200
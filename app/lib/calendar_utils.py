@@ -0,0 +1,172 @@
+"""
+    app.lib.calendar_utils
+    ~~~~~~~~~~~~~~~~
+    synopsis: Business-day calendar with constant time date arithmetic
+
+    A drop-in replacement for business_calendar.Calendar (Monday to Friday
+    work days), whose addbusdays and busdaycount walk the days and holidays
+    in between the dates.
+
+    Every day is numbered by the count of business days up to and including it:
+
+        busday_number(day) = workdays(day) - holidays(day)
+
+    where workdays(day) has a closed form (0001-01-01 is a Monday). The
+    numbers are precomputed in an array over the years of the holiday list
+    and a second array maps the business day numbers of that span
+    back to their days, so that adding business days and counting them are
+    a few array lookups. There are no holidays outside of the span
+    (like business_calendar.Calendar, minus the warnings).
+
+    Dates are counted by day; the time of day (of datetimes) is kept
+    but not compared.
+"""
+from array import array
+from datetime import date as date_, datetime, timedelta
+from itertools import repeat
+
+WORKDAYS_PER_WEEK = 5
+
+
+def _workdays(ordinal):
+    """
+    Return the number of work days (Monday to Friday) from 0001-01-01 to the given day (included).
+    """
+    weeks, days = divmod(ordinal, 7)
+    return weeks * WORKDAYS_PER_WEEK + min(days, WORKDAYS_PER_WEEK)
+
+
+def _isworkday(ordinal):
+    return ordinal % 7 not in (6, 0)  # Saturday, Sunday
+
+
+def _workday_ordinal(number):
+    """
+    Return the day of the given work day number (inverse of _workdays).
+    """
+    weeks, days = divmod(number - 1, WORKDAYS_PER_WEEK)
+    return weeks * 7 + days + 1
+
+
+def _parse(date):
+    """
+    Same parsing as business_calendar.Calendar: dates and datetimes are returned
+    as is, "YYYY-MM-DD" and "YYYY-MM-DD HH:MM:SS" strings as datetimes.
+    """
+    if hasattr(date, 'year'):
+        return date
+    try:
+        return datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        return datetime.strptime(date, '%Y-%m-%d %H:%M:%S')
+
+
+class BusinessCalendar(object):
+    """
+    Monday to Friday business days, excluding holidays, between the
+    first and last year (included) of the holiday list.
+    """
+
+    def __init__(self, holidays, first_year, last_year):
+        """
+        :param holidays: holiday dates (date, datetime or "YYYY-MM-DD")
+        :param first_year: first year of the precomputed span
+        :param last_year: last year of the precomputed span
+        """
+        self.first_ordinal = date_(first_year, 1, 1).toordinal()
+        self.last_ordinal = date_(last_year, 12, 31).toordinal()
+        # holidays of the span falling on work days
+        self.holidays = frozenset(
+            ordinal for ordinal in (_parse(holiday).toordinal() for holiday in holidays)
+            if self.first_ordinal <= ordinal <= self.last_ordinal and _isworkday(ordinal)
+        )
+
+        # number of business days up to each day of the span
+        self._busday_numbers = array('l')
+        # day of each business day of the span
+        self._busday_ordinals = array('l')
+        number = self._workdays_before_span = _workdays(self.first_ordinal - 1)
+        for ordinal in range(self.first_ordinal, self.last_ordinal + 1):
+            if _isworkday(ordinal) and ordinal not in self.holidays:
+                number += 1
+                self._busday_ordinals.append(ordinal)
+            self._busday_numbers.append(number)
+
+    def busday_number(self, ordinal):
+        """
+        Return the number of business days up to the given day (proleptic Gregorian ordinal, included).
+        """
+        if ordinal < self.first_ordinal:
+            return _workdays(ordinal)
+        if ordinal > self.last_ordinal:
+            return _workdays(ordinal) - len(self.holidays)
+        return self._busday_numbers[ordinal - self.first_ordinal]
+
+    def busday_ordinal(self, number):
+        """
+        Return the day (proleptic Gregorian ordinal) of the given business day number.
+        """
+        index = number - self._workdays_before_span - 1
+        if index < 0:
+            return _workday_ordinal(number)
+        if index >= len(self._busday_ordinals):
+            return _workday_ordinal(number + len(self.holidays))
+        return self._busday_ordinals[index]
+
+    def isbusday(self, date):
+        ordinal = _parse(date).toordinal()
+        return self.busday_number(ordinal) != self.busday_number(ordinal - 1)
+
+    def isholiday(self, date):
+        return _parse(date).toordinal() in self.holidays
+
+    def addbusdays(self, date, offset):
+        """
+        Add business days to a date (see business_calendar.Calendar.addbusdays).
+
+        An offset of 0 returns the date unchanged; an offset of 1 returns the
+        next business day, whether or not the date is a business day.
+
+        :param date: date, datetime or string
+        :param offset: number of business days to add (negative to subtract)
+        :return: date or datetime (with the time of day of the given date)
+        """
+        date = _parse(date)
+        if offset == 0:
+            return date
+        ordinal = date.toordinal()
+        if offset > 0:
+            target = self.busday_ordinal(self.busday_number(ordinal) + offset)
+        else:
+            target = self.busday_ordinal(self.busday_number(ordinal - 1) + offset + 1)
+        return date + timedelta(days=target - ordinal)
+
+    def busdaycount(self, date1, date2):
+        """
+        Count the business days from the close of date1 to the close of date2
+        (see business_calendar.Calendar.busdaycount); negative if date2 is before date1.
+        """
+        return (self.busday_number(_parse(date2).toordinal()) -
+                self.busday_number(_parse(date1).toordinal()))
+
+    def addbusdays_many(self, dates, offset):
+        """
+        Batch version of addbusdays.
+
+        :param dates: iterable of dates, datetimes or strings
+        :param offset: number of business days to add to every date, or an iterable of offsets (one per date)
+        :return: list of dates or datetimes
+        """
+        offsets = repeat(offset) if isinstance(offset, int) else offset
+        return [self.addbusdays(date, offset) for date, offset in zip(dates, offsets)]
+
+    def busdaycount_many(self, dates, date2):
+        """
+        Batch version of busdaycount: count the business days from each of the dates to date2.
+
+        :param dates: iterable of dates, datetimes or strings
+        :param date2: date, datetime or string
+        :return: list of business day counts
+        """
+        number2 = self.busday_number(_parse(date2).toordinal())
+        return [number2 - self.busday_number(_parse(date).toordinal()) for date in dates]
@@ -1,3 +1,5 @@
+from datetime import datetime, timedelta
+
 from pytz import timezone
 from business_calendar import FOLLOWING
 from app import calendar
@@ -78,3 +80,20 @@ def get_holidays_date_list(year_start, year_end=None):
 def get_release_date(initial_date, days_until_release, tz_name):
     release_date = calendar.addbusdays(initial_date, days_until_release)
     return utc_to_local(release_date, tz_name)
+
+
+def get_due_date_bounds(now=None):
+    """
+    Return the (utc) start of today and the start of the first day after
+    the due soon period (DUE_SOON_DAYS_THRESHOLD business days from today),
+    where days are local (app) days.
+    Open requests due before the first are overdue and open requests due
+    before the second are due soon.
+
+    :param now: current datetime (utc), defaults to datetime.utcnow()
+    :return: tuple of naive datetime objects (utc)
+    """
+    tz_name = current_app.config['APP_TIMEZONE']
+    today = utc_to_local(now or datetime.utcnow(), tz_name).replace(hour=0, minute=0, second=0, microsecond=0)
+    due_soon_date = calendar.addbusdays(today, current_app.config['DUE_SOON_DAYS_THRESHOLD'])
+    return local_to_utc(today, tz_name), local_to_utc(due_soon_date + timedelta(days=1), tz_name)
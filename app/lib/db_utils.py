@@ -10,7 +10,7 @@ from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm.attributes import flag_modified
 
 
-def create_object(obj):
+def create_object(obj, es_create=True):
     """
     Add a database record and its elasticsearch counterpart.
 
@@ -21,6 +21,7 @@ def create_object(obj):
     Requests object in app.request.utils.
 
     :param obj: object (instance of sqlalchemy model) to create
+    :param es_create: create the elasticsearch counterpart
 
     :return: string representation of created object
         or None if creation failed
@@ -34,7 +35,8 @@ def create_object(obj):
         return None
     else:
         # create elasticsearch doc
-        if (not isinstance(obj, Requests)
+        if (es_create
+            and not isinstance(obj, Requests)
             and hasattr(obj, 'es_create')
             and current_app.config['ELASTICSEARCH_ENABLED']):
             obj.es_create()
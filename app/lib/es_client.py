@@ -0,0 +1,177 @@
+"""
+    app.lib.es_client
+    ~~~~~~~~~~~~~~~~
+    synopsis: Elasticsearch client with a per-process connection pool, retries and latency metrics
+
+    Replaces FlaskElasticsearch, which creates a new client (and connection pool)
+    for every application context. The client is created once per process
+    (after forking, e.g. gunicorn --preload or celery workers) and configured by:
+
+        ELASTICSEARCH_MAX_CONNECTIONS: connection pool size per node
+        ELASTICSEARCH_TIMEOUT: default request timeout (seconds)
+        ELASTICSEARCH_SNIFF: discover cluster nodes on start and on connection failures
+        ELASTICSEARCH_SNIFFER_TIMEOUT: seconds between node discoveries (if ELASTICSEARCH_SNIFF)
+        ELASTICSEARCH_MAX_RETRIES: retries of transient errors (of IDEMPOTENT_OPERATIONS only)
+        ELASTICSEARCH_RETRY_BACKOFF: seconds before the first retry, doubled for every retry
+        ELASTICSEARCH_LATENCY_METRICS: record latency histograms (see redis_record_es_latency)
+
+"""
+import os
+import sys
+import time
+from functools import partial
+
+from elasticsearch import Elasticsearch
+from elasticsearch.exceptions import ConnectionError, TransportError
+from redis.exceptions import RedisError
+
+# operations that may be retried after a transient error (a failed write may have been
+# processed, and a failed scroll may have advanced the cursor, skipping a page if retried)
+IDEMPOTENT_OPERATIONS = frozenset((
+    'search',
+    'count',
+    'get',
+    'mget',
+    'exists',
+))
+
+# operations with recorded latencies (other attributes of the client are returned as is)
+INSTRUMENTED_OPERATIONS = IDEMPOTENT_OPERATIONS | frozenset((
+    'scroll',
+    'clear_scroll',
+    'index',
+    'create',
+    'update',
+    'delete',
+    'delete_by_query',
+    'bulk',
+))
+
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+
+class ElasticsearchClient(object):
+    """
+    Flask extension proxying a shared elasticsearch client.
+
+    Calls of INSTRUMENTED_OPERATIONS (including those made by elasticsearch.helpers,
+    e.g. bulk and scan) have their latencies recorded by operation and caller
+    (see _get_caller). Calls of IDEMPOTENT_OPERATIONS are also retried with
+    exponential backoff on transient errors; writes are left to their callers
+    (e.g. the retries of bulk_update_docs).
+    """
+
+    def __init__(self, app=None, **kwargs):
+        self._options = {}
+        self._client = None
+        self._pid = None
+        self._max_retries = 0
+        self._retry_backoff = 0
+        self._latency_metrics = False
+        if app is not None:
+            self.init_app(app, **kwargs)
+
+    def init_app(self, app, **kwargs):
+        """
+        :param app: flask application
+        :param kwargs: additional arguments of elasticsearch.Elasticsearch (e.g. use_ssl)
+        """
+        hosts = app.config['ELASTICSEARCH_HOST']
+        self._options = dict(
+            hosts=[hosts] if isinstance(hosts, str) else hosts,
+            http_auth=app.config['ELASTICSEARCH_HTTP_AUTH'],
+            maxsize=app.config['ELASTICSEARCH_MAX_CONNECTIONS'],
+            timeout=app.config['ELASTICSEARCH_TIMEOUT'],
+            sniff_on_start=app.config['ELASTICSEARCH_SNIFF'],
+            sniff_on_connection_fail=app.config['ELASTICSEARCH_SNIFF'],
+            sniffer_timeout=(app.config['ELASTICSEARCH_SNIFFER_TIMEOUT']
+                             if app.config['ELASTICSEARCH_SNIFF'] else None),
+            max_retries=0,  # retried with backoff (see _call)
+            **kwargs
+        )
+        self._max_retries = app.config['ELASTICSEARCH_MAX_RETRIES']
+        self._retry_backoff = app.config['ELASTICSEARCH_RETRY_BACKOFF']
+        self._latency_metrics = app.config['ELASTICSEARCH_LATENCY_METRICS']
+        self._client = None
+        app.extensions['elasticsearch'] = self
+
+    @property
+    def client(self):
+        """
+        The elasticsearch client of the current process; connections are
+        never shared with forked processes.
+        """
+        if self._client is None or self._pid != os.getpid():
+            self._client = Elasticsearch(**self._options)
+            self._pid = os.getpid()
+        return self._client
+
+    def __getattr__(self, item):
+        attr = getattr(self.client, item)
+        if item in INSTRUMENTED_OPERATIONS:
+            return partial(self._call, item, attr)
+        return attr
+
+    def _call(self, operation, method, *args, **kwargs):
+        if not self._latency_metrics:
+            return self._call_with_retries(operation, method, *args, **kwargs)
+        caller = _get_caller()
+        start = time.perf_counter()
+        try:
+            return self._call_with_retries(operation, method, *args, **kwargs)
+        finally:
+            _record_latency(operation, caller, time.perf_counter() - start)
+
+    def _call_with_retries(self, operation, method, *args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return method(*args, **kwargs)
+            except TransportError as e:
+                if attempt >= self._max_retries or not _is_transient(operation, e):
+                    raise
+            time.sleep(self._retry_backoff * 2 ** attempt)
+            attempt += 1
+
+
+def _is_transient(operation, error):
+    """
+    Can an operation be retried after the given error?
+
+    Only reads are retried: a write may have been applied before the error
+    (e.g. a bulk request timing out or rejected by some of the nodes).
+    """
+    if operation not in IDEMPOTENT_OPERATIONS:
+        return False
+    if isinstance(error, ConnectionError):  # including timeouts
+        return True
+    return error.status_code in RETRY_STATUS_CODES
+
+
+def _get_caller():
+    """
+    Return the name of the function (and class, for methods) that called
+    elasticsearch, skipping this module and elasticsearch.helpers,
+    e.g. "app.models.Requests.es_create".
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if module != __name__ and not module.startswith('elasticsearch'):
+            break
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    code = frame.f_code
+    self_ = frame.f_locals.get('self') if code.co_argcount and code.co_varnames[0] == 'self' else None
+    if self_ is not None:
+        return '.'.join((frame.f_globals.get('__name__', ''), type(self_).__name__, code.co_name))
+    return '.'.join((frame.f_globals.get('__name__', ''), code.co_name))
+
+
+def _record_latency(operation, caller, seconds):
+    from app.lib.redis_utils import redis_record_es_latency  # circular import (redis_utils needs app)
+    try:
+        redis_record_es_latency(operation, caller, seconds)
+    except RedisError:
+        pass  # metrics must never fail an elasticsearch call
@@ -1,4 +1,5 @@
 import os
+import json
 
 try:
     import cPickle as pickle
@@ -6,7 +7,7 @@ except ImportError:
     import pickle
 
 from flask import current_app
-from app import upload_redis as redis
+from app import upload_redis as redis, search_redis
 from app.lib.file_utils import (
     os_get_hash,
     os_get_mime_type
@@ -78,3 +79,99 @@ def redis_get_user_session(session_id):
 
 def redis_delete_user_session(session_id):
     redis.delete(session_id)
+
+
+# Redis Search Cache Utilities
+SEARCH_GENERATION_KEY = 'search_generation'
+SEARCH_CACHE_HITS_KEY = 'search_cache_hits'
+SEARCH_CACHE_MISSES_KEY = 'search_cache_misses'
+
+
+def redis_get_search_generation():
+    """
+    Returns the current search index generation.
+    The generation is part of every search cache key (see redis_bump_search_generation).
+    """
+    return int(search_redis.get(SEARCH_GENERATION_KEY) or 0)
+
+
+def redis_bump_search_generation():
+    """
+    Invalidates all cached search results by moving on to the next generation.
+    Called whenever request docs are written.
+    """
+    search_redis.incr(SEARCH_GENERATION_KEY)
+
+
+def redis_get_search_results(key):
+    """
+    Returns cached search results or None, counting cache hits and misses.
+    """
+    results = search_redis.get(key)
+    search_redis.incr(SEARCH_CACHE_HITS_KEY if results is not None else SEARCH_CACHE_MISSES_KEY)
+    return json.loads(results.decode()) if results is not None else None
+
+
+def redis_set_search_results(key, results, ttl):
+    search_redis.setex(key, ttl, json.dumps(results))
+
+
+def redis_get_search_cache_stats():
+    """
+    Returns a dictionary of search cache hits and misses.
+    """
+    hits, misses = search_redis.mget(SEARCH_CACHE_HITS_KEY, SEARCH_CACHE_MISSES_KEY)
+    return {
+        'hits': int(hits or 0),
+        'misses': int(misses or 0),
+    }
+
+
+# Redis Elasticsearch Latency Utilities
+ES_LATENCY_KEY = 'es_latency:{operation}:{caller}'
+ES_LATENCY_KEYS_KEY = 'es_latency_keys'
+ES_LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)  # upper bounds (ms)
+
+
+def redis_record_es_latency(operation, caller, seconds):
+    """
+    Adds the latency of an elasticsearch call to the histogram
+    of its operation and caller (see app.lib.es_client).
+    """
+    ms = seconds * 1000
+    bucket = next((str(bound) for bound in ES_LATENCY_BUCKETS if ms <= bound), '+Inf')
+    key = ES_LATENCY_KEY.format(operation=operation, caller=caller)
+    pipe = search_redis.pipeline(transaction=False)
+    pipe.hincrby(key, bucket, 1)
+    pipe.hincrby(key, 'count', 1)
+    pipe.hincrbyfloat(key, 'sum', ms)
+    pipe.sadd(ES_LATENCY_KEYS_KEY, key)
+    pipe.execute()
+
+
+def redis_get_es_latency_stats():
+    """
+    Returns a list of elasticsearch latency histograms, one per operation and caller:
+    {"operation", "caller", "count", "sum_ms", "buckets": [{"le": <ms>, "count": <cumulative count>}, ...]}
+    """
+    keys = sorted(key.decode() for key in search_redis.smembers(ES_LATENCY_KEYS_KEY))
+    pipe = search_redis.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+    stats = []
+    for key, histogram in zip(keys, pipe.execute()):
+        histogram = {field.decode(): value for field, value in histogram.items()}
+        _, operation, caller = key.split(':', 2)
+        buckets = []
+        cumulative = 0
+        for bound in ES_LATENCY_BUCKETS + ('+Inf',):
+            cumulative += int(histogram.get(str(bound), 0))
+            buckets.append({'le': bound, 'count': cumulative})
+        stats.append({
+            'operation': operation,
+            'caller': caller,
+            'count': int(histogram.get('count', 0)),
+            'sum_ms': float(histogram.get('sum', 0)),
+            'buckets': buckets,
+        })
+    return stats
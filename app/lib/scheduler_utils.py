@@ -0,0 +1,175 @@
+"""
+    app.lib.scheduler_utils
+    ~~~~~~~~~~~~~~~~
+    synopsis: Runs scheduled jobs in a single process of the cluster
+
+    Every process created with jobs enabled (e.g. every gunicorn worker) takes
+    part in a leader election; only the leader runs the scheduler.
+
+    Leadership is a redis lock (SCHEDULER_LEADER_KEY, holding the id of the
+    leader node) that expires after SCHEDULER_LEADER_TTL seconds unless the
+    leader renews it. Every node sends a heartbeat three times per TTL: the
+    leader renews the lock, the other nodes try to take it, so a new leader
+    takes over within a TTL of the previous one dying. A leader that cannot
+    renew the lock pauses the scheduler before the lock could have expired.
+
+    A leader only acts in the process that started it: processes forked from it
+    (e.g. gunicorn workers with preload) inherit its state and exit hook but must
+    neither renew nor release its lock, nor shut down its scheduler.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from redis.exceptions import RedisError
+
+SCHEDULER_LEADER_KEY = 'scheduler_leader'
+SCHEDULER_LEADER_INFO_KEY = 'scheduler_leader_info'  # node, since and heartbeat of the current leader
+
+# renew or release the lock only if it is still held by the node
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SchedulerLeader(object):
+    """
+    Starts (or resumes) a scheduler while this process is the elected leader
+    and pauses it otherwise.
+    """
+
+    def __init__(self, scheduler, redis_client, ttl, logger):
+        """
+        :param scheduler: flask_apscheduler.APScheduler with its jobs added
+        :param redis_client: redis client shared by every node
+        :param ttl: seconds before the lock of a leader that stopped renewing it expires
+        :param logger: logger of the application
+        """
+        self.scheduler = scheduler
+        self.redis = redis_client
+        self.ttl = ttl
+        self.logger = logger
+        self.node_id = '{host}:{pid}:{uid}'.format(host=socket.gethostname(),
+                                                   pid=os.getpid(),
+                                                   uid=uuid.uuid4().hex[:8])
+        self.is_leader = False
+        self._pid = os.getpid()  # process taking part in the election
+        self._scheduler_started = False
+        self._last_renewal = None
+        self._stopped = threading.Event()
+        self._renew = redis_client.register_script(_RENEW_SCRIPT)
+        self._release = redis_client.register_script(_RELEASE_SCRIPT)
+
+    @property
+    def heartbeat_interval(self):
+        return self.ttl / 3
+
+    def start(self):
+        """
+        Take part in the election from a background thread.
+        """
+        self._pid = os.getpid()
+        threading.Thread(target=self._run, name='scheduler-leader-election', daemon=True).start()
+
+    def stop(self):
+        """
+        Stop taking part in the election, handing over leadership if held.
+        """
+        if not self._is_owner:
+            return
+        self._stopped.set()
+        if self.is_leader:
+            self._step_down()
+            try:
+                self._release(keys=[SCHEDULER_LEADER_KEY], args=[self.node_id])
+            except RedisError:
+                pass  # the lock will expire
+        if self._scheduler_started:
+            self.scheduler.shutdown(wait=False)
+
+    def heartbeat(self):
+        """
+        Renew the lock if leader, otherwise try to take it.
+        """
+        if not self._is_owner:
+            return
+        ttl_ms = int(self.ttl * 1000)
+        if self.is_leader:
+            if self._renew(keys=[SCHEDULER_LEADER_KEY], args=[self.node_id, ttl_ms]):
+                self._last_renewal = time.time()
+                self.redis.hset(SCHEDULER_LEADER_INFO_KEY, 'heartbeat', datetime.utcnow().isoformat())
+                return
+            self.logger.warning("Scheduler leadership of '{}' was lost.".format(self.node_id))
+            self._step_down()
+        if self.redis.set(SCHEDULER_LEADER_KEY, self.node_id, nx=True, px=ttl_ms):
+            self._last_renewal = time.time()
+            self._step_up()
+
+    @property
+    def _is_owner(self):
+        """
+        Is this the process that takes part in the election (not a forked copy)?
+        """
+        return os.getpid() == self._pid
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.heartbeat()
+            except RedisError:
+                self.logger.exception("Scheduler leader election heartbeat failed.")
+                # another node may take over once the lock expires
+                if self.is_leader and time.time() - self._last_renewal >= self.ttl - self.heartbeat_interval:
+                    self._step_down()
+            self._stopped.wait(self.heartbeat_interval)
+
+    def _step_up(self):
+        if self._scheduler_started:
+            self.scheduler.scheduler.resume()
+        else:
+            self.scheduler.start()
+            self._scheduler_started = True
+        self.is_leader = True
+        self.logger.info("'{}' is now the scheduler leader.".format(self.node_id))
+        now = datetime.utcnow().isoformat()
+        self.redis.hmset(SCHEDULER_LEADER_INFO_KEY, {
+            'node': self.node_id,
+            'since': now,
+            'heartbeat': now,
+        })
+
+    def _step_down(self):
+        self.is_leader = False
+        if self._scheduler_started:
+            self.scheduler.scheduler.pause()
+
+
+def get_scheduler_leader(redis_client):
+    """
+    Returns the current scheduler leader or None if there is none:
+    {"node": <host>:<pid>:<id>, "since": <isoformat datetime>, "heartbeat": <isoformat datetime>}
+    """
+    pipe = redis_client.pipeline()
+    pipe.get(SCHEDULER_LEADER_KEY)
+    pipe.hgetall(SCHEDULER_LEADER_INFO_KEY)
+    node, info = pipe.execute()
+    if node is None:
+        return None
+    info = {field.decode(): value.decode() for field, value in info.items()}
+    if info.get('node') != node.decode():
+        # taken over, but the info of the new leader has not been recorded yet
+        info = {}
+    info['node'] = node.decode()
+    return info
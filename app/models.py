@@ -11,7 +11,7 @@ from warnings import warn
 
 from flask import current_app, session
 from flask_login import UserMixin, AnonymousUserMixin
-from sqlalchemy import desc
+from sqlalchemy import and_, case, desc
 from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
@@ -32,6 +32,7 @@ from app.constants import (
     event_type,
 )
 from app.lib.utils import eval_request_bool, DuplicateFileException
+from app.lib.date_utils import get_due_date_bounds
 
 
 class Roles(db.Model):
@@ -164,6 +165,7 @@ class Agencies(db.Model):
                 requests. Defaults to False.
     monitors_sub_agencies - a boolean field that denotes whether administrators for this agency should be able to edit
                             requests for sub-agencies. Defaults to False.
+    updated_at - a datetime that keeps track of when the record was last changed (used to sync request docs)
 
     administrators - an array of user id strings that identify default admins for an agencies requests
     standard_users - an array of user id strings that identify agency users (non-admins) for an agencies requests
@@ -184,6 +186,7 @@ class Agencies(db.Model):
     appeals_email = db.Column(db.String(254))
     is_active = db.Column(db.Boolean(), default=False)
     agency_features = db.Column(JSONB)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     # TODO: Method to insert updates to the agency_features column
     # TODO: Use validation on agency_features column
 
@@ -311,6 +314,7 @@ class Users(UserMixin, db.Model):
     phone_number - string containing the user's phone number
     fax_number - string containing the user's fax number
     mailing_address - a JSON object containing the user's address
+    updated_at - a datetime that keeps track of when the record was last changed (used to sync request docs)
     """
     __tablename__ = 'users'
     guid = db.Column(db.String(64), primary_key=True)  # guid + auth_user_type
@@ -340,6 +344,7 @@ class Users(UserMixin, db.Model):
     fax_number = db.Column(db.String(25))
     mailing_address = db.Column(JSONB)  # TODO: define validation for minimum acceptable mailing address
     session_id = db.Column(db.String(254), nullable=True, default=None)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     # Relationships
     user_requests = db.relationship("UserRequests", backref="user", lazy='dynamic')
@@ -528,11 +533,20 @@ class Users(UserMixin, db.Model):
 
     def es_update(self):
         """
-        Call es_update for any request where this user is the requester
-        since the request es doc relies on the requester's name.
+        Update the es docs of every request (of an active agency) this user
+        is associated with, since the request es doc relies on the requester's
+        name and contact information and on the emails of assigned users.
+
+        Request ids are fetched with one query and their docs are updated in
+        bulk (or queued, if ELASTICSEARCH_ASYNC_UPDATES is set).
         """
-        for request in self.requests:
-            request.es_update()
+        from app.search.utils import update_request_docs  # circular import (search.utils needs models)
+        update_request_docs([request_id for request_id, in db.session.query(
+            UserRequests.request_id
+        ).filter(
+            UserRequests.user_guid == self.guid,
+            UserRequests.auth_user_type == self.auth_user_type
+        )])
 
     @property
     def val_for_events(self):
@@ -699,6 +713,7 @@ class Requests(db.Model):
     status - an Enum that selects from a list of different statuses a request can have
     privacy - a JSON object that contains the boolean privacy options of a request's title and agency description
               (True = Private, False = Public)
+    updated_at - a datetime that keeps track of when the record was last changed (used to sync request docs)
     """
     __tablename__ = 'requests'
     id = db.Column(db.String(19), primary_key=True)
@@ -730,6 +745,7 @@ class Requests(db.Model):
     privacy = db.Column(JSONB)
     agency_request_summary = db.Column(db.String(5000))
     agency_request_summary_release_date = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     user_requests = db.relationship('UserRequests', backref=db.backref('request', uselist=False), lazy='dynamic')
     agency = db.relationship('Agencies', backref='requests', uselist=False)
@@ -828,6 +844,57 @@ class Requests(db.Model):
     def days_until_due(self):
         return calendar.busdaycount(datetime.utcnow(), self.due_date.replace(hour=23, minute=59, second=59))
 
+    @property
+    def current_status(self):
+        """
+        The status of this request as of today: the stored status or, if
+        DERIVED_REQUEST_STATUSES, the status derived from the due date
+        (see derive_status).
+        """
+        if not current_app.config['DERIVED_REQUEST_STATUSES']:
+            return self.status
+        return self.derive_status(self.status, self.due_date, *get_due_date_bounds())
+
+    @staticmethod
+    def derive_status(status, due_date, today, due_later_date):
+        """
+        Return the status of a request as of today (see get_due_date_bounds).
+
+        Open requests due before today are Overdue and open requests due
+        before due_later_date are Due Soon. Other open requests keep their
+        stored status, unless it is Due Soon or Overdue (stored before the
+        due date was extended), in which case they are In Progress.
+
+        :param status: stored status
+        :param due_date: due date (utc)
+        :param today: (utc) start of today
+        :param due_later_date: (utc) start of the first day after the due soon period
+        """
+        if status == request_status.CLOSED:
+            return status
+        if due_date < today:
+            return request_status.OVERDUE
+        if due_date < due_later_date:
+            return request_status.DUE_SOON
+        if status in (request_status.DUE_SOON, request_status.OVERDUE):
+            return request_status.IN_PROGRESS
+        return status
+
+    @classmethod
+    def current_status_expression(cls):
+        """
+        SQL expression of current_status.
+        """
+        if not current_app.config['DERIVED_REQUEST_STATUSES']:
+            return cls.status
+        today, due_later_date = get_due_date_bounds()
+        not_closed = cls.status != request_status.CLOSED
+        return case([
+            (and_(not_closed, cls.due_date < today), request_status.OVERDUE),
+            (and_(not_closed, cls.due_date < due_later_date), request_status.DUE_SOON),
+            (cls.status.in_((request_status.DUE_SOON, request_status.OVERDUE)), request_status.IN_PROGRESS),
+        ], else_=cls.status)
+
     @property
     def url(self):
         """
@@ -847,60 +914,66 @@ class Requests(db.Model):
         return self.status == request_status.CLOSED and not self.privacy['agency_request_summary'] and \
                self.agency_request_summary and self.agency_request_summary_release_date < datetime.utcnow()
 
+    @property
+    def es_agency_only_fields(self):
+        """
+        Requester contact information and assigned user emails for the
+        request es doc. These fields are not indexed (not searchable) and
+        are only ever returned to agency users (e.g. CSV exports).
+        """
+        return {
+            'requester_email': self.requester.email,
+            'requester_title': self.requester.title,
+            'requester_organization': self.requester.organization,
+            'requester_phone_number': self.requester.phone_number,
+            'requester_fax_number': self.requester.fax_number,
+            'requester_mailing_address': self.requester.mailing_address or {},
+            'assigned_user_emails': [u.email for u in self.agency_users],
+        }
+
     def es_update(self):
+        """
+        Update this request's es doc, or queue the update to be flushed
+        in bulk if ELASTICSEARCH_ASYNC_UPDATES is set.
+        """
         if self.agency.is_active:
+            if current_app.config['ELASTICSEARCH_ASYNC_UPDATES']:
+                from app.search.utils import queue_doc_update  # circular import (search.utils needs Requests)
+                queue_doc_update(self.id)
+                return
+            # circular import (search.utils needs Requests)
+            from app.search.utils import bump_search_generation, get_routing, request_doc
+            doc = request_doc(self, self.date_closed)
             es.update(
                 index=current_app.config["ELASTICSEARCH_INDEX"],
                 doc_type='request',
                 id=self.id,
+                routing=get_routing(self.agency_ein),
                 body={
-                    'doc': {
-                        'title': self.title,
-                        'description': self.description,
-                        'agency_request_summary': self.agency_request_summary,
-                        'title_private': self.privacy['title'],
-                        'agency_request_summary_private': not self.agency_request_summary_released,
-                        'date_due': self.due_date.strftime(ES_DATETIME_FORMAT),
-                        'date_closed': self.date_closed.strftime(
-                            ES_DATETIME_FORMAT) if self.date_closed is not None else [],
-                        'status': self.status,
-                        'requester_name': self.requester.name,
-                        'public_title': 'Private' if self.privacy['title'] else self.title
-                    }
+                    'doc': doc
                 },
                 # refresh='wait_for'
             )
+            bump_search_generation()
 
     def es_create(self):
-        """ Must be called AFTER UserRequest has been created. """
+        """
+        Must be called AFTER UserRequest has been created.
+
+        The new doc is then matched against saved searches (see SavedSearches).
+        """
+        # circular import (search.utils needs Requests)
+        from app.search.utils import bump_search_generation, get_routing, percolate_request, request_doc
+        doc = request_doc(self, self.date_closed)
         es.create(
             index=current_app.config["ELASTICSEARCH_INDEX"],
             doc_type='request',
             id=self.id,
-            body={
-                'title': self.title,
-                'description': self.description,
-                'agency_request_summary': self.agency_request_summary,
-                'agency_ein': self.agency_ein,
-                'agency_name': self.agency.name,
-                'agency_acronym': self.agency.acronym,
-                'title_private': self.privacy['title'],
-                'agency_request_summary_private': not self.agency_request_summary_released,
-                'date_created': self.date_created.strftime(ES_DATETIME_FORMAT),
-                'date_submitted': self.date_submitted.strftime(ES_DATETIME_FORMAT),
-                'date_received': self.date_created.strftime(
-                    ES_DATETIME_FORMAT) if self.date_created < self.date_submitted else self.date_submitted.strftime(
-                    ES_DATETIME_FORMAT),
-                'date_due': self.due_date.strftime(ES_DATETIME_FORMAT),
-                'submission': self.submission,
-                'status': self.status,
-                'requester_id': (self.requester.get_id()
-                                 if not self.requester.is_anonymous_requester
-                                 else ''),
-                'requester_name': self.requester.name,
-                'public_title': 'Private' if self.privacy['title'] else self.title,
-            }
+            routing=get_routing(self.agency_ein),
+            body=doc
         )
+        bump_search_generation()
+        percolate_request.delay(self.id, doc)
 
     def __repr__(self):
         return '<Requests %r>' % self.id
@@ -1096,6 +1169,7 @@ class Responses(db.Model):
     date_modified - a datetime object that keeps track of when a request was changed
     content - a JSON object that contains the content for all the possible responses a request can have
     privacy - an Enum containing the privacy options for a response
+    updated_at - a datetime that keeps track of when the record was last changed (used to sync request docs)
     """
     __tablename__ = 'responses'
     id = db.Column(db.Integer, primary_key=True)
@@ -1109,6 +1183,7 @@ class Responses(db.Model):
     release_date = db.Column(db.DateTime)
     deleted = db.Column(db.Boolean, default=False, nullable=False)
     is_editable = db.Column(db.Boolean, default=False, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     type = db.Column(db.Enum(
         response_type.NOTE,
         response_type.LINK,
@@ -1225,6 +1300,7 @@ class UserRequests(db.Model):
         Agency is a user from the agency to whom the request is assigned.
         Anonymous request_user_type is not needed, since anonymous users can always browse a request
             for public information.
+    updated_at - a datetime that keeps track of when the record was last changed (used to sync request docs)
     """
     __tablename__ = 'user_requests'
     user_guid = db.Column(db.String(64), primary_key=True)
@@ -1246,6 +1322,7 @@ class UserRequests(db.Model):
                 user_type_request.AGENCY,
                 name='request_user_type'))
     permissions = db.Column(db.BigInteger)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
     # Note: If an anonymous user creates a request, they will be listed in the UserRequests table, but will have the
     # same permissions as an anonymous user browsing a request since there is no method for authenticating that the
     # current anonymous user is in fact the requester.
@@ -1270,6 +1347,17 @@ class UserRequests(db.Model):
             "permissions": self.permissions
         }
 
+    def es_create(self):
+        """
+        Update the associated request es doc since it stores the
+        emails of assigned (agency) users.
+
+        Requester UserRequests are skipped; the request es doc is
+        created after them (see Requests.es_create).
+        """
+        if self.request_user_type == user_type_request.AGENCY:
+            self.request.es_update()
+
     def has_permission(self, perm):
         """
         Ex:
@@ -1603,3 +1691,115 @@ class Emails(Responses):
             'privacy': self.privacy,
             'body': self.body,
         }
+
+
+class SavedSearches(db.Model):
+    """
+    Define the SavedSearches class with the following columns and relationships:
+    A SavedSearch is a request search an agency user is notified of new matches for
+
+    id - an integer that is the primary key of a SavedSearches
+    user_guid - a string that contains the unique guid of the user who saved the search
+    auth_user_type - a string that tells what type of a user they are (agency user, helper, etc.)
+    name - a string containing the name of the search
+    query_string - a string containing the search query (empty to match every request)
+    query_fields - a JSON object of the fields to query ({"title": true, "description": false, ...})
+    agency_ein - a foreign key that links to the primary key of the agency to filter by (optional)
+    by_phrase - a boolean that is set to true if the query is matched as a phrase
+    date_created - a datetime that keeps track of when the search was saved
+
+    Saved searches are stored as percolator queries in the elasticsearch index
+    (doc type "saved_search"); new requests are matched against them once,
+    when their doc is created (see Requests.es_create).
+    """
+    __tablename__ = 'saved_searches'
+    id = db.Column(db.Integer, primary_key=True)
+    user_guid = db.Column(db.String(64), nullable=False)
+    auth_user_type = db.Column(
+        db.Enum(user_type_auth.AGENCY_USER,
+                user_type_auth.AGENCY_LDAP_USER,
+                user_type_auth.PUBLIC_USER_FACEBOOK,
+                user_type_auth.PUBLIC_USER_MICROSOFT,
+                user_type_auth.PUBLIC_USER_YAHOO,
+                user_type_auth.PUBLIC_USER_LINKEDIN,
+                user_type_auth.PUBLIC_USER_GOOGLE,
+                user_type_auth.PUBLIC_USER_NYC_ID,
+                user_type_auth.ANONYMOUS_USER,
+                name='auth_user_type'),
+        nullable=False)
+    name = db.Column(db.String(64), nullable=False)
+    query_string = db.Column(db.String(256), nullable=False, default='')
+    query_fields = db.Column(JSONB, nullable=False)
+    agency_ein = db.Column(db.String(4), db.ForeignKey('agencies.ein'))
+    by_phrase = db.Column(db.Boolean, nullable=False, default=False)
+    date_created = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.ForeignKeyConstraint(
+            [user_guid, auth_user_type],
+            [Users.guid, Users.auth_user_type],
+            onupdate="CASCADE"
+        ),
+    )
+
+    user = db.relationship('Users', backref=db.backref('saved_searches', lazy='dynamic'))
+
+    @property
+    def user_id(self):
+        return USER_ID_DELIMITER.join((self.user_guid, self.auth_user_type))
+
+    @property
+    def es_query(self):
+        """
+        Percolator query of this search: the agency user query of
+        RequestsDSLGenerator over open requests (new requests are always open).
+        """
+        from app.search.utils import RequestsDSLGenerator  # circular import (search.utils needs models)
+        dsl_gen = RequestsDSLGenerator(self.query_string,
+                                       self.query_fields,
+                                       [request_status.OPEN],
+                                       [],
+                                       self.agency_ein,
+                                       'match_phrase' if self.by_phrase else 'match',
+                                       stored_statuses=True)
+        dsl = dsl_gen.agency_user() if self.query_string else dsl_gen.queryless()
+        return dsl['query']
+
+    @property
+    def val_for_json(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'query': self.query_string,
+            'query_fields': self.query_fields,
+            'agency_ein': self.agency_ein,
+            'by_phrase': self.by_phrase,
+            'date_created': self.date_created.strftime(ES_DATETIME_FORMAT),
+        }
+
+    def es_create(self, index=None):
+        """
+        Index this search as a percolator query.
+
+        :param index: name of the index; defaults to ELASTICSEARCH_INDEX
+        """
+        es.index(
+            index=index or current_app.config["ELASTICSEARCH_INDEX"],
+            doc_type='saved_search',
+            id=self.id,
+            body={
+                'query': self.es_query,
+                'user_id': self.user_id,
+            },
+        )
+
+    def es_delete(self):
+        es.delete(
+            index=current_app.config["ELASTICSEARCH_INDEX"],
+            doc_type='saved_search',
+            id=self.id,
+            ignore=404,
+        )
+
+    def __repr__(self):
+        return '<SavedSearches %r>' % self.id
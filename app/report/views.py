@@ -5,6 +5,7 @@
 """
 from app.report import report
 from flask import (
+    current_app,
     render_template,
     jsonify,
     request
@@ -20,6 +21,7 @@ from app.constants import (
     user_type_auth
 )
 from app.report.forms import ReportFilterForm
+from app.search.utils import count_requests
 
 
 @report.route('/show', methods=['GET'])
@@ -52,7 +54,12 @@ def get():
     is_visible = False
     results = False
     if agency_ein:
-        if agency_ein == 'all':
+        if current_app.config['ELASTICSEARCH_ENABLED']:
+            # a single count-only search (request docs only exist for active agencies)
+            status_counts = count_requests(agency_ein if agency_ein != 'all' else None)['statuses']
+            requests_closed = status_counts.get(request_status.CLOSED, 0)
+            requests_opened = sum(status_counts.values()) - requests_closed
+        elif agency_ein == 'all':
             active_requests = Requests.query.with_entities(Requests.status).join(
                 Agencies, Requests.agency_ein == Agencies.ein).filter(
                 Agencies.is_active).all()
@@ -64,6 +71,7 @@ def get():
                 Agencies.ein == agency_ein, Agencies.is_active).all()
             requests_closed = len([r for r in active_requests if r[0] == request_status.CLOSED])
             requests_opened = len(active_requests) - requests_closed
+        if agency_ein != 'all':
             if not (current_user.is_anonymous or current_user.is_public):
                 if (current_user.is_agency and current_user.is_agency_admin(agency_ein)) or current_user.is_super:
                     is_visible = True
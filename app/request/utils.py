@@ -251,13 +251,9 @@ def create_request(title,
         timestamp=datetime.utcnow()
     ))
 
-    # 11. Create the elasticsearch request doc only if agency has been onboarded
+    # 11. Get the agency of the request
     agency = Agencies.query.filter_by(ein=agency_ein).one()
 
-    # (Now that we can associate the request with its requester.)
-    if current_app.config['ELASTICSEARCH_ENABLED'] and agency.is_active:
-        request.es_create()
-
     # 12. Add all agency administrators to the request.
     if agency.administrators:
         # b. Store all agency users objects in the UserRequests table as Agency users with Agency Administrator
@@ -279,6 +275,11 @@ def create_request(title,
                                          agency_admins=agency.parent.administrators,
                                          guid_for_event=guid_for_event,
                                          auth_type_for_event=auth_type_for_event)
+
+    # 14. Create the elasticsearch request doc only if agency has been onboarded
+    # (Now that we can associate the request with its requester and assigned agency users.)
+    if current_app.config['ELASTICSEARCH_ENABLED'] and agency.is_active:
+        request.es_create()
     return request_id
 
 
@@ -503,7 +504,8 @@ def _create_agency_user_requests(request_id, agency_admins, guid_for_event, auth
                                     request_id=request_id,
                                     permissions=Roles.query.filter_by(
                                         name=role.AGENCY_ADMIN).first().permissions)
-        create_object(user_request)
+        # the request doc is created once all agency users are added
+        create_object(user_request, es_create=False)
         create_object(Events(
             request_id,
             guid_for_event,
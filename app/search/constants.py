@@ -13,3 +13,121 @@ MOCK_EMPTY_ELASTICSEARCH_RESULT = {
 ALL_RESULTS_CHUNKSIZE = 100
 
 MAX_RESULT_SIZE = 50
+
+# Requester contact information and assigned user emails.
+# Stored in request docs but not indexed; returned to agency users only.
+AGENCY_ONLY_FIELDS = [
+    'requester_email',
+    'requester_title',
+    'requester_organization',
+    'requester_phone_number',
+    'requester_fax_number',
+    'requester_mailing_address',
+    'assigned_user_emails',
+]
+
+# Fields of request docs returned to non-agency users (whatever the source profile);
+# text that may be private and fields identifying requesters are returned to agency users only
+PUBLIC_SOURCE_FIELDS = [
+    'date_submitted',
+    'date_due',
+    'date_received',
+    'date_created',
+    'date_closed',
+    'status',
+    'agency_ein',
+    'agency_name',
+    'agency_acronym',
+    'title_private',
+    'agency_request_summary_private',
+    'public_title',
+    'public_agency_request_summary',
+]
+
+# Redis key (search_redis) of the datetime of the last successful doc sync
+SYNC_WATERMARK_KEY = 'es_sync_watermark'
+SYNC_WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# Redis keys (search_redis) of the request doc update queue
+DIRTY_REQUESTS_KEY = 'es_dirty_requests'
+FLUSH_SCHEDULED_KEY = 'es_flush_scheduled'
+
+# Redis key (search_redis) of whether the docs of the aliased index are routed by agency
+INDEX_ROUTED_KEY = 'es_index_routed'
+
+# Redis key (search_redis) set while a delayed search cache invalidation is scheduled
+GENERATION_BUMP_SCHEDULED_KEY = 'search_generation_bump_scheduled'
+
+# Maximum number of agency buckets returned by request count aggregations
+AGGREGATION_AGENCIES_SIZE = 500
+
+# Title suggestions (search-as-you-type)
+SUGGEST_MIN_QUERY_LENGTH = 2
+SUGGEST_SIZE = 10
+
+# FOIL ID searches (the "FOIL-" prefix is stripped from queries)
+FOIL_ID_REGEX = r'^\d{4}-\d{3}-\d{5}$'
+FOIL_ID_MIN_GRAM = 3
+FOIL_ID_MAX_GRAM = 14  # length of a complete FOIL ID without "FOIL-"
+
+# _source fields of request docs returned for each use of search results (see search_requests;
+# non-agency users only get PUBLIC_SOURCE_FIELDS)
+SOURCE_PROFILES = {
+    # request/result_row.html (descriptions are replaced by snippets, see SNIPPET_SIZE)
+    'listing': [
+        'date_received',
+        'date_due',
+        'date_closed',
+        'status',
+        'agency_name',
+        'agency_acronym',
+        'requester_name',
+        'title',
+        'public_title',
+    ],
+    # search results CSV (agency users also get AGENCY_ONLY_FIELDS)
+    'csv': [
+        'date_submitted',
+        'date_due',
+        'date_received',
+        'date_created',
+        'date_closed',
+        'status',
+        'agency_name',
+        'requester_name',
+        'title',
+        'agency_request_summary',
+        'description',
+    ],
+    # every field but AGENCY_ONLY_FIELDS
+    'api': [
+        'requester_id',
+        'date_submitted',
+        'date_due',
+        'date_received',
+        'date_created',
+        'date_closed',
+        'status',
+        'agency_ein',
+        'agency_name',
+        'agency_acronym',
+        'requester_name',
+        'title_private',
+        'agency_request_summary_private',
+        'public_title',
+        'public_agency_request_summary',
+        'title',
+        'agency_request_summary',
+        'description',
+    ],
+}
+
+# Maximum length of the description snippets of listed requests
+SNIPPET_SIZE = 150
+
+# Redis keys (search_redis) of new request matches of saved searches, pending a digest email
+SAVED_SEARCH_MATCHES_KEY = 'saved_search_matches:{}'  # request ids matched by a saved search
+SAVED_SEARCHES_MATCHED_KEY = 'saved_searches_matched'  # ids of saved searches with matches
+
+SAVED_SEARCH_DIGEST_SUBJECT = "New Requests Matching Your Saved Searches"
+SAVED_SEARCH_DIGEST_TEMPLATE = "email_templates/email_saved_search_digest"
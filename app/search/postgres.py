@@ -0,0 +1,369 @@
+"""
+.. module:: search.postgres
+
+   :synopsis: Postgres full-text search backend for request searches
+
+An alternative to elasticsearch for deployments without a cluster
+(SEARCH_BACKEND = "postgres"). Requests are searched directly with
+full-text search over expression GIN indexes on the title, description
+and agency request summary, and FOIL IDs with a trigram index on the
+request id (see migration 7c2d9e4b1a3f, which skips the trigram index
+if the pg_trgm extension cannot be created). Results are returned in the
+same format as elasticsearch results, built from the same docs
+(see app.search.utils.request_doc).
+
+The privacy rules are those of RequestsDSLGenerator.
+"""
+import re
+from datetime import datetime
+from html import escape
+from itertools import islice
+
+from flask_login import current_user
+from sqlalchemy import and_, or_, case, false, func, literal_column
+
+from app import db
+from app.constants import (
+    determination_type,
+    request_status,
+    user_type_request,
+)
+from app.lib.utils import InvalidUserException
+from app.models import (
+    Agencies,
+    Determinations,
+    Requests,
+    UserRequests,
+    Users,
+)
+from app.search.constants import (
+    ALL_RESULTS_CHUNKSIZE,
+    DT_DATE_RANGE_FORMAT,
+    FOIL_ID_REGEX,
+    FOIL_ID_MIN_GRAM,
+    SNIPPET_SIZE,
+    SUGGEST_MIN_QUERY_LENGTH,
+    SUGGEST_SIZE,
+)
+from app.search.utils import (
+    get_due_date_bounds,
+    get_snippet_field,
+    request_docs,
+)
+
+# text search configurations (literals, so queries match the index expressions)
+ENGLISH = literal_column("'english'::regconfig")
+SIMPLE = literal_column("'simple'::regconfig")
+
+
+def tsvector(column, config=ENGLISH):
+    """
+    Return the text search vector of a column, as indexed.
+    """
+    return func.to_tsvector(config, func.coalesce(column, ''))
+
+
+def tsquery(query, match_type='match', config=ENGLISH, prefix=False):
+    """
+    Return a text search query for a query string, or None if it has no words.
+
+    Like elasticsearch 'match' queries, documents matching any word match.
+    'match_phrase' queries match documents with all words (phrase queries
+    are not available on Postgres 9.5).
+
+    :param query: query string
+    :param match_type: 'match' or 'match_phrase'
+    :param config: text search configuration
+    :param prefix: match words starting with the query words?
+    """
+    words = re.findall(r'[^\W_]+', query or '')
+    if not words:
+        return None
+    operator = ' | ' if match_type == 'match' else ' & '
+    return func.to_tsquery(config, operator.join(
+        "{}{}".format(word, ':*' if prefix else '') for word in words))
+
+
+def _title_public():
+    return Requests.privacy['title'].astext == 'false'
+
+
+def _agency_request_summary_released():
+    # see Requests.agency_request_summary_released
+    return and_(
+        Requests.status == request_status.CLOSED,
+        Requests.privacy['agency_request_summary'].astext == 'false',
+        func.coalesce(Requests.agency_request_summary, '') != '',
+        Requests.agency_request_summary_release_date < datetime.utcnow()
+    )
+
+
+def _requester_is(user):
+    return db.session.query(UserRequests).filter(
+        UserRequests.request_id == Requests.id,
+        UserRequests.request_user_type == user_type_request.REQUESTER,
+        UserRequests.user_guid == user.guid,
+        UserRequests.auth_user_type == user.auth_user_type
+    ).exists()
+
+
+def _requester_name_matches(tsq):
+    return db.session.query(UserRequests).join(
+        Users, and_(Users.guid == UserRequests.user_guid,
+                    Users.auth_user_type == UserRequests.auth_user_type)
+    ).filter(
+        UserRequests.request_id == Requests.id,
+        UserRequests.request_user_type == user_type_request.REQUESTER,
+        tsvector(Users.first_name + ' ' + Users.last_name, SIMPLE).op('@@')(tsq)
+    ).exists()
+
+
+def _date_closed():
+    # see Requests.date_closed
+    return db.session.query(
+        func.max(Determinations.date_modified)
+    ).filter(
+        Determinations.request_id == Requests.id,
+        Determinations.dtype.in_([determination_type.CLOSING, determination_type.DENIAL])
+    ).correlate(Requests).as_scalar()
+
+
+def _date_received():
+    return func.least(Requests.date_created, Requests.date_submitted)
+
+
+def _foil_id_condition(query):
+    """
+    Same matching as RequestsDSLGenerator.foil_id.
+    """
+    if re.match(FOIL_ID_REGEX, query):
+        return Requests.id == 'FOIL-{}'.format(query)
+    query = re.sub(r'[%_\\]', '', query)
+    if len(query) < FOIL_ID_MIN_GRAM:
+        return Requests.id.like('FOIL-{}%'.format(query))
+    return Requests.id.ilike('%{}%'.format(query))  # trigram index
+
+
+def _query_conditions(query, query_fields, match_type):
+    """
+    Return the full-text conditions (any of which must match) and rank
+    expressions of a query, following the privacy rules of RequestsDSLGenerator.
+    """
+    tsq = tsquery(query, match_type)
+    if tsq is None:
+        return [], []
+    fields = {
+        'title': Requests.title,
+        'description': Requests.description,
+        'agency_request_summary': Requests.agency_request_summary,
+    }
+
+    def matches(name):
+        return tsvector(fields[name]).op('@@')(tsq)
+
+    conditions = []
+    ranked = []
+    if current_user.is_agency:
+        for name, use in query_fields.items():
+            if use:
+                conditions.append(
+                    _requester_name_matches(tsquery(query, match_type, SIMPLE))
+                    if name == 'requester_name' else matches(name))
+                if name != 'requester_name':
+                    ranked.append(name)
+    elif current_user.is_anonymous or current_user.is_public:
+        if query_fields['title']:
+            conditions.append(and_(matches('title'), _title_public()))
+            ranked.append('title')
+        if query_fields['agency_request_summary']:
+            conditions.append(and_(matches('agency_request_summary'), _agency_request_summary_released()))
+            ranked.append('agency_request_summary')
+        if current_user.is_public:
+            if query_fields['title']:
+                conditions.append(and_(matches('title'), _requester_is(current_user)))
+            if query_fields['description']:
+                conditions.append(and_(matches('description'), _requester_is(current_user)))
+                ranked.append('description')
+    else:
+        raise InvalidUserException(current_user)
+    return conditions, [func.ts_rank(tsvector(fields[name]), tsq) for name in ranked]
+
+
+def _date_range_conditions(date_ranges):
+    """
+    Return the conditions of elasticsearch date range filters (see search_requests).
+    """
+    columns = {
+        'date_received': _date_received(),
+        'date_due': Requests.due_date,
+        'date_closed': _date_closed(),
+    }
+    operators = {
+        'gte': lambda column, value: column >= value,
+        'lt': lambda column, value: column < value,
+        'lte': lambda column, value: column <= value,
+    }
+    conditions = []
+    for date_range in date_ranges:
+        for field, bounds in date_range['range'].items():
+            if field == 'date_closed':
+                conditions.append(Requests.status == request_status.CLOSED)
+            for op, value in bounds.items():
+                if op in operators:
+                    conditions.append(operators[op](
+                        columns[field], datetime.strptime(value, DT_DATE_RANGE_FORMAT)))
+    return conditions
+
+
+def _order_by(sort, ranks):
+    columns = {
+        'date_received': _date_received(),
+        'date_due': Requests.due_date,
+        'title.keyword': Requests.title,
+    }
+    order_by = []
+    for field_direction in sort:
+        field, direction = field_direction.split(':')
+        order_by.append(getattr(columns[field], direction)())
+    if not order_by and ranks:
+        order_by.append(sum(ranks[1:], ranks[0]).desc())
+    order_by.append(Requests.id.asc())
+    return order_by
+
+
+def _hits(request_ids, source, snippets):
+    """
+    Return elasticsearch-like hits of requests.
+    """
+    snippet_field = get_snippet_field() if snippets else None
+    hits = []
+    for request_id, doc in request_docs(request_ids):
+        hit = {
+            '_id': request_id,
+            '_source': {field: doc.get(field) for field in source},
+        }
+        if snippet_field and doc.get(snippet_field):
+            hit['highlight'] = {snippet_field: [escape(doc[snippet_field][:SNIPPET_SIZE])]}
+        hits.append(hit)
+    return hits
+
+
+def _aggregations(ids_query):
+    """
+    Return request counts in the format of elasticsearch aggregations (see get_aggregations_dsl).
+    """
+    request_ids = ids_query.subquery()
+    query = db.session.query(Requests).join(request_ids, Requests.id == request_ids.c.id)
+    status = Requests.current_status_expression()
+    aggregations = {
+        'statuses': {'buckets': [
+            {'key': key, 'doc_count': count} for key, count in
+            query.with_entities(status, func.count()).group_by(status)
+        ]},
+        'agencies': {'buckets': [
+            {'key': key, 'doc_count': count} for key, count in
+            query.with_entities(Requests.agency_ein, func.count()).group_by(Requests.agency_ein)
+        ]},
+    }
+    if current_user.is_agency:
+        today, due_later_date = get_due_date_bounds()
+        total, overdue, due_soon, due_later = query.with_entities(
+            func.count(),
+            func.count(case([(Requests.due_date < today, 1)])),
+            func.count(case([(and_(Requests.due_date >= today, Requests.due_date < due_later_date), 1)])),
+            func.count(case([(Requests.due_date >= due_later_date, 1)])),
+        ).filter(Requests.status != request_status.CLOSED).one()
+        aggregations['due_dates'] = {
+            'doc_count': total,
+            'buckets': {'buckets': {
+                'overdue': {'doc_count': overdue},
+                'due_soon': {'doc_count': due_soon},
+                'due_later': {'doc_count': due_later},
+            }}
+        }
+    return aggregations
+
+
+def search_requests(query,
+                    foil_id,
+                    query_fields,
+                    statuses,
+                    date_ranges,
+                    agency_ein,
+                    match_type,
+                    sort,
+                    source,
+                    snippets,
+                    size,
+                    start,
+                    highlight,
+                    for_csv,
+                    stream,
+                    aggregations,
+                    cursor):
+    """
+    Postgres search backend (see app.search.utils.search_requests and _search_elasticsearch).
+
+    Highlights (other than snippets) and cursors are not supported;
+    pages are always fetched by offset and no cursor is returned.
+    """
+    conditions = [
+        Agencies.is_active == True,
+        Requests.current_status_expression().in_(statuses),
+    ] + _date_range_conditions(date_ranges)
+    if agency_ein:
+        conditions.append(Requests.agency_ein == agency_ein)
+
+    ranks = []
+    if foil_id:
+        conditions.append(_foil_id_condition(query))
+    elif query:
+        query_conditions, ranks = _query_conditions(query, query_fields, match_type)
+        conditions.append(or_(*query_conditions) if query_conditions else false())
+
+    ids_query = db.session.query(Requests.id).join(
+        Agencies, Requests.agency_ein == Agencies.ein
+    ).filter(*conditions)
+    order_by = _order_by(sort, ranks)
+
+    if stream:
+        def stream_hits():
+            request_ids = (request_id for request_id, in
+                           ids_query.order_by(*order_by).yield_per(ALL_RESULTS_CHUNKSIZE))
+            while True:
+                batch = list(islice(request_ids, ALL_RESULTS_CHUNKSIZE))
+                if not batch:
+                    break
+                yield from _hits(batch, source, False)
+        return stream_hits()
+
+    request_ids = [request_id for request_id, in ids_query.order_by(*order_by).offset(start).limit(size)]
+    results = {
+        'hits': {
+            'total': ids_query.count(),
+            'hits': _hits(request_ids, source, snippets),
+        },
+        'cursor': None,
+    }
+    if aggregations:
+        results['aggregations'] = _aggregations(ids_query)
+    return results
+
+
+def suggest_titles(query, size=SUGGEST_SIZE):
+    """
+    Postgres version of app.search.utils.suggest_titles (word prefix matching).
+    """
+    tsq = tsquery(query, 'match_phrase', prefix=True)
+    if tsq is None or len(query.strip()) < SUGGEST_MIN_QUERY_LENGTH:
+        return []
+    suggestions = db.session.query(Requests.id, Requests.title).join(
+        Agencies, Requests.agency_ein == Agencies.ein
+    ).filter(
+        Agencies.is_active == True,
+        tsvector(Requests.title).op('@@')(tsq)
+    )
+    if not current_user.is_agency:
+        suggestions = suggestions.filter(_title_public())
+    return [{'id': request_id, 'title': title}
+            for request_id, title in suggestions.order_by(Requests.id.desc()).limit(size)]
@@ -1,32 +1,159 @@
-from datetime import datetime
+import json
+import re
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime, timedelta
+from hashlib import sha1
+from itertools import islice
 
 from flask import current_app
 from flask_login import current_user
-from elasticsearch.helpers import bulk
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch.helpers import bulk, scan, parallel_bulk, streaming_bulk
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload, subqueryload
 
-from app import es
-from app.models import Requests
+from app import celery, db, es, search_redis
+from app.models import (
+    Agencies,
+    Determinations,
+    Requests,
+    Responses,
+    SavedSearches,
+    UserRequests,
+    Users,
+)
 from app.constants import (
     ES_DATETIME_FORMAT,
+    determination_type,
     request_status
 )
 from app.search.constants import (
     MAX_RESULT_SIZE,
+    ALL_RESULTS_CHUNKSIZE,
+    AGENCY_ONLY_FIELDS,
+    PUBLIC_SOURCE_FIELDS,
+    SOURCE_PROFILES,
+    SNIPPET_SIZE,
     ES_DATE_RANGE_FORMAT,
     DT_DATE_RANGE_FORMAT,
-    MOCK_EMPTY_ELASTICSEARCH_RESULT
+    MOCK_EMPTY_ELASTICSEARCH_RESULT,
+    AGGREGATION_AGENCIES_SIZE,
+    SUGGEST_MIN_QUERY_LENGTH,
+    FOIL_ID_REGEX,
+    FOIL_ID_MIN_GRAM,
+    FOIL_ID_MAX_GRAM,
+    SUGGEST_SIZE,
+    SYNC_WATERMARK_KEY,
+    SYNC_WATERMARK_FORMAT,
+    DIRTY_REQUESTS_KEY,
+    FLUSH_SCHEDULED_KEY,
+    GENERATION_BUMP_SCHEDULED_KEY,
+    INDEX_ROUTED_KEY,
+    SAVED_SEARCH_MATCHES_KEY,
+    SAVED_SEARCHES_MATCHED_KEY,
+    SAVED_SEARCH_DIGEST_SUBJECT,
+    SAVED_SEARCH_DIGEST_TEMPLATE,
 )
 from app.lib.utils import InvalidUserException
-from app.lib.date_utils import utc_to_local, local_to_utc
+from app.lib.email_utils import send_email
+from app.lib.redis_utils import (
+    redis_bump_search_generation,
+    redis_get_search_generation,
+    redis_get_search_results,
+    redis_set_search_results,
+)
+from app.lib.date_utils import get_due_date_bounds, utc_to_local, local_to_utc
 
 
 def recreate():
     """
-    Recreate elasticsearch indices and request docs.
+    Recreate elasticsearch indices and request docs without downtime.
+
+    A new versioned index is created with refreshes and replicas disabled,
+    loaded with request docs and, once its doc count has been verified,
+    atomically swapped in as the ELASTICSEARCH_INDEX alias. Changes made
+    while the new index was being loaded are then synced and the
+    previously aliased indices are deleted.
+
+    If verification fails, the new index is deleted and the alias is left
+    untouched.
     """
-    delete_index()
-    create_index()
-    create_docs()
+    alias = current_app.config["ELASTICSEARCH_INDEX"]
+    started = datetime.utcnow()
+
+    index = create_index(bulk_load=True)
+    try:
+        create_docs(index)
+        create_saved_search_docs(index)
+        es.indices.put_settings(
+            index=index,
+            body={
+                "index": {
+                    "refresh_interval": current_app.config["ELASTICSEARCH_REFRESH_INTERVAL"],
+                    "number_of_replicas": current_app.config["ELASTICSEARCH_NUMBER_OF_REPLICAS"],
+                }
+            }
+        )
+        es.indices.refresh(index=index)
+        _verify_index(index, started)
+    except Exception:
+        es.indices.delete(index, ignore=[400, 404])
+        raise
+
+    old_indices = get_aliased_indices()
+    if not old_indices and es.indices.exists(alias):
+        # an unversioned index is in the way of the alias
+        current_app.logger.warning("Deleting unversioned index '{}' to create alias.".format(alias))
+        es.indices.delete(alias)
+    es.indices.update_aliases(
+        body={
+            "actions": [{"remove": {"index": old_index, "alias": alias}} for old_index in old_indices] +
+                       [{"add": {"index": index, "alias": alias}}]
+        }
+    )
+    set_index_routed(current_app.config["ELASTICSEARCH_ROUTE_BY_AGENCY"])
+    redis_bump_search_generation()
+    current_app.logger.info("Alias '{}' now points to '{}'.".format(alias, index))
+
+    # catch up on changes made while the new index was being loaded
+    update_docs(since=started)
+    create_saved_search_docs(index, since=started)
+
+    for old_index in old_indices:
+        es.indices.delete(old_index, ignore=[400, 404])
+
+
+def _verify_index(index, started):
+    """
+    Check that an index contains a doc for every request of an active agency
+    created before the index started being loaded.
+
+    Requests created since then may or may not have been loaded (they are
+    synced once the index is aliased, see recreate) and are not counted.
+
+    :param index: name of the index to verify
+    :param started: (utc) datetime the index started being loaded
+    :raises ValueError: if the doc count does not match
+    """
+    # docs are dated to the second
+    cutoff = started.replace(microsecond=0)
+    expected = Requests.query.join(
+        Agencies, Requests.agency_ein == Agencies.ein
+    ).filter(
+        Agencies.is_active == True,
+        Requests.date_created < cutoff
+    ).count()
+    actual = es.count(
+        index=index,
+        doc_type='request',
+        body={
+            'query': {
+                'range': {'date_created': {'lt': cutoff.strftime(ES_DATETIME_FORMAT)}}
+            }
+        }
+    )['count']
+    if actual != expected:
+        raise ValueError("Index '{}' has {} request docs, expected {}.".format(index, actual, expected))
 
 
 def index_exists():
@@ -36,14 +163,28 @@ def index_exists():
     return es.indices.exists(current_app.config["ELASTICSEARCH_INDEX"])
 
 
+def get_aliased_indices():
+    """
+    Return the names of the indices the ELASTICSEARCH_INDEX alias points to.
+    """
+    alias = current_app.config["ELASTICSEARCH_INDEX"]
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return list(es.indices.get_alias(name=alias).keys())
+
+
 def delete_index():
     """
     Delete all elasticsearch indices, ignoring errors.
+    This includes every index behind the ELASTICSEARCH_INDEX alias.
     """
+    for index in get_aliased_indices():
+        es.indices.delete(index, ignore=[400, 404])
     es.indices.delete(
         current_app.config["ELASTICSEARCH_INDEX"],
         ignore=[400, 404]
     )
+    set_index_routed(None)
 
 
 def delete_docs():
@@ -61,18 +202,102 @@ def delete_docs():
         wait_for_completion=True,
         refresh=True,
     )
+    redis_bump_search_generation()
 
 
-def create_index():
+def create_index(bulk_load=False):
     """
-    Create elasticsearch index with mappings for request docs.
+    Create a versioned elasticsearch index with mappings for request docs.
+
+    The index is named after ELASTICSEARCH_INDEX followed by a timestamp.
+    ELASTICSEARCH_INDEX is added as its alias unless it is created for a
+    bulk load, in which case refreshes and replicas are disabled and the
+    alias is left to the caller (see recreate).
+
+    :param bulk_load: create the index for an initial bulk load of docs
+    :return: name of the created index
     """
+    alias = current_app.config["ELASTICSEARCH_INDEX"]
+    index = "{}_{}".format(alias, datetime.utcnow().strftime("%Y%m%d%H%M%S%f"))
     es.indices.create(
-        index=current_app.config["ELASTICSEARCH_INDEX"],
+        index=index,
         body={
+            "settings": {
+                "index": {
+                    "refresh_interval": ("-1" if bulk_load
+                                         else current_app.config["ELASTICSEARCH_REFRESH_INTERVAL"]),
+                    "number_of_replicas": (0 if bulk_load
+                                           else current_app.config["ELASTICSEARCH_NUMBER_OF_REPLICAS"]),
+                    "number_of_shards": current_app.config["ELASTICSEARCH_NUMBER_OF_SHARDS"],
+                },
+                "analysis": {
+                    "char_filter": {
+                        "foil_id_prefix": {
+                            "type": "pattern_replace",
+                            "pattern": "(?i)^FOIL-",
+                            "replacement": "",
+                        }
+                    },
+                    "filter": {
+                        "autocomplete_filter": {
+                            "type": "edge_ngram",
+                            "min_gram": SUGGEST_MIN_QUERY_LENGTH,
+                            "max_gram": 20,
+                        },
+                        "foil_id_ngram_filter": {
+                            "type": "ngram",
+                            "min_gram": FOIL_ID_MIN_GRAM,
+                            "max_gram": FOIL_ID_MAX_GRAM,
+                        }
+                    },
+                    "analyzer": {
+                        # indexes every substring of a FOIL ID, e.g. "2017-002-00123" as
+                        # "201", "017", ..., "2017-002-00123"
+                        "foil_id_ngram": {
+                            "type": "custom",
+                            "char_filter": ["foil_id_prefix"],
+                            "tokenizer": "keyword",
+                            "filter": ["lowercase", "foil_id_ngram_filter"],
+                        },
+                        "foil_id_search": {
+                            "type": "custom",
+                            "char_filter": ["foil_id_prefix"],
+                            "tokenizer": "keyword",
+                            "filter": ["lowercase"],
+                        },
+                        # indexes the prefixes of every word, e.g. "records" as "re", "rec", ...
+                        "autocomplete": {
+                            "type": "custom",
+                            "tokenizer": "standard",
+                            "filter": ["lowercase", "asciifolding", "autocomplete_filter"],
+                        },
+                        "autocomplete_search": {
+                            "type": "custom",
+                            "tokenizer": "standard",
+                            "filter": ["lowercase", "asciifolding"],
+                        }
+                    }
+                }
+            },
+            "aliases": {} if bulk_load else {alias: {}},
             "mappings": {
                 "request": {
+                    # docs are routed by agency ein (see get_routing and is_index_routed)
+                    "_routing": {
+                        "required": current_app.config["ELASTICSEARCH_ROUTE_BY_AGENCY"]
+                    },
                     "properties": {
+                        # the request id ("FOIL-YYYY-XXX-XXXXX"), for partial FOIL ID searches
+                        "foil_id": {
+                            "type": "keyword",
+                            "fields": {
+                                "ngram": {
+                                    "type": "text",
+                                    "analyzer": "foil_id_ngram",
+                                    "search_analyzer": "foil_id_search",
+                                }
+                            }
+                        },
                         "title": {
                             "type": "text",
                             "analyzer": "english",
@@ -80,9 +305,30 @@ def create_index():
                                 # for sorting by title
                                 "keyword": {
                                     "type": "keyword",
+                                },
+                                # for search-as-you-type (see suggest_titles)
+                                "autocomplete": {
+                                    "type": "text",
+                                    "analyzer": "autocomplete",
+                                    "search_analyzer": "autocomplete_search",
+                                }
+                            }
+                        },
+                        "public_title": {
+                            "type": "text",
+                            "analyzer": "english",
+                            "fields": {
+                                "autocomplete": {
+                                    "type": "text",
+                                    "analyzer": "autocomplete",
+                                    "search_analyzer": "autocomplete_search",
                                 }
                             }
                         },
+                        "public_agency_request_summary": {
+                            "type": "text",
+                            "analyzer": "english"
+                        },
                         "description": {
                             "type": "text",
                             "analyzer": "english"
@@ -131,71 +377,693 @@ def create_index():
                         "date_closed": {
                             "type": "date",
                             "format": "strict_date_hour_minute_second",
+                        },
+                        # agency-only fields (not searchable)
+                        "requester_email": {
+                            "type": "keyword",
+                            "index": False,
+                        },
+                        "requester_title": {
+                            "type": "keyword",
+                            "index": False,
+                        },
+                        "requester_organization": {
+                            "type": "keyword",
+                            "index": False,
+                        },
+                        "requester_phone_number": {
+                            "type": "keyword",
+                            "index": False,
+                        },
+                        "requester_fax_number": {
+                            "type": "keyword",
+                            "index": False,
+                        },
+                        "requester_mailing_address": {
+                            "type": "object",
+                            "enabled": False,
+                        },
+                        "assigned_user_emails": {
+                            "type": "keyword",
+                            "index": False,
+                        }
+                    }
+                },
+                # saved searches, matched against new request docs (see percolate_request)
+                "saved_search": {
+                    "properties": {
+                        "query": {
+                            "type": "percolator",
+                        },
+                        "user_id": {
+                            "type": "keyword",
                         }
                     }
                 }
             }
         }
     )
+    if not bulk_load:
+        set_index_routed(current_app.config["ELASTICSEARCH_ROUTE_BY_AGENCY"])
+    return index
 
 
-def create_docs():
+def create_docs(index=None):
     """
     Create elasticsearch request docs for every request db record.
+
+    Request ids are streamed from the database and docs are built in
+    batches of ELASTICSEARCH_SYNC_CHUNKSIZE (see request_docs) as they
+    are consumed by streaming_bulk, so memory usage stays constant and
+    the number of queries is proportional to the number of batches.
+
+    :param index: name of the index to create docs in; defaults to ELASTICSEARCH_INDEX
     """
-    #: :type: collections.Iterable[app.models.Requests]
-    requests = Requests.query.all()
-
-    operations = []
-    for r in requests:
-        if r.agency.is_active:
-            date_received = r.date_created.strftime(
-                ES_DATETIME_FORMAT) if r.date_created < r.date_submitted else r.date_submitted.strftime(
-                ES_DATETIME_FORMAT)
-            operation = {
-                '_op_type': 'create',
-                '_id': r.id,
-                'title': r.title,
-                'description': r.description,
-                'agency_request_summary': r.agency_request_summary,
-                'requester_name': r.requester.name,
-                'title_private': r.privacy['title'],
-                'agency_request_summary_private': not r.agency_request_summary_released,
-                'date_created': r.date_created.strftime(ES_DATETIME_FORMAT),
-                'date_submitted': r.date_submitted.strftime(ES_DATETIME_FORMAT),
-                'date_received': date_received,
-                'date_due': r.due_date.strftime(ES_DATETIME_FORMAT),
-                'submission': r.submission,
-                'status': r.status,
-                'requester_id': r.requester.get_id(),
-                'agency_ein': r.agency_ein,
-                'agency_acronym': r.agency.acronym,
-                'agency_name': r.agency.name,
-                'public_title': 'Private' if r.privacy['title'] else r.title,
-                # public_agency_request_summary
-            }
+    chunk_size = current_app.config['ELASTICSEARCH_SYNC_CHUNKSIZE']
+    # new indices are routed as configured (see create_index)
+    routed = current_app.config['ELASTICSEARCH_ROUTE_BY_AGENCY'] if index is not None else is_index_routed()
+    num_success = 0
+    for ok, _ in streaming_bulk(
+            es,
+            _create_doc_actions(chunk_size, routed),
+            index=index or current_app.config["ELASTICSEARCH_INDEX"],
+            doc_type='request',
+            chunk_size=ALL_RESULTS_CHUNKSIZE,
+            raise_on_error=True):
+        num_success += ok
+    if index is None:
+        # cached results are invalidated once the docs are visible to searches
+        # (new indices are only searched once aliased, see recreate)
+        es.indices.refresh(index=current_app.config["ELASTICSEARCH_INDEX"])
+        redis_bump_search_generation()
+    current_app.logger.info("Successfully created {} docs.".format(num_success))
 
-            if r.date_closed is not None:
-                operation['date_closed'] = r.date_closed.strftime(ES_DATETIME_FORMAT)
 
-            operations.append(operation)
+def _create_doc_actions(chunk_size, routed):
+    """
+    Generate bulk 'create' actions for the docs of every request of an active agency.
 
+    :param chunk_size: number of docs to build at a time
+    :param routed: route docs by agency?
+    """
+    request_ids = (request_id for request_id, in _changed_request_ids_query().yield_per(chunk_size))
+    while True:
+        batch = list(islice(request_ids, chunk_size))
+        if not batch:
+            break
+        for request_id, doc in request_docs(batch):
+            yield _doc_action('create', request_id, doc, routed, _source=doc)
+
+
+def create_saved_search_docs(index=None, since=None):
+    """
+    Create elasticsearch percolator docs for saved searches.
+
+    :param index: name of the index to create docs in; defaults to ELASTICSEARCH_INDEX
+    :param since: only create docs for searches saved since this datetime
+    """
+    saved_searches = SavedSearches.query
+    if since is not None:
+        saved_searches = saved_searches.filter(SavedSearches.date_created >= since)
     num_success, _ = bulk(
         es,
-        operations,
+        ({
+            '_op_type': 'index',
+            '_id': saved_search.id,
+            '_source': {
+                'query': saved_search.es_query,
+                'user_id': saved_search.user_id,
+            },
+        } for saved_search in saved_searches.yield_per(ALL_RESULTS_CHUNKSIZE)),
+        index=index or current_app.config["ELASTICSEARCH_INDEX"],
+        doc_type='saved_search',
+        chunk_size=ALL_RESULTS_CHUNKSIZE,
+        raise_on_error=True
+    )
+    current_app.logger.info("Successfully created {} saved search docs.".format(num_success))
+
+
+def _doc_action(op_type, request_id, doc, routed, **action):
+    """
+    Return a bulk action for a request doc, routed by agency if necessary (see get_routing).
+
+    :param op_type: bulk operation type
+    :param request_id: id of the request
+    :param doc: request doc (see request_doc)
+    :param routed: route docs by agency (see is_index_routed)?
+    :param action: additional action fields
+    """
+    action.update({
+        '_op_type': op_type,
+        '_id': request_id,
+    })
+    routing = get_routing(doc['agency_ein'], routed)
+    if routing is not None:
+        action['_routing'] = routing
+    return action
+
+
+def get_routing(agency_ein, routed=None):
+    """
+    Return the routing value of the request docs of an agency,
+    or None if docs are not routed.
+
+    :param agency_ein: agency ein
+    :param routed: are docs routed by agency? defaults to whether
+        those of the aliased index are (see is_index_routed)
+    """
+    if not agency_ein:
+        return None
+    if routed is None:
+        routed = is_index_routed()
+    return agency_ein if routed else None
+
+
+def is_index_routed():
+    """
+    Return whether the request docs of the ELASTICSEARCH_INDEX alias are routed by agency.
+
+    Indices are routed if ELASTICSEARCH_ROUTE_BY_AGENCY was set when they were
+    created (see create_index), so setting it only takes effect once the index is
+    recreated (see recreate); docs of an index created without routing must not
+    be written or searched with routing.
+
+    The value is kept in search_redis (INDEX_ROUTED_KEY), set whenever the alias
+    is moved, or read from the mapping of the aliased index if it is not.
+    """
+    routed = search_redis.get(INDEX_ROUTED_KEY)
+    if routed is not None:
+        return routed == b'1'
+    try:
+        mappings = es.indices.get_mapping(index=current_app.config["ELASTICSEARCH_INDEX"], doc_type='request')
+    except NotFoundError:
+        return False  # no index yet
+    routed = any(mapping['mappings']['request'].get('_routing', {}).get('required', False)
+                 for mapping in mappings.values())
+    set_index_routed(routed)
+    return routed
+
+
+def set_index_routed(routed):
+    """
+    Record whether the request docs of the ELASTICSEARCH_INDEX alias are routed by agency
+    (see is_index_routed); None if there is no index.
+    """
+    if routed is None:
+        search_redis.delete(INDEX_ROUTED_KEY)
+    else:
+        search_redis.set(INDEX_ROUTED_KEY, int(routed))
+
+
+def update_docs(since=None, full=False, progress=None):
+    """
+    Bulk update the elasticsearch request docs of every request
+    (of an active agency) that has changed since the last sync.
+
+    A request has changed if it, its agency, any of its responses,
+    user requests or associated users has been updated since the sync
+    watermark (see the 'updated_at' columns). Changed request ids are
+    streamed from the database and their docs are built and sent to
+    elasticsearch in batches of ELASTICSEARCH_SYNC_CHUNKSIZE.
+
+    Missing docs are created (upserted). The stored watermark is set
+    ELASTICSEARCH_SYNC_WATERMARK_MARGIN seconds before the sync started,
+    so changes committed late (by transactions still running when their
+    rows were queried) are synced by the next run.
+
+    :param since: only sync requests changed after this (utc) datetime;
+        defaults to the stored watermark
+    :param full: sync all requests, ignoring any watermark
+    :param progress: callable accepting (number of docs synced, total)
+    :return: number of docs synced
+    """
+    started = datetime.utcnow()
+    if not full and since is None:
+        since = get_sync_watermark()
+
+    ids_query = _changed_request_ids_query(None if full else since)
+    total = ids_query.count()
+    chunk_size = current_app.config['ELASTICSEARCH_SYNC_CHUNKSIZE']
+
+    routed = is_index_routed()
+    num_synced = 0
+    request_ids = (request_id for request_id, in ids_query.yield_per(chunk_size))
+    while True:
+        batch = list(islice(request_ids, chunk_size))
+        if not batch:
+            break
+        actions = [
+            _doc_action('update', request_id, doc, routed, doc=doc, doc_as_upsert=True)
+            for request_id, doc in request_docs(batch)
+        ]
+        for _ in parallel_bulk(
+                es,
+                actions,
+                thread_count=current_app.config['ELASTICSEARCH_SYNC_THREAD_COUNT'],
+                chunk_size=max(len(actions) // current_app.config['ELASTICSEARCH_SYNC_THREAD_COUNT'], 1),
+                index=current_app.config["ELASTICSEARCH_INDEX"],
+                doc_type='request',
+                raise_on_error=True):
+            num_synced += 1
+        if progress is not None:
+            progress(num_synced, total)
+
+    # rows updated before the sync started but committed after their changes were
+    # queried are only visible to the next sync, which re-checks the margin
+    set_sync_watermark(started - timedelta(seconds=current_app.config['ELASTICSEARCH_SYNC_WATERMARK_MARGIN']))
+    # cached results are invalidated once the updates are visible to searches
+    es.indices.refresh(index=current_app.config["ELASTICSEARCH_INDEX"])
+    redis_bump_search_generation()
+    current_app.logger.info("Successfully synced {} docs.".format(num_synced))
+    return num_synced
+
+
+@celery.task(bind=True)
+def update_docs_task(self, full=False):
+    """
+    Celery task for update_docs. Progress is reported through
+    the task state ('PROGRESS', with 'current' and 'total' meta).
+    """
+    return update_docs(
+        full=full,
+        progress=lambda current, total: self.update_state(
+            state='PROGRESS',
+            meta={'current': current, 'total': total}
+        )
+    )
+
+
+def queue_doc_update(request_id):
+    """
+    Mark a request doc as needing an update.
+
+    Queued request ids are kept in a redis set, so repeated updates to the
+    same doc are coalesced, and a single flush (flush_doc_updates) is
+    scheduled ELASTICSEARCH_ASYNC_UPDATES_DELAY seconds after the first
+    update of a window.
+
+    :param request_id: id of the request whose doc has changed
+    """
+    queue_doc_updates([request_id])
+
+
+def queue_doc_updates(request_ids):
+    """
+    Same as queue_doc_update but for many requests at once.
+
+    :param request_ids: ids of the requests whose docs have changed
+    """
+    delay = current_app.config['ELASTICSEARCH_ASYNC_UPDATES_DELAY']
+    search_redis.sadd(DIRTY_REQUESTS_KEY, *request_ids)
+    # expiry guards against a flush that never ran (e.g. worker down)
+    if search_redis.set(FLUSH_SCHEDULED_KEY, 1, nx=True, ex=delay * 10):
+        flush_doc_updates.apply_async(countdown=delay)
+
+
+@celery.task
+def flush_doc_updates():
+    """
+    Update the docs of all queued requests (see queue_doc_update) in one bulk call.
+    """
+    pipe = search_redis.pipeline()  # transaction
+    pipe.smembers(DIRTY_REQUESTS_KEY)
+    pipe.delete(DIRTY_REQUESTS_KEY)
+    pipe.delete(FLUSH_SCHEDULED_KEY)
+    request_ids, _, _ = pipe.execute()
+    request_ids = sorted(request_id.decode() for request_id in request_ids)
+    if not request_ids:
+        return 0
+
+    try:
+        num_updated, retry_ids = bulk_update_docs(request_ids)
+    except Exception:
+        current_app.logger.exception("Failed to flush request doc updates; re-queueing.")
+        queue_doc_updates(request_ids)
+        raise
+    if retry_ids:
+        current_app.logger.warning("Re-queueing {} request doc updates.".format(len(retry_ids)))
+        queue_doc_updates(retry_ids)
+    return num_updated
+
+
+def update_request_docs(request_ids):
+    """
+    Update the docs of the given requests (of active agencies, the only ones
+    indexed) in one bulk call or, if ELASTICSEARCH_ASYNC_UPDATES is set,
+    queue them (see queue_doc_updates). Updates failing with a transient
+    error are queued to be retried.
+
+    :param request_ids: ids of the requests whose docs have changed
+    """
+    if not request_ids:
+        return
+    request_ids = [request_id for request_id, in db.session.query(Requests.id).join(
+        Agencies, Agencies.ein == Requests.agency_ein
+    ).filter(
+        Requests.id.in_(request_ids),
+        Agencies.is_active == True
+    )]
+    if not request_ids:
+        return
+    if current_app.config['ELASTICSEARCH_ASYNC_UPDATES']:
+        queue_doc_updates(request_ids)
+        return
+    _, retry_ids = bulk_update_docs(request_ids)
+    if retry_ids:
+        queue_doc_updates(retry_ids)
+
+
+def bulk_update_docs(request_ids):
+    """
+    Update the docs of the given requests in one bulk call.
+
+    Missing docs (e.g. of requests created while elasticsearch was down)
+    are created (upserted). Updates failing with a client error are logged
+    and dropped; those failing with a transient error (429 or 5xx) are
+    returned to be retried.
+
+    :param request_ids: ids of the requests whose docs have changed
+    :return: number of docs updated and ids of the requests to retry
+    """
+    routed = is_index_routed()
+    num_success, errors = bulk(
+        es,
+        (_doc_action('update', request_id, doc, routed, doc=doc, doc_as_upsert=True)
+         for request_id, doc in request_docs(request_ids)),
         index=current_app.config["ELASTICSEARCH_INDEX"],
         doc_type='request',
-        chunk_size=100,
-        raise_on_error=True
+        chunk_size=ALL_RESULTS_CHUNKSIZE,
+        raise_on_error=False
     )
-    current_app.logger.info("Successfully created {} docs.".format(num_success))
+    retry_ids = []
+    for error in errors:
+        item = error['update']
+        if item.get('status') == 429 or item.get('status', 500) >= 500:
+            retry_ids.append(item['_id'])
+        else:
+            current_app.logger.error("Failed to update the doc of request {}: {}".format(
+                item['_id'], item.get('error')))
+    bump_search_generation()
+    return num_success, retry_ids
+
 
+def bump_search_generation():
+    """
+    Invalidate cached search results after request docs were written
+    (see redis_bump_search_generation) without waiting for the writes
+    to be refreshed.
+
+    Results cached before the next index refresh may not reflect the writes,
+    so they are invalidated once more SEARCH_CACHE_REFRESH_DELAY seconds
+    later. Delayed invalidations of writes made within SEARCH_CACHE_REFRESH_DELAY
+    of each other are coalesced.
+    """
+    redis_bump_search_generation()
+    delay = current_app.config['SEARCH_CACHE_REFRESH_DELAY']
+    # the invalidation scheduled by the first write of a window is
+    # delayed until the last write of the window has been refreshed
+    if search_redis.set(GENERATION_BUMP_SCHEDULED_KEY, 1, nx=True, ex=delay):
+        bump_search_generation_task.apply_async(countdown=delay * 2)
+
+
+@celery.task
+def bump_search_generation_task():
+    """
+    Celery task for the delayed invalidation of bump_search_generation.
+    """
+    redis_bump_search_generation()
 
-def update_docs():
-    #: :type: collections.Iterable[app.models.Requests]
-    requests = Requests.query.all()
-    for r in requests:
-        r.es_update()  # TODO: in bulk, if re-creating starts to get too slow
+
+@celery.task
+def percolate_request(request_id, doc):
+    """
+    Match a new request doc against every saved search (one percolate query)
+    and record the matches to be sent in the next digest (see send_saved_search_digests).
+
+    :param request_id: id of the new request
+    :param doc: request doc (see Requests.es_create)
+    """
+    if not db.session.query(SavedSearches.query.exists()).scalar():
+        return 0
+    pipe = search_redis.pipeline()
+    for hit in scan(
+            es,
+            query={
+                'query': {
+                    'percolate': {
+                        'field': 'query',
+                        'document_type': 'request',
+                        'document': doc,
+                    }
+                }
+            },
+            index=current_app.config["ELASTICSEARCH_INDEX"],
+            doc_type='saved_search',
+            _source=False):
+        pipe.sadd(SAVED_SEARCH_MATCHES_KEY.format(hit['_id']), request_id)
+        pipe.sadd(SAVED_SEARCHES_MATCHED_KEY, hit['_id'])
+    return len(pipe.execute()) // 2
+
+
+def send_saved_search_digests():
+    """
+    Email every agency user with saved searches matched by new requests
+    since the last digest, listing the new requests of each search.
+
+    The matches of a search are only removed once its digest is sent, so that
+    they are sent with the next digest if sending fails.
+
+    :return: number of digests sent
+    """
+    saved_search_ids = sorted(int(saved_search_id)
+                              for saved_search_id in search_redis.smembers(SAVED_SEARCHES_MATCHED_KEY))
+    if not saved_search_ids:
+        return 0
+
+    pipe = search_redis.pipeline()
+    for saved_search_id in saved_search_ids:
+        pipe.smembers(SAVED_SEARCH_MATCHES_KEY.format(saved_search_id))
+    matches = {saved_search_id: sorted(request_id.decode() for request_id in request_ids)
+               for saved_search_id, request_ids in zip(saved_search_ids, pipe.execute())}
+
+    requests = {r.id: r for r in Requests.query.filter(
+        Requests.id.in_(set(request_id for request_ids in matches.values() for request_id in request_ids))
+    )}
+
+    # searches deleted since they were matched, and searches whose matched requests
+    # were all deleted, are skipped (their matches are removed below)
+    digests = {}
+    for saved_search in SavedSearches.query.filter(
+            SavedSearches.id.in_(saved_search_ids)
+    ).options(joinedload(SavedSearches.user)).order_by(SavedSearches.name):
+        matched_requests = [requests[request_id] for request_id in matches[saved_search.id]
+                            if request_id in requests]
+        if matched_requests:
+            digests.setdefault(saved_search.user, []).append((saved_search, matched_requests))
+    sent_ids = set(saved_search_ids) - set(saved_search.id
+                                           for searches in digests.values()
+                                           for saved_search, _ in searches)
+
+    num_sent = 0
+    for user, searches in digests.items():
+        if user.is_agency:
+            try:
+                send_email(
+                    SAVED_SEARCH_DIGEST_SUBJECT,
+                    to=[user.notification_email or user.email],
+                    template=SAVED_SEARCH_DIGEST_TEMPLATE,
+                    searches=searches
+                )
+            except Exception as e:
+                current_app.logger.error(
+                    "Failed to send saved search digest to {}: {}".format(user.guid, e))
+                continue
+            num_sent += 1
+        sent_ids.update(saved_search.id for saved_search, _ in searches)
+
+    _remove_saved_search_matches({saved_search_id: matches[saved_search_id]
+                                  for saved_search_id in sent_ids})
+    return num_sent
+
+
+def _remove_saved_search_matches(matches):
+    """
+    Remove the sent (or skipped) matches of saved searches.
+
+    A search matched again in the meantime (see percolate_request) keeps its new
+    matches and stays in the set of matched searches.
+
+    :param matches: dict of saved search id to the request ids to remove
+    """
+    if not matches:
+        return
+    pipe = search_redis.pipeline()
+    pipe.srem(SAVED_SEARCHES_MATCHED_KEY, *matches)
+    for saved_search_id, request_ids in matches.items():
+        if request_ids:
+            pipe.srem(SAVED_SEARCH_MATCHES_KEY.format(saved_search_id), *request_ids)
+    pipe.execute()
+
+    for saved_search_id in matches:
+        pipe.scard(SAVED_SEARCH_MATCHES_KEY.format(saved_search_id))
+    num_remaining = pipe.execute()
+    for saved_search_id, num in zip(matches, num_remaining):
+        if num:
+            pipe.sadd(SAVED_SEARCHES_MATCHED_KEY, saved_search_id)
+    pipe.execute()
+
+
+def get_sync_watermark():
+    """
+    Return the (utc) datetime changes are synced from by the next doc sync
+    (see update_docs) or None.
+    """
+    watermark = search_redis.get(SYNC_WATERMARK_KEY)
+    if watermark is not None:
+        return datetime.strptime(watermark.decode(), SYNC_WATERMARK_FORMAT)
+    return None
+
+
+def set_sync_watermark(dt):
+    search_redis.set(SYNC_WATERMARK_KEY, dt.strftime(SYNC_WATERMARK_FORMAT))
+
+
+def _changed_request_ids_query(since=None):
+    """
+    Query for the ids of requests (of active agencies) whose
+    docs have to be synced.
+
+    :param since: (utc) datetime; if None, all request ids are returned
+    """
+    query = db.session.query(Requests.id).join(
+        Agencies, Requests.agency_ein == Agencies.ein
+    ).filter(
+        Agencies.is_active == True
+    )
+    if since is not None:
+        query = query.filter(or_(
+            Requests.updated_at > since,
+            Agencies.updated_at > since,
+            Requests.id.in_(
+                db.session.query(Responses.request_id).filter(Responses.updated_at > since)
+            ),
+            Requests.id.in_(
+                db.session.query(UserRequests.request_id).filter(UserRequests.updated_at > since)
+            ),
+            Requests.id.in_(
+                db.session.query(UserRequests.request_id).join(
+                    Users, and_(Users.guid == UserRequests.user_guid,
+                                Users.auth_user_type == UserRequests.auth_user_type)
+                ).filter(Users.updated_at > since)
+            ),
+        ))
+    return query.order_by(Requests.id)
+
+
+def request_docs(request_ids):
+    """
+    Build the elasticsearch docs for a batch of requests using
+    a fixed number of queries.
+
+    :param request_ids: ids of requests
+    :return: generator of (request id, doc) tuples
+    """
+    requests = hydrate_requests(request_ids)
+    dates_closed = get_dates_closed(request_ids)
+    for request_id in request_ids:
+        r = requests.get(request_id)
+        if r is not None:
+            yield request_id, request_doc(r, dates_closed.get(request_id))
+
+
+def get_dates_closed(request_ids):
+    """
+    Return the closing date of each of the specified requests
+    that have been closed or denied.
+
+    Equivalent to Requests.date_closed but for many requests at once.
+
+    :param request_ids: ids of requests
+    :return: dict of request id to closing date
+    """
+    if not request_ids:
+        return {}
+    return dict(
+        db.session.query(
+            Determinations.request_id,
+            func.max(Determinations.date_modified)
+        ).join(
+            Requests, Determinations.request_id == Requests.id
+        ).filter(
+            Determinations.request_id.in_(request_ids),
+            Determinations.dtype.in_([determination_type.CLOSING, determination_type.DENIAL]),
+            Requests.status == request_status.CLOSED
+        ).group_by(
+            Determinations.request_id
+        ).all()
+    )
+
+
+def request_doc(r, date_closed):
+    """
+    Return the elasticsearch doc for a request; the only place request docs
+    are built (see Requests.es_create, Requests.es_update and request_docs).
+
+    :param r: request with its agency, requester and agency users loaded
+    :param date_closed: precomputed closing date (see get_dates_closed)
+    """
+    doc = {
+        'foil_id': r.id,
+        'title': r.title,
+        'description': r.description,
+        'agency_request_summary': r.agency_request_summary,
+        'agency_ein': r.agency_ein,
+        'agency_name': r.agency.name,
+        'agency_acronym': r.agency.acronym,
+        'title_private': r.privacy['title'],
+        'agency_request_summary_private': not r.agency_request_summary_released,
+        'date_created': r.date_created.strftime(ES_DATETIME_FORMAT),
+        'date_submitted': r.date_submitted.strftime(ES_DATETIME_FORMAT),
+        'date_received': r.date_created.strftime(
+            ES_DATETIME_FORMAT) if r.date_created < r.date_submitted else r.date_submitted.strftime(
+            ES_DATETIME_FORMAT),
+        'date_due': r.due_date.strftime(ES_DATETIME_FORMAT),
+        'date_closed': date_closed.strftime(ES_DATETIME_FORMAT) if date_closed is not None else [],
+        'submission': r.submission,
+        'status': r.status,
+        'requester_id': (r.requester.get_id()
+                         if not r.requester.is_anonymous_requester
+                         else ''),
+        'requester_name': r.requester.name,
+        'public_title': r.title if not r.privacy['title'] else None,
+        'public_agency_request_summary': (r.agency_request_summary
+                                          if r.agency_request_summary_released else None),
+    }
+    doc.update(r.es_agency_only_fields)
+    return doc
+
+
+def hydrate_requests(request_ids):
+    """
+    Load the requests for a page of search hits along with their
+    agencies, requesters and assigned agency users.
+
+    Agencies, requesters and agency users are eager-loaded so the number
+    of queries issued is fixed (3) regardless of the number of ids.
+
+    :param request_ids: ids of the requests to load
+    :return: dict of request id to Requests object
+    """
+    if not request_ids:
+        return {}
+    requests = Requests.query.filter(
+        Requests.id.in_(request_ids)
+    ).options(
+        joinedload(Requests.agency),
+        subqueryload(Requests.requester),
+        subqueryload(Requests.agency_users)
+    ).all()
+    return {r.id: r for r in requests}
 
 
 def search_requests(query,
@@ -224,7 +1092,11 @@ def search_requests(query,
                     tz_name,
                     by_phrase=False,
                     highlight=False,
-                    for_csv=False):
+                    for_csv=False,
+                    stream=False,
+                    aggregations=False,
+                    cursor=None,
+                    source_profile=None):
     """
     The arguments of this function match the request parameters
     of the '/search/requests' endpoints.
@@ -258,12 +1130,31 @@ def search_requests(query,
     :param tz_name: timezone name (e.g. "America/New_York")
     :param by_phrase: use phrase matching instead of full-text?
     :param highlight: return highlights?
-        if True, will come at a slight performance cost (in order to
-        restrict highlights to public fields, iterating over elasticsearch
-        query results is required)
+        only public fields are highlighted for non-agency users
+        (see RequestsDSLGenerator.highlight_fields)
     :param for_csv: search for a csv export
         if True, will not check the maximum value of size against MAX_RESULT_SIZE
+    :param stream: iterate over the entire result set using a scroll cursor
+        if True, size, start and highlight are ignored and a generator
+        of hits is returned instead of the json response
+    :param aggregations: return request counts by status, agency and
+        (for agency users) due date, computed over the same query as the hits
+        (see get_aggregations_dsl); use with a size of 0 for counts only
+    :param cursor: cursor returned with the previous page of results
+        if given (and valid for the current sort), start is ignored and the
+        page following the previous one is returned using search_after
+    :param source_profile: fields of request docs to return (see SOURCE_PROFILES);
+        defaults to 'csv' if for_csv is True, otherwise to 'api'
+        non-agency users only get PUBLIC_SOURCE_FIELDS, whatever the profile
+        if 'listing', hits also have a description snippet highlight
+        (see get_snippet_field)
     :return: elasticsearch json response with result information
+        and the cursor of the next page ("cursor", None if there are no
+        more results), or a generator of hits if stream is True
+
+    The search is run by the configured backend (see get_search_backend).
+    If DERIVED_REQUEST_STATUSES, the statuses of hits are derived from
+    their due dates (see derive_hit_status).
 
     """
     # clean query trailing/leading whitespace
@@ -346,13 +1237,105 @@ def search_requests(query,
         if date_closed_from or date_closed_to:
             date_ranges.append({'range': {'date_closed': range_filters['date_closed']}})
 
-    # generate query dsl body
     query_fields = {
         'title': title,
         'description': description,
         'agency_request_summary': agency_request_summary,
         'requester_name': requester_name
     }
+    if source_profile is None:
+        source_profile = 'csv' if for_csv else 'api'
+    source = list(SOURCE_PROFILES[source_profile])
+    if source_profile == 'csv' and current_user.is_agency:
+        source += AGENCY_ONLY_FIELDS
+    if not current_user.is_agency:
+        source = [field for field in source if field in PUBLIC_SOURCE_FIELDS]
+
+    # Calculate result set size
+    result_set_size = size if for_csv else min(size, MAX_RESULT_SIZE)
+
+    search = get_search_backend()
+    results = search(
+        query,
+        foil_id,
+        query_fields,
+        statuses,
+        date_ranges,
+        agency_ein,
+        match_type,
+        sort,
+        source,
+        source_profile == 'listing',
+        result_set_size,
+        start,
+        highlight,
+        for_csv,
+        stream,
+        aggregations,
+        cursor
+    )
+
+    if current_app.config['DERIVED_REQUEST_STATUSES']:
+        due_date_bounds = get_due_date_bounds()
+        if stream:
+            return (derive_hit_status(hit, *due_date_bounds) for hit in results)
+        for hit in results['hits']['hits']:
+            derive_hit_status(hit, *due_date_bounds)
+    return results
+
+
+def get_search_backend():
+    """
+    Return the search function of the configured backend (SEARCH_BACKEND).
+
+    A search backend is a function accepting the arguments of _search_elasticsearch
+    and returning results in the same (elasticsearch json) format.
+    """
+    if current_app.config['SEARCH_BACKEND'] == 'postgres':
+        from app.search.postgres import search_requests as search_postgres  # circular import (uses request_docs)
+        return search_postgres
+    return _search_elasticsearch
+
+
+def _search_elasticsearch(query,
+                          foil_id,
+                          query_fields,
+                          statuses,
+                          date_ranges,
+                          agency_ein,
+                          match_type,
+                          sort,
+                          source,
+                          snippets,
+                          size,
+                          start,
+                          highlight,
+                          for_csv,
+                          stream,
+                          aggregations,
+                          cursor):
+    """
+    Elasticsearch search backend (see search_requests).
+
+    :param query: string to query for (stripped of "FOIL-" if searching by FOIL ID)
+    :param foil_id: search by request id?
+    :param query_fields: dict of field names to whether to query them
+    :param statuses: list of request statuses to filter by
+    :param date_ranges: list of elasticsearch date range filters
+    :param agency_ein: agency ein to filter by
+    :param match_type: 'match' (full-text) or 'match_phrase'
+    :param sort: list of "field:direction" sorts
+    :param source: list of fields of request docs to return
+    :param snippets: return description snippets (see get_snippet_field)?
+    :param size: number of requests per page
+    :param start: starting index of request result set
+    :param highlight: return highlights?
+    :param for_csv: search for a csv export?
+    :param stream: return a generator of all hits?
+    :param aggregations: return request counts?
+    :param cursor: cursor returned with the previous page of results
+    """
+    # generate query dsl body
     dsl_gen = RequestsDSLGenerator(query, query_fields, statuses, date_ranges, agency_ein, match_type)
     if foil_id:
         dsl = dsl_gen.foil_id()
@@ -369,70 +1352,415 @@ def search_requests(query,
         else:
             dsl = dsl_gen.queryless()
 
-    # add highlights to dsl
-    if highlight:
-        highlight_fields = {}
-        for name, add in query_fields.items():
-            if add:
-                highlight_fields[name] = {}
+    # scroll through all results, one page in memory at a time
+    if stream:
+        scan_kwargs = {'sort': sort} if sort else {}
+        return scan(
+            es,
+            query=dsl,
+            index=current_app.config["ELASTICSEARCH_INDEX"],
+            doc_type='request',
+            routing=get_routing(agency_ein),
+            _source=source,
+            size=ALL_RESULTS_CHUNKSIZE,
+            preserve_order=bool(sort),
+            **scan_kwargs
+        )
+
+    # add highlights and snippets to dsl
+    highlight_fields = {}
+    if highlight and not foil_id:
+        highlight_fields.update({name: {} for name in dsl_gen.highlight_fields})
+    if snippets:
+        # the start of the text if it does not match
+        highlight_fields[get_snippet_field()] = {
+            'fragment_size': SNIPPET_SIZE,
+            'number_of_fragments': 1,
+            'no_match_size': SNIPPET_SIZE,
+        }
+    if highlight_fields:
         dsl.update(
             {
                 'highlight': {
                     'pre_tags': ['<span class="highlight">'],
                     'post_tags': ['</span>'],
+                    'encoder': 'html',
                     'fields': highlight_fields
                 }
             }
         )
 
-    # Calculate result set size
-    result_set_size = size if for_csv else min(size, MAX_RESULT_SIZE)
+    # add aggregations to dsl
+    if aggregations:
+        dsl['aggs'] = get_aggregations_dsl(current_user.is_agency)
+
+    # continue from the cursor of the previous page, if any
+    # (sorted hits are tied-broken by request id so every hit has a unique position)
+    paging_sort = (sort or ['_score:desc']) + ['foil_id:asc']
+    search_after = decode_cursor(cursor, paging_sort) if cursor else None
+    if search_after is not None:
+        dsl['search_after'] = search_after
+        start = 0
+    dsl['sort'] = get_sort_dsl(paging_sort)
+
+    # check cache
+    cache_ttl = 0 if for_csv else _get_search_cache_ttl()
+    if cache_ttl:
+        cache_key = _get_search_cache_key(dsl, source, size, start, paging_sort)
+        results = redis_get_search_results(cache_key)
+        if results is not None:
+            return results
 
     # search / run query
     results = es.search(
         index=current_app.config["ELASTICSEARCH_INDEX"],
         doc_type='request',
         body=dsl,
-        _source=['requester_id',
-                 'date_submitted',
-                 'date_due',
-                 'date_received',
-                 'date_created',
-                 'date_closed',
-                 'status',
-                 'agency_ein',
-                 'agency_name',
-                 'agency_acronym',
-                 'requester_name',
-                 'title_private',
-                 'agency_request_summary_private',
-                 'public_title',
-                 'title',
-                 'agency_request_summary',
-                 'description'],
-        size=result_set_size,
+        routing=get_routing(agency_ein),
+        _source=source,
+        size=size,
         from_=start,
-        sort=sort,
+        # count-only results are cached per shard by elasticsearch
+        request_cache=size == 0,
     )
 
-    # process highlights
-    if highlight and not foil_id:
-        _process_highlights(results, dsl_gen.requester_id)
+    hits = results['hits']['hits']
+    results['cursor'] = (encode_cursor(paging_sort, hits[-1]['sort'])
+                         if hits and len(hits) == size
+                         else None)
+
+    if cache_ttl:
+        redis_set_search_results(cache_key, results, cache_ttl)
 
     return results
 
 
+def get_sort_dsl(sort):
+    """
+    Return the elasticsearch sort of a list of "field:direction" sorts.
+
+    The foil_id field is missing from the mappings of indices created
+    before it was added, on which it is sorted as an unmapped keyword
+    (without failing the search) until they are recreated.
+
+    :param sort: list of "field:direction" sorts
+    """
+    sort_dsl = []
+    for field_direction in sort:
+        field, direction = field_direction.split(':')
+        order = {'order': direction}
+        if field == 'foil_id':
+            order['unmapped_type'] = 'keyword'
+        sort_dsl.append({field: order})
+    return sort_dsl
+
+
+def encode_cursor(sort, sort_values):
+    """
+    Return an opaque search cursor for the position of a hit.
+
+    :param sort: sort the hit was found with
+    :param sort_values: sort values of the hit
+    """
+    return urlsafe_b64encode(json.dumps([sort, sort_values]).encode()).decode()
+
+
+def decode_cursor(cursor, sort):
+    """
+    Return the sort values (search_after) of a search cursor
+    or None if the cursor is invalid or was created for another sort.
+
+    :param cursor: cursor created by encode_cursor
+    :param sort: sort of the current search
+    """
+    try:
+        cursor_sort, sort_values = json.loads(urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError):
+        return None
+    return sort_values if cursor_sort == sort and isinstance(sort_values, list) else None
+
+
+def suggest_titles(query, size=SUGGEST_SIZE):
+    """
+    Return the ids and titles of requests whose title contains words
+    starting with the words of the query, for search-as-you-type.
+
+    Agency users get suggestions from all titles. Other users only get
+    suggestions from public titles (private titles are never matched).
+
+    :param query: partial title
+    :param size: maximum number of suggestions
+    :return: list of dicts with "id" and "title" keys
+    """
+    if current_app.config['SEARCH_BACKEND'] == 'postgres':
+        from app.search.postgres import suggest_titles as suggest_postgres  # circular import (uses request_docs)
+        return suggest_postgres(query, size)
+
+    query = (query or '').strip()
+    if len(query) < SUGGEST_MIN_QUERY_LENGTH:
+        return []
+
+    if current_user.is_agency:
+        field = 'title'
+        dsl = {
+            'query': {
+                'match': {'title.autocomplete': {'query': query, 'operator': 'and'}}
+            }
+        }
+    else:
+        field = 'public_title'
+        dsl = {
+            'query': {
+                'bool': {
+                    'must': {
+                        'match': {'public_title.autocomplete': {'query': query, 'operator': 'and'}}
+                    },
+                    'filter': {'term': {'title_private': False}}
+                }
+            }
+        }
+
+    results = es.search(
+        index=current_app.config["ELASTICSEARCH_INDEX"],
+        doc_type='request',
+        body=dsl,
+        _source=[field],
+        size=size,
+        filter_path=['hits.hits._id', 'hits.hits._source'],
+    )
+    return [{'id': hit['_id'], 'title': hit['_source'][field]}
+            for hit in results.get('hits', {}).get('hits', [])]
+
+
+def get_aggregations_dsl(due_dates=False):
+    """
+    Return the aggregations of request counts by status and agency and,
+    optionally, of open request counts by due date ("overdue", "due_soon",
+    and "due_later").
+
+    Due date buckets are computed from today's date rather than "now"
+    so that elasticsearch can cache count-only results. Statuses are
+    counted as derived if DERIVED_REQUEST_STATUSES (see get_status_filter).
+
+    :param due_dates: include due date buckets?
+    """
+    if current_app.config['DERIVED_REQUEST_STATUSES']:
+        statuses = {
+            'filters': {
+                'filters': {status: get_status_filter([status]) for status in (
+                    request_status.OPEN,
+                    request_status.IN_PROGRESS,
+                    request_status.DUE_SOON,
+                    request_status.OVERDUE,
+                    request_status.CLOSED,
+                )}
+            }
+        }
+    else:
+        statuses = {
+            'terms': {'field': 'status'}
+        }
+    aggs = {
+        'statuses': statuses,
+        'agencies': {
+            'terms': {'field': 'agency_ein', 'size': AGGREGATION_AGENCIES_SIZE}
+        },
+    }
+    if due_dates:
+        today, due_later_date = (date.strftime(DT_DATE_RANGE_FORMAT) for date in get_due_date_bounds())
+        aggs['due_dates'] = {
+            'filter': {
+                'bool': {
+                    'must_not': {'term': {'status': request_status.CLOSED}}
+                }
+            },
+            'aggs': {
+                'buckets': {
+                    'date_range': {
+                        'field': 'date_due',
+                        'format': ES_DATE_RANGE_FORMAT,
+                        'keyed': True,
+                        'ranges': [
+                            {'key': 'overdue', 'to': today},
+                            {'key': 'due_soon', 'from': today, 'to': due_later_date},
+                            {'key': 'due_later', 'from': due_later_date},
+                        ]
+                    }
+                }
+            }
+        }
+    return aggs
+
+
+def get_status_filter(statuses, derived=True):
+    """
+    Return the elasticsearch filter of requests with any of the given statuses.
+
+    If DERIVED_REQUEST_STATUSES (and derived), Due Soon and Overdue are not
+    kept up to date in request docs and statuses are matched as derived by
+    Requests.derive_status, from the stored status and the due date.
+
+    :param statuses: list of request statuses
+    :param derived: match derived statuses (if DERIVED_REQUEST_STATUSES)?
+    """
+    if not (derived and current_app.config['DERIVED_REQUEST_STATUSES']):
+        return {'terms': {'status': statuses}}
+
+    today, due_later_date = (date.strftime(DT_DATE_RANGE_FORMAT) for date in get_due_date_bounds())
+
+    def due(**bounds):
+        bounds['format'] = ES_DATE_RANGE_FORMAT
+        return {'range': {'date_due': bounds}}
+
+    not_closed = {'bool': {'must_not': {'term': {'status': request_status.CLOSED}}}}
+    clauses = []
+    for status in statuses:
+        if status == request_status.CLOSED:
+            clauses.append({'term': {'status': status}})
+        elif status == request_status.OVERDUE:
+            clauses.append({'bool': {'filter': [not_closed, due(lt=today)]}})
+        elif status == request_status.DUE_SOON:
+            clauses.append({'bool': {'filter': [not_closed, due(gte=today, lt=due_later_date)]}})
+        else:
+            stored = [status]
+            if status == request_status.IN_PROGRESS:
+                stored += [request_status.DUE_SOON, request_status.OVERDUE]
+            clauses.append({'bool': {'filter': [{'terms': {'status': stored}}, due(gte=due_later_date)]}})
+    return {'bool': {'should': clauses, 'minimum_should_match': 1}}
+
+
+def derive_hit_status(hit, today, due_later_date):
+    """
+    Replace the stored status of a search hit with its derived status
+    (see Requests.derive_status and get_due_date_bounds).
+    """
+    source = hit['_source']
+    if source.get('status') and source.get('date_due'):
+        source['status'] = Requests.derive_status(source['status'],
+                                                  datetime.strptime(source['date_due'], ES_DATETIME_FORMAT),
+                                                  today,
+                                                  due_later_date)
+    return hit
+
+
+def format_aggregations(results):
+    """
+    Flatten the aggregations of a search response (see get_aggregations_dsl)
+    into dicts of counts, e.g.:
+
+        {
+            "statuses": {"Open": 10, "Closed": 5},
+            "agencies": {"0002": 15},
+            "due_dates": {"overdue": 1, "due_soon": 2, "due_later": 7}
+        }
+
+    :param results: elasticsearch json search results
+    """
+    aggs = results.get('aggregations', {})
+    counts = {}
+    for name in ('statuses', 'agencies'):
+        buckets = aggs.get(name, {}).get('buckets', [])
+        if isinstance(buckets, dict):
+            # keyed filters aggregation (derived statuses)
+            counts[name] = {key: bucket['doc_count'] for key, bucket in buckets.items() if bucket['doc_count']}
+        else:
+            counts[name] = {bucket['key']: bucket['doc_count'] for bucket in buckets}
+    if 'due_dates' in aggs:
+        counts['due_dates'] = {key: bucket['doc_count']
+                               for key, bucket in aggs['due_dates']['buckets']['buckets'].items()}
+    return counts
+
+
+def count_requests(agency_ein=None):
+    """
+    Return the number of requests by status and agency (see format_aggregations)
+    in a single count-only search, regardless of the current user.
+
+    :param agency_ein: only count requests of this agency
+    """
+    query = {'term': {'agency_ein': agency_ein}} if agency_ein else {'match_all': {}}
+    results = es.search(
+        index=current_app.config["ELASTICSEARCH_INDEX"],
+        doc_type='request',
+        body={
+            'query': {'bool': {'filter': query}},
+            'aggs': get_aggregations_dsl(),
+        },
+        routing=get_routing(agency_ein),
+        size=0,
+        request_cache=True,
+    )
+    return format_aggregations(results)
+
+
+def get_snippet_field():
+    """
+    Return the field request snippets are taken from for the current user:
+    the description for agency users, the public agency description otherwise.
+    """
+    return 'description' if current_user.is_agency else 'public_agency_request_summary'
+
+
+def _get_search_cache_ttl():
+    """
+    Return the number of seconds search results of the current user
+    should be cached for (0 if they should not be cached).
+    """
+    if current_user.is_agency:
+        return current_app.config['SEARCH_CACHE_AGENCY_TTL']
+    return current_app.config['SEARCH_CACHE_TTL']
+
+
+def _get_search_cache_key(dsl, *search_args):
+    """
+    Return the search cache key for a query dsl body and search arguments.
+
+    Results depend on the query and on the class of the current user
+    (and, for public users, on their id), all of which are part of the key
+    along with the current search generation, so bumping the generation
+    invalidates every cached result at once.
+    """
+    if current_user.is_agency:
+        user_class = 'agency'
+    elif current_user.is_anonymous:
+        user_class = 'anonymous'
+    else:
+        user_class = 'public:{}'.format(current_user.get_id())
+    digest = sha1(json.dumps([dsl, search_args], sort_keys=True).encode()).hexdigest()
+    return 'search:{generation}:{user_class}:{digest}'.format(
+        generation=redis_get_search_generation(),
+        user_class=user_class,
+        digest=digest
+    )
+
+
 class RequestsDSLGenerator(object):
-    """ Class for generating dicts representing query dsl bodies for searching request docs. """
+    """
+    Class for generating dicts representing query dsl bodies for searching request docs.
+
+    Only full-text match clauses are run in query context (scored).
+    Statuses, date ranges, agency, privacy and requester clauses are run
+    in filter context so they are not scored and can be cached by elasticsearch.
 
-    def __init__(self, query, query_fields, statuses, date_ranges, agency_ein, match_type):
+    Anonymous and public users query (and get highlights from) the public
+    text fields ("public_title" and "public_agency_request_summary"), which
+    only hold text that is publicly visible, so private text can never be
+    matched or highlighted for them.
+    """
+
+    def __init__(self, query, query_fields, statuses, date_ranges, agency_ein, match_type, stored_statuses=False):
+        """
+        :param stored_statuses: filter by the statuses stored in request docs
+            even if DERIVED_REQUEST_STATUSES (see get_status_filter), e.g. for
+            percolator queries, which must not depend on the current date
+        """
         self.__query = query
         self.__query_fields = query_fields
         self.__statuses = statuses
         self.__agency_ein = agency_ein
         self.__match_type = match_type
 
-        self.__default_filters = [{'terms': {'status': statuses}}]
+        self.__default_filters = [get_status_filter(statuses, derived=not stored_statuses)]
         if date_ranges:
             self.__default_filters += date_ranges
         if agency_ein:
@@ -440,102 +1768,91 @@ class RequestsDSLGenerator(object):
                 'term': {'agency_ein': agency_ein}
             })
 
-        self.__filters = []
         self.__conditions = []
-        self.requester_id = None
+        self.highlight_fields = []
 
     def foil_id(self):
-        self.__filters = [{
-            'wildcard': {
-                '_uid': 'request#FOIL-*{}*'.format(self.__query)
-            }
-        }]
-        return self.__must_query
+        """
+        Complete FOIL IDs are looked up by doc id. Partial FOIL IDs
+        shorter than FOIL_ID_MIN_GRAM are matched as a prefix of the
+        FOIL ID (after "FOIL-") and longer ones anywhere in the FOIL ID.
+        """
+        if re.match(FOIL_ID_REGEX, self.__query):
+            condition = {'ids': {'values': ['FOIL-{}'.format(self.__query)]}}
+        elif len(self.__query) < FOIL_ID_MIN_GRAM:
+            condition = {'prefix': {'foil_id': 'FOIL-{}'.format(self.__query)}}
+        else:
+            condition = {'match': {'foil_id.ngram': self.__query}}
+        return self.__filter_query([condition])
 
     def agency_user(self):
         for name, use in self.__query_fields.items():
             if use:
-                self.__filters = [
-                    {self.__match_type: {name: self.__query}}
-                ]
-                self.__conditions.append(self.__must)
-        return self.__should
+                self.__add_condition(name)
+                self.highlight_fields.append(name)
+        return self.__should_query
 
     def anonymous_user(self):
         if self.__query_fields['title']:
-            self.__filters = [
-                {self.__match_type: {'title': self.__query}},
-                {'term': {'title_private': False}}
-            ]
-            self.__conditions.append(self.__must)
+            self.__add_condition('public_title')
+            self.highlight_fields.append('public_title')
         if self.__query_fields['agency_request_summary']:
-            self.__filters = [
-                {self.__match_type: {'agency_request_summary': self.__query}},
-                {'term': {'agency_request_summary_private': False}}
-            ]
-            self.__conditions.append(self.__must)
-        return self.__should
+            self.__add_condition('public_agency_request_summary')
+            self.highlight_fields.append('public_agency_request_summary')
+        return self.__should_query
 
     def public_user(self):
-        self.requester_id = current_user.get_id()
+        """
+        Public users can also search the title and description of their own
+        requests. These are matched but not highlighted, since highlights are
+        not restricted to the hits matched by a given clause.
+        """
+        requester_id = current_user.get_id()
+        self.anonymous_user()
         if self.__query_fields['title']:
-            self.__filters = [
-                {self.__match_type: {'title': self.__query}},
-                {'bool': {
-                    'should': [
-                        {'term': {'requester_id': self.requester_id}},
-                        {'term': {'title_private': False}}
-                    ]
-                }}
-            ]
-            self.__conditions.append(self.__must)
-        if self.__query_fields['agency_request_summary']:
-            self.__filters = [
-                {self.__match_type: {'agency_request_summary': self.__query}},
-                {'term': {'agency_request_summary_private': False}}
-            ]
-            self.__conditions.append(self.__must)
+            self.__add_condition('title', {'term': {'requester_id': requester_id}})
         if self.__query_fields['description']:
-            self.__filters = [
-                {self.__match_type: {'description': self.__query}},
-                {'term': {'requester_id': self.requester_id}},
-            ]
-            self.__conditions.append(self.__must)
-        return self.__should
+            self.__add_condition('description', {'term': {'requester_id': requester_id}})
+        return self.__should_query
 
     def queryless(self):
-        self.__filters = [
-            {'match_all': {}},
-        ]
-        return self.__must_query
+        return self.__filter_query([])
 
-    @property
-    def __must_query(self):
-        return {
-            'query': self.__must
+    def __add_condition(self, field, *filters):
+        """
+        Add a condition matching the query against a field (scored),
+        restricted by the given filters (not scored).
+        """
+        condition = {
+            'bool': {
+                'must': [{self.__match_type: {field: self.__query}}]
+            }
         }
+        if filters:
+            condition['bool']['filter'] = list(filters)
+        self.__conditions.append(condition)
 
-    @property
-    def __must(self):
+    def __filter_query(self, filters):
         return {
-            'bool': {
-                'must': self.__get_filters()
+            'query': {
+                'bool': {
+                    'filter': filters + self.__default_filters
+                }
             }
         }
 
     @property
-    def __should(self):
+    def __should_query(self):
         return {
             'query': {
                 'bool': {
-                    'should': self.__conditions
+                    'should': self.__conditions,
+                    'minimum_should_match': 1,
+                    'filter': self.__default_filters
                 }
             }
         }
 
-    def __get_filters(self):
-        return self.__filters + self.__default_filters
-
 
 def convert_dates(results, dt_format=None, tz_name=None):
     """
@@ -548,40 +1865,24 @@ def convert_dates(results, dt_format=None, tz_name=None):
     :tz_name: time zone name
     """
     for hit in results["hits"]["hits"]:
-        for field in ("date_submitted", "date_due", "date_received", "date_closed"):
-            dt_field = hit["_source"].get(field, None)
-            if dt_field is not None and dt_field:
-                dt = datetime.strptime(hit["_source"][field], ES_DATETIME_FORMAT)
-            else:
-                continue
-            if tz_name:
-                dt = utc_to_local(dt, tz_name)
-            hit["_source"][field] = dt.strftime(dt_format) if dt_format is not None else dt
+        convert_hit_dates(hit, dt_format, tz_name)
 
 
-def _process_highlights(results, requester_id=None):
+def convert_hit_dates(hit, dt_format=None, tz_name=None):
     """
-    Remove highlights for private and non-requester fields.
-    Used for non-agency users.
-
-    Why this is necessary:
-    https://github.com/elastic/elasticsearch/issues/6787
+    Same as convert_dates but for a single search hit.
+    Used when iterating over a streamed result set.
 
-    :param results: elasticsearch json search results
-    :param requester_id: id of requester as it is exists in results
+    :hit: elasticsearch json hit
+    :dt_format: datetime string format
+    :tz_name: time zone name
     """
-    if not current_user.is_agency:
-        for hit in results['hits']['hits']:
-            is_requester = (requester_id == hit['_source']['requester_id']
-                            if requester_id
-                            else False)
-            if ('title' in hit['highlight']
-                and hit['_source']['title_private']
-                and (current_user.is_anonymous or not is_requester)):
-                hit['highlight'].pop('title')
-            if ('agency_request_summary' in hit['highlight']
-                and hit['_source']['agency_request_summary_private']):
-                hit['highlight'].pop('agency_request_summary')
-            if ('description' in hit['highlight']
-                and not is_requester):
-                hit['highlight'].pop('description')
+    for field in ("date_submitted", "date_due", "date_received", "date_closed"):
+        dt_field = hit["_source"].get(field, None)
+        if dt_field is not None and dt_field:
+            dt = datetime.strptime(hit["_source"][field], ES_DATETIME_FORMAT)
+        else:
+            continue
+        if tz_name:
+            dt = utc_to_local(dt, tz_name)
+        hit["_source"][field] = dt.strftime(dt_format) if dt_format is not None else dt
@@ -1,22 +1,34 @@
 import csv
 from datetime import datetime
-from io import StringIO, BytesIO
+from io import StringIO
+from itertools import chain, islice
 import re
 
 from flask import (
+    current_app,
     request,
     render_template,
     jsonify,
+    Response,
+    stream_with_context,
 )
-from flask.helpers import send_file
 from flask_login import current_user
 
 from app.lib.date_utils import utc_to_local
+from app.lib.db_utils import create_object, delete_object
+from app.lib.redis_utils import redis_get_search_cache_stats, redis_get_es_latency_stats
 from app.lib.utils import eval_request_bool
-from app.models import Requests
+from app.models import SavedSearches
 from app.search import search
-from app.search.constants import DEFAULT_HITS_SIZE, ALL_RESULTS_CHUNKSIZE
-from app.search.utils import search_requests, convert_dates
+from app.search.constants import DEFAULT_HITS_SIZE, ALL_RESULTS_CHUNKSIZE, SOURCE_PROFILES
+from app.search.utils import (
+    search_requests,
+    convert_dates,
+    convert_hit_dates,
+    format_aggregations,
+    hydrate_requests,
+    suggest_titles,
+)
 
 
 @search.route("/requests", methods=['GET'])
@@ -54,6 +66,19 @@ def requests():
     - Status, Overdue
     - Date Due
 
+    Pages can be requested with 'start' (an offset) or, to page through
+    results efficiently, with 'cursor', the cursor returned with the
+    previous page for the same search and sort.
+
+    If 'aggregations' is true, request counts by status and agency
+    (and by due date for agency users) over the same search are returned
+    as well. Pass a 'size' of 0 to only return counts.
+
+    'source_profile' selects the fields of the results (see SOURCE_PROFILES):
+    'listing' (the default) returns rendered result rows, other profiles
+    return the hits as json. Non-agency users only get public fields
+    (see PUBLIC_SOURCE_FIELDS) whatever the profile.
+
     """
     try:
         agency_ein = request.args.get('agency_ein', '')
@@ -71,6 +96,11 @@ def requests():
         start = 0
 
     query = request.args.get('query')
+    aggregations = eval_request_bool(request.args.get('aggregations'))
+
+    source_profile = request.args.get('source_profile', 'listing')
+    if source_profile not in SOURCE_PROFILES:
+        source_profile = 'listing'
 
     # Determine if searching for FOIL ID
     foil_id = eval_request_bool(request.args.get('foil_id')) or re.match(r'^(FOIL-|foil-|)\d{4}-\d{3}-\d{5}$', query)
@@ -99,24 +129,131 @@ def requests():
         request.args.get('sort_date_submitted'),
         request.args.get('sort_date_due'),
         request.args.get('sort_title'),
-        request.args.get('tz_name')
+        request.args.get('tz_name'),
         # eval_request_bool(request.args.get('by_phrase')),
         # eval_request_bool(request.args.get('highlight')),
+        aggregations=aggregations,
+        cursor=request.args.get('cursor'),
+        source_profile=source_profile
     )
 
     # format results
     total = results["hits"]["total"]
     formatted_results = None
-    if total != 0:
-        convert_dates(results)
-        formatted_results = render_template("request/result_row.html",
-                                            requests=results["hits"]["hits"])
-        # query=query)  # only for testing
-    return jsonify({
+    if results["hits"]["hits"]:
+        if source_profile == 'listing':
+            convert_dates(results)
+            formatted_results = render_template("request/result_row.html",
+                                                requests=results["hits"]["hits"])
+            # query=query)  # only for testing
+        else:
+            formatted_results = results["hits"]["hits"]
+    response = {
         "count": len(results["hits"]["hits"]),
         "total": total,
-        "results": formatted_results
-    }), 200
+        "results": formatted_results,
+        "cursor": results.get("cursor")
+    }
+    if aggregations:
+        response["aggregations"] = format_aggregations(results)
+    return jsonify(response), 200
+
+
+@search.route("/suggest", methods=['GET'])
+def suggest():
+    """
+    Returns title suggestions for a partial title (search-as-you-type).
+    See app.search.utils.suggest_titles
+
+    Request parameters:
+    - query: partial title
+
+    :return: json object({"suggestions": [{"id": "FOIL-...", "title": "..."}, ...]}), 200
+    """
+    return jsonify({"suggestions": suggest_titles(request.args.get('query'))}), 200
+
+
+@search.route("/saved", methods=['GET', 'POST'])
+def saved_searches():
+    """
+    Lists (GET) or saves (POST) the saved searches of the current (agency) user.
+    New requests matching a saved search are emailed to its user
+    (see app.search.utils.send_saved_search_digests).
+
+    Request parameters (POST):
+    - name: name of the search
+    - query, title, agency_request_summary, description, requester_name,
+      agency_ein, by_phrase: see /search/requests
+
+    :return: json object({"saved_searches": [...]}), 200 (GET)
+             json object of the saved search, 201 (POST)
+    """
+    if not current_user.is_agency or not current_app.config['ELASTICSEARCH_ENABLED']:
+        return '', 403
+
+    if request.method == 'GET':
+        return jsonify({"saved_searches": [
+            saved_search.val_for_json for saved_search in
+            current_user.saved_searches.order_by(SavedSearches.name)
+        ]}), 200
+
+    name = (request.form.get('name') or '').strip()
+    if not name:
+        return '', 400
+    saved_search = SavedSearches(
+        user_guid=current_user.guid,
+        auth_user_type=current_user.auth_user_type,
+        name=name[:64],
+        query_string=(request.form.get('query') or '').strip(),
+        query_fields={
+            'title': eval_request_bool(request.form.get('title')),
+            'agency_request_summary': eval_request_bool(request.form.get('agency_request_summary')),
+            'description': eval_request_bool(request.form.get('description')),
+            'requester_name': eval_request_bool(request.form.get('requester_name')),
+        },
+        agency_ein=request.form.get('agency_ein') or None,
+        by_phrase=eval_request_bool(request.form.get('by_phrase')),
+    )
+    if saved_search.query_string and not any(saved_search.query_fields.values()):
+        return '', 400
+    if create_object(saved_search) is None:
+        return '', 400
+    return jsonify(saved_search.val_for_json), 201
+
+
+@search.route("/saved/<int:saved_search_id>", methods=['DELETE'])
+def delete_saved_search(saved_search_id):
+    """
+    Deletes a saved search of the current (agency) user.
+    """
+    if not current_user.is_agency:
+        return '', 403
+    saved_search = current_user.saved_searches.filter_by(id=saved_search_id).first()
+    if saved_search is None:
+        return '', 404
+    saved_search.es_delete()
+    return ('', 200) if delete_object(saved_search) else ('', 400)
+
+
+@search.route("/cache/stats", methods=['GET'])
+def cache_stats():
+    """
+    Returns the search result cache hit and miss counts (super users only).
+    """
+    if current_user.is_anonymous or not current_user.is_super:
+        return jsonify({}), 403
+    return jsonify(redis_get_search_cache_stats()), 200
+
+
+@search.route("/latency/stats", methods=['GET'])
+def latency_stats():
+    """
+    Returns elasticsearch latency histograms by operation and caller (super users only).
+    See app.lib.redis_utils.redis_get_es_latency_stats
+    """
+    if current_user.is_anonymous or not current_user.is_super:
+        return jsonify({}), 403
+    return jsonify({"latencies": redis_get_es_latency_stats()}), 200
 
 
 @search.route("/requests/<doc_type>", methods=['GET'])
@@ -126,6 +263,8 @@ def requests_doc(doc_type):
     file of the specified document type.
     - Filtering on set size is ignored; all results are returned.
     - Currently only supports CSVs.
+    - The file is streamed; rows are written as hits are scrolled
+      through so memory usage does not grow with the result set.
 
     Document name format: "FOIL_requests_results_<timestamp:MM_DD_YYYY_at_HH_mm_pp>"
 
@@ -141,102 +280,130 @@ def requests_doc(doc_type):
 
         tz_name = request.args.get('tz_name')
 
-        start = 0
-        buffer = StringIO()  # csvwriter cannot accept BytesIO
-        writer = csv.writer(buffer)
-        writer.writerow(["FOIL ID",
-                         "Agency",
-                         "Title",
-                         "Description",
-                         "Agency Description",
-                         "Current Status",
-                         "Date Created",
-                         "Date Received",
-                         "Date Due",
-                         "Date Closed",
-                         "Requester Name",
-                         "Requester Email",
-                         "Requester Title",
-                         "Requester Organization",
-                         "Requester Phone Number",
-                         "Requester Fax Number",
-                         "Requester Address 1",
-                         "Requester Address 2",
-                         "Requester City",
-                         "Requester State",
-                         "Requester Zipcode",
-                         "Assigned User Emails"])
-        while True:
-            results = search_requests(
-                request.args.get('query'),
-                eval_request_bool(request.args.get('foil_id')),
-                eval_request_bool(request.args.get('title')),
-                eval_request_bool(request.args.get('agency_request_summary')),
-                eval_request_bool(request.args.get('description')),
-                eval_request_bool(request.args.get('requester_name')),
-                request.args.get('date_rec_from'),
-                request.args.get('date_rec_to'),
-                request.args.get('date_due_from'),
-                request.args.get('date_due_to'),
-                request.args.get('date_closed_from'),
-                request.args.get('date_closed_to'),
-                agency_ein,
-                eval_request_bool(request.args.get('open')),
-                eval_request_bool(request.args.get('closed')),
-                eval_request_bool(request.args.get('in_progress')),
-                eval_request_bool(request.args.get('due_soon')),
-                eval_request_bool(request.args.get('overdue')),
-                ALL_RESULTS_CHUNKSIZE,
-                start,
-                request.args.get('sort_date_submitted'),
-                request.args.get('sort_date_due'),
-                request.args.get('sort_title'),
-                tz_name,
-                for_csv=True
-            )
-            total = results["hits"]["total"]
-            if total != 0:
-                convert_dates(results, tz_name=tz_name)
-                for result in results["hits"]["hits"]:
-                    r = Requests.query.filter_by(id=result["_id"]).one()
-                    mailing_address = (r.requester.mailing_address
-                                       if r.requester.mailing_address is not None
-                                       else {})
-                    date_closed = result["_source"].get('date_closed', '')
-                    date_closed = date_closed if str(date_closed) != str(list()) else ''
-                    writer.writerow([
-                        result["_id"],
-                        result["_source"]["agency_name"],
-                        result["_source"]["title"],
-                        result["_source"]["description"],
-                        result["_source"]["agency_request_summary"],
-                        r.status,
-                        result["_source"]["date_created"],
-                        result["_source"]["date_submitted"],
-                        result["_source"]["date_due"],
-                        date_closed,
-                        result["_source"]["requester_name"],
-                        r.requester.email,
-                        r.requester.title,
-                        r.requester.organization,
-                        r.requester.phone_number,
-                        r.requester.fax_number,
-                        mailing_address.get('address_one'),
-                        mailing_address.get('address_two'),
-                        mailing_address.get('city'),
-                        mailing_address.get('state'),
-                        mailing_address.get('zip'),
-                        ", ".join(u.email for u in r.agency_users)])
-            start += ALL_RESULTS_CHUNKSIZE
-            if start > total:
-                break
-        if total != 0:
-            dt = datetime.utcnow()
-            timestamp = utc_to_local(dt, tz_name) if tz_name is not None else dt
-            return send_file(
-                BytesIO(buffer.getvalue().encode('UTF-8')),  # convert to bytes
-                attachment_filename="FOIL_requests_results_{}.csv".format(
-                    timestamp.strftime("%m_%d_%Y_at_%I_%M_%p")),
-                as_attachment=True
-            )
+        hits = search_requests(
+            request.args.get('query'),
+            eval_request_bool(request.args.get('foil_id')),
+            eval_request_bool(request.args.get('title')),
+            eval_request_bool(request.args.get('agency_request_summary')),
+            eval_request_bool(request.args.get('description')),
+            eval_request_bool(request.args.get('requester_name')),
+            request.args.get('date_rec_from'),
+            request.args.get('date_rec_to'),
+            request.args.get('date_due_from'),
+            request.args.get('date_due_to'),
+            request.args.get('date_closed_from'),
+            request.args.get('date_closed_to'),
+            agency_ein,
+            eval_request_bool(request.args.get('open')),
+            eval_request_bool(request.args.get('closed')),
+            eval_request_bool(request.args.get('in_progress')),
+            eval_request_bool(request.args.get('due_soon')),
+            eval_request_bool(request.args.get('overdue')),
+            ALL_RESULTS_CHUNKSIZE,
+            0,
+            request.args.get('sort_date_submitted'),
+            request.args.get('sort_date_due'),
+            request.args.get('sort_title'),
+            tz_name,
+            for_csv=True,
+            stream=True
+        )
+
+        # peek at the first hit so an empty result set is still a bad request
+        try:
+            first_hit = next(hits)
+        except StopIteration:
+            return '', 400
+
+        dt = datetime.utcnow()
+        timestamp = utc_to_local(dt, tz_name) if tz_name is not None else dt
+        return Response(
+            stream_with_context(_generate_csv(chain([first_hit], hits), tz_name)),
+            mimetype='text/csv',
+            headers={
+                'Content-Disposition': 'attachment; filename=FOIL_requests_results_{}.csv'.format(
+                    timestamp.strftime("%m_%d_%Y_at_%I_%M_%p"))
+            }
+        )
     return '', 400
+
+
+def _generate_csv(hits, tz_name):
+    """
+    Yield the lines of a request search results CSV, one row at a time.
+
+    :param hits: iterable of elasticsearch request hits
+    :param tz_name: timezone name used to localize dates
+    """
+    buffer = StringIO()  # re-used for every row
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return line
+
+    writer.writerow(["FOIL ID",
+                     "Agency",
+                     "Title",
+                     "Description",
+                     "Agency Description",
+                     "Current Status",
+                     "Date Created",
+                     "Date Received",
+                     "Date Due",
+                     "Date Closed",
+                     "Requester Name",
+                     "Requester Email",
+                     "Requester Title",
+                     "Requester Organization",
+                     "Requester Phone Number",
+                     "Requester Fax Number",
+                     "Requester Address 1",
+                     "Requester Address 2",
+                     "Requester City",
+                     "Requester State",
+                     "Requester Zipcode",
+                     "Assigned User Emails"])
+    yield flush()
+
+    hits = iter(hits)
+    while True:
+        page = list(islice(hits, ALL_RESULTS_CHUNKSIZE))
+        if not page:
+            break
+        # docs indexed before agency-only fields were added fall back to the database
+        requests_ = hydrate_requests([result["_id"] for result in page
+                                      if "assigned_user_emails" not in result["_source"]])
+        for result in page:
+            convert_hit_dates(result, tz_name=tz_name)
+            if result["_id"] in requests_:
+                result["_source"].update(requests_[result["_id"]].es_agency_only_fields)
+            mailing_address = result["_source"]["requester_mailing_address"]
+            date_closed = result["_source"].get('date_closed', '')
+            date_closed = date_closed if str(date_closed) != str(list()) else ''
+            writer.writerow([
+                result["_id"],
+                result["_source"]["agency_name"],
+                result["_source"]["title"],
+                result["_source"]["description"],
+                result["_source"]["agency_request_summary"],
+                result["_source"]["status"],
+                result["_source"]["date_created"],
+                result["_source"]["date_submitted"],
+                result["_source"]["date_due"],
+                date_closed,
+                result["_source"]["requester_name"],
+                result["_source"]["requester_email"],
+                result["_source"]["requester_title"],
+                result["_source"]["requester_organization"],
+                result["_source"]["requester_phone_number"],
+                result["_source"]["requester_fax_number"],
+                mailing_address.get('address_one'),
+                mailing_address.get('address_two'),
+                mailing_address.get('city'),
+                mailing_address.get('state'),
+                mailing_address.get('zip'),
+                ", ".join(result["_source"]["assigned_user_emails"])])
+            yield flush()
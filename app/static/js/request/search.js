@@ -6,6 +6,8 @@ $(function() {
     $("input[name='tz_name']").val(jstz.determine().name());
 
     var start = 0,
+        cursors = [""],  // cursors[i] is the cursor of page i
+        nextCursor = null,
         end = 0,
         total = 0,
         canSearch = true,
@@ -216,6 +218,7 @@ $(function() {
                         " of " + data.total
                     );
                     total = data.total;
+                    nextCursor = data.cursor;
                     end = start + data.count;
                     if (end === total) {
                         next.hide();
@@ -274,9 +277,53 @@ $(function() {
         }
     });
 
+    // title suggestions (search-as-you-type)
+    $("#query").autocomplete({
+        minLength: 2,
+        delay: 150,
+        source: function (request, response) {
+            if ($("input[name='foil_id']").is(":checked")) {
+                response([]);
+                return;
+            }
+            $.ajax({
+                url: "/search/suggest",
+                data: {query: request.term},
+                success: function (data) {
+                    response($.map(data.suggestions, function (suggestion) {
+                        return {label: suggestion.title, value: suggestion.title};
+                    }));
+                },
+                error: function () {
+                    response([]);
+                }
+            });
+        },
+        select: function (event, ui) {
+            $(this).val(ui.item.value);
+            searchBtn.click();
+        }
+    });
+
     function setStart(val) {
+        /*
+        * Set the result offset and the cursor of the page starting at it.
+        * Pages are fetched with cursors (see /search/requests); the offset
+        * is only used if no cursor is known for the page.
+        * */
+        var page = Math.floor(val / parseInt($("#size").val()));
+        if (val === 0) {
+            cursors = [""];
+        }
+        else if (page === cursors.length && nextCursor) {
+            cursors.push(nextCursor);
+        }
+        else {
+            cursors = cursors.slice(0, page + 1);
+        }
         start = val;
         $("input[name='start']").val(val);
+        $("input[name='cursor']").val(cursors[page] || "");
     }
 
     // Sorting
@@ -312,6 +359,24 @@ $(function() {
         }
     }
 
+    $("#save-search").click(function () {
+        var status = $("#save-search-status");
+        var data = $("#search-form").serializeArray();
+        data.push({name: "name", value: $("#saved-search-name").val()});
+        data.push({name: "csrf_token", value: $("#saved-search-csrf-token").val()});
+        $.ajax({
+            url: "/search/saved",
+            type: "POST",
+            data: data,
+            success: function () {
+                status.text("Saved. New matching requests will be emailed to you.");
+            },
+            error: function () {
+                status.text("Enter a name and select at least one field to query.");
+            }
+        });
+    });
+
     generateDocBtn.click(function () {
         if (canSearch) {
             search();
@@ -2,7 +2,7 @@ from datetime import datetime
 
 from sqlalchemy.orm.exc import NoResultFound, MultipleResultsFound
 
-from flask import request, jsonify
+from flask import current_app, request, jsonify
 from flask_login import current_user
 
 from app.user import user
@@ -22,6 +22,7 @@ from app.lib.db_utils import (
     delete_object,
 )
 from app.lib.utils import eval_request_bool
+from app.search.utils import update_request_docs
 
 
 @user.route('/<user_id>', methods=['PATCH'])
@@ -280,9 +281,13 @@ def patch(user_id):
 
                 if is_agency_active is not None and not is_agency_active:
                     # remove ALL UserRequests
+                    request_ids = []
                     for user_request in user_.user_requests.all():
                         create_user_request_event(event_type.USER_REMOVED, user_request)
+                        request_ids.append(user_request.request_id)
                         delete_object(user_request)
+                    if current_app.config['ELASTICSEARCH_ENABLED']:
+                        update_request_docs(request_ids)
                 elif is_agency_admin is not None:
 
                     def set_permissions_and_create_event(user_req, perms):
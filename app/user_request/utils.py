@@ -1,6 +1,7 @@
 from datetime import datetime
 from urllib.parse import urljoin
 from flask import (
+    current_app,
     request as flask_request,
     render_template,
     url_for
@@ -194,8 +195,13 @@ def remove_user_request(request_id, user_guid):
         to=[user_request.user.email])
 
     create_user_request_event(event_type.USER_REMOVED, user_request)
+    request = user_request.request
     delete_object(user_request)
 
+    # assigned user emails are stored in the request es doc
+    if current_app.config['ELASTICSEARCH_ENABLED']:
+        request.es_update()
+
 
 def create_user_request_event(events_type, user_request, old_permissions=None, user=current_user):
     """
@@ -0,0 +1,267 @@
+"""
+.. module:: benchmarks
+
+   :synopsis: Shared helpers for search benchmarks run against a synthetic corpus
+
+Benchmarks create the flask app with the 'testing' configuration, their own
+database (BENCHMARK_DATABASE_URL, every table of which may be dropped) and
+their own elasticsearch index alias, so they can be run alongside a
+development database and index, e.g.:
+
+    python -m benchmarks.search_dsl --docs 100000
+"""
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from elasticsearch.helpers import streaming_bulk
+from sqlalchemy.engine.url import make_url
+
+from app import create_app, es
+from app.constants import ES_DATETIME_FORMAT, USER_ID_DELIMITER, request_status, user_type_auth
+
+BENCHMARK_INDEX = 'requests_benchmark'
+BENCHMARK_DATABASE_URI = (os.environ.get('BENCHMARK_DATABASE_URL') or
+                          'postgresql://localhost:5432/openrecords_v2_0_benchmark')
+
+WORDS = (
+    'police report accident records contract budget inspection permit violation complaint '
+    'school building water health housing emails correspondence salary payroll overtime '
+    'arrest video camera footage license agreement invoice payment vendor audit policy '
+    'memo minutes meeting schedule noise parking ticket traffic street sanitation tree '
+    'fire department hospital restaurant grade lease property tax assessment zoning'
+).split()
+
+STATUSES = (
+    request_status.OPEN,
+    request_status.IN_PROGRESS,
+    request_status.DUE_SOON,
+    request_status.OVERDUE,
+    request_status.CLOSED,
+)
+
+AGENCY_EINS = ['{:04d}'.format(ein) for ein in range(2, 60)]
+
+
+def create_benchmark_app():
+    """
+    Create the app with the testing configuration and push its context,
+    pointing the database at BENCHMARK_DATABASE_URI and ELASTICSEARCH_INDEX
+    at the benchmark alias.
+    """
+    app = create_app('testing', jobs_enabled=False)
+    app.config['SQLALCHEMY_DATABASE_URI'] = BENCHMARK_DATABASE_URI
+    app.config['ELASTICSEARCH_INDEX'] = BENCHMARK_INDEX
+    app.config['SEARCH_CACHE_TTL'] = 0
+    app.config['SEARCH_CACHE_AGENCY_TTL'] = 0
+    app.app_context().push()
+    return app
+
+
+def synthetic_request_id(i):
+    return 'FOIL-{year}-{ein}-{num:05d}'.format(
+        year=2016 + i % 3,
+        ein=AGENCY_EINS[i % len(AGENCY_EINS)][1:],
+        num=i // len(AGENCY_EINS) % 100000
+    )
+
+
+def synthetic_docs(num_docs, seed=0):
+    """
+    Generate (request id, doc) tuples of synthetic request docs.
+
+    :param num_docs: number of docs to generate
+    :param seed: random seed, so corpora are reproducible across benchmarks
+    """
+    rand = random.Random(seed)
+    now = datetime.utcnow()
+
+    def text(num_words):
+        return ' '.join(rand.choice(WORDS) for _ in range(num_words))
+
+    for i in range(num_docs):
+        agency_ein = AGENCY_EINS[i % len(AGENCY_EINS)]
+        date_created = now - timedelta(days=rand.randint(0, 3 * 365))
+        date_due = date_created + timedelta(days=rand.randint(5, 60))
+        status = rand.choice(STATUSES)
+        title = text(rand.randint(3, 12))
+        title_private = rand.random() < 0.3
+        agency_request_summary = text(rand.randint(0, 50))
+        agency_request_summary_private = rand.random() < 0.5
+        requester_id = USER_ID_DELIMITER.join(('requester{}'.format(rand.randint(0, num_docs // 10)),
+                                               user_type_auth.PUBLIC_USER_NYC_ID))
+        request_id = synthetic_request_id(i)
+        yield request_id, {
+            'foil_id': request_id,
+            'title': title,
+            'description': text(rand.randint(20, 200)),
+            'agency_request_summary': agency_request_summary,
+            'agency_ein': agency_ein,
+            'agency_name': 'Agency {}'.format(agency_ein),
+            'agency_acronym': 'A{}'.format(agency_ein),
+            'title_private': title_private,
+            'agency_request_summary_private': agency_request_summary_private,
+            'date_created': date_created.strftime(ES_DATETIME_FORMAT),
+            'date_submitted': date_created.strftime(ES_DATETIME_FORMAT),
+            'date_received': date_created.strftime(ES_DATETIME_FORMAT),
+            'date_due': date_due.strftime(ES_DATETIME_FORMAT),
+            'date_closed': date_due.strftime(ES_DATETIME_FORMAT) if status == request_status.CLOSED else [],
+            'status': status,
+            'requester_id': requester_id,
+            'requester_name': text(2).title(),
+            'public_title': title if not title_private else None,
+            'public_agency_request_summary': agency_request_summary if not agency_request_summary_private else None,
+        }
+
+
+def load_synthetic_corpus(num_docs, seed=0):
+    """
+    (Re)create the benchmark index and load it with synthetic request docs.
+    """
+    from app.search.utils import create_index, delete_index
+    delete_index()
+    index = create_index()
+    for _ in streaming_bulk(
+            es,
+            ({'_op_type': 'index', '_id': request_id, '_source': doc}
+             for request_id, doc in synthetic_docs(num_docs, seed)),
+            index=index,
+            doc_type='request',
+            chunk_size=1000,
+            raise_on_error=True):
+        pass
+    es.indices.refresh(index=index)
+    es.indices.forcemerge(index=index, max_num_segments=1)
+    return index
+
+
+def load_synthetic_corpus_postgres(num_docs, seed=0):
+    """
+    Recreate the tables of the database and load them with the synthetic requests
+    of load_synthetic_corpus (with their agencies and requesters), along with the
+    full-text search indexes of the postgres search backend.
+
+    This drops every table of the benchmark database (BENCHMARK_DATABASE_URI)
+    and refuses to run against any other database.
+    """
+    from flask import current_app
+    from app import db
+    from app.models import Agencies
+
+    if not current_app.config['TESTING'] or db.engine.url != make_url(BENCHMARK_DATABASE_URI):
+        raise RuntimeError("Refusing to drop the tables of '{}': not the benchmark database ({}).".format(
+            db.engine.url, BENCHMARK_DATABASE_URI))
+    db.drop_all()
+    db.create_all()
+    db.session.execute(Agencies.__table__.insert(), [
+        {'ein': ein, 'name': 'Agency {}'.format(ein), 'acronym': 'A{}'.format(ein), 'is_active': True}
+        for ein in AGENCY_EINS
+    ])
+    requesters = set()
+    batch = []
+    for request_id, doc in synthetic_docs(num_docs, seed):
+        batch.append((request_id, doc))
+        if len(batch) == 1000:
+            _insert_requests(batch, requesters)
+            batch = []
+    _insert_requests(batch, requesters)
+
+    for statement in (
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX ix_requests_title_tsv ON requests "
+        "USING gin (to_tsvector('english'::regconfig, coalesce(title, '')))",
+        "CREATE INDEX ix_requests_description_tsv ON requests "
+        "USING gin (to_tsvector('english'::regconfig, coalesce(description, '')))",
+        "CREATE INDEX ix_requests_agency_request_summary_tsv ON requests "
+        "USING gin (to_tsvector('english'::regconfig, coalesce(agency_request_summary, '')))",
+        "CREATE INDEX ix_requests_id_trgm ON requests USING gin (id gin_trgm_ops)",
+        "ANALYZE",
+    ):
+        db.session.execute(statement)
+    db.session.commit()
+
+
+def _insert_requests(docs, requesters):
+    from app import db
+    from app.constants import submission_methods, user_type_request
+    from app.models import Requests, UserRequests, Users
+
+    if not docs:
+        return
+    new_requesters = {doc['requester_id'] for _, doc in docs} - requesters
+    requesters.update(new_requesters)
+    if new_requesters:
+        db.session.execute(Users.__table__.insert(), [
+            {
+                'guid': requester_id.split(USER_ID_DELIMITER)[0],
+                'auth_user_type': user_type_auth.PUBLIC_USER_NYC_ID,
+                'first_name': requester_id.split(USER_ID_DELIMITER)[0],
+                'last_name': 'Requester',
+                'email_validated': True,
+                'is_super': False,
+            } for requester_id in new_requesters
+        ])
+
+    def parse(datestr):
+        return datetime.strptime(datestr, ES_DATETIME_FORMAT)
+
+    db.session.execute(Requests.__table__.insert(), [
+        {
+            'id': request_id,
+            'agency_ein': doc['agency_ein'],
+            'category': 'All',
+            'title': doc['title'],
+            'description': doc['description'],
+            'agency_request_summary': doc['agency_request_summary'],
+            'agency_request_summary_release_date': parse(doc['date_created']),
+            'date_created': parse(doc['date_created']),
+            'date_submitted': parse(doc['date_submitted']),
+            'due_date': parse(doc['date_due']),
+            'submission': submission_methods.DIRECT_INPUT,
+            'status': doc['status'],
+            'privacy': {
+                'title': doc['title_private'],
+                'agency_request_summary': doc['agency_request_summary_private'],
+            },
+        } for request_id, doc in docs
+    ])
+    db.session.execute(UserRequests.__table__.insert(), [
+        {
+            'user_guid': doc['requester_id'].split(USER_ID_DELIMITER)[0],
+            'auth_user_type': user_type_auth.PUBLIC_USER_NYC_ID,
+            'request_id': request_id,
+            'request_user_type': user_type_request.REQUESTER,
+        } for request_id, doc in docs
+    ])
+
+
+def time_calls(func, iterations, warmup=5):
+    """
+    Call func repeatedly and return latency statistics in milliseconds.
+    """
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        'mean': statistics.mean(timings),
+        'p50': timings[len(timings) // 2],
+        'p95': timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def print_results(title, rows):
+    """
+    Print a table of (name, stats) rows as returned by time_calls.
+    """
+    print(title)
+    print('{:40} {:>10} {:>10} {:>10}'.format('', 'mean (ms)', 'p50 (ms)', 'p95 (ms)'))
+    for name, stats in rows:
+        print('{:40} {:>10.2f} {:>10.2f} {:>10.2f}'.format(name, stats['mean'], stats['p50'], stats['p95']))
+    print()
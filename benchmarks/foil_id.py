@@ -0,0 +1,69 @@
+"""
+.. module:: benchmarks.foil_id
+
+   :synopsis: Compare FOIL ID lookups against the previous _uid wildcard query
+
+    python -m benchmarks.foil_id [--docs N] [--iterations N]
+"""
+import argparse
+import random
+
+from benchmarks import (
+    STATUSES,
+    create_benchmark_app,
+    load_synthetic_corpus,
+    synthetic_request_id,
+    time_calls,
+    print_results,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=500000)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    create_benchmark_app()
+    from app import es
+    from app.search.utils import RequestsDSLGenerator
+    index = load_synthetic_corpus(args.docs)
+
+    rand = random.Random(1)
+    request_ids = [synthetic_request_id(rand.randrange(args.docs)) for _ in range(args.iterations)]
+    queries = {
+        'complete': [request_id[len('FOIL-'):] for request_id in request_ids],
+        'prefix (2 chars)': [request_id[len('FOIL-'):len('FOIL-') + 2] for request_id in request_ids],
+        'infix (agency and number)': [request_id[len('FOIL-YYYY-'):] for request_id in request_ids],
+        'suffix (number)': [request_id[-5:] for request_id in request_ids],
+    }
+
+    def search(dsl):
+        es.search(index=index, doc_type='request', body=dsl, size=50, _source=['title', 'status'])
+
+    def legacy_dsl(query):
+        return {'query': {'bool': {'filter': [
+            {'wildcard': {'_uid': 'request#FOIL-*{}*'.format(query)}},
+            {'terms': {'status': list(STATUSES)}}
+        ]}}}
+
+    def dsl(query):
+        return RequestsDSLGenerator(query, {}, list(STATUSES), [], None, 'match').foil_id()
+
+    def timed(make_dsl, query_list):
+        queries_ = iter(query_list * 2)
+        return time_calls(lambda: search(make_dsl(next(queries_))), len(query_list), warmup=0)
+
+    rows = []
+    for name, query_list in queries.items():
+        rows.append(('{} / wildcard _uid'.format(name), timed(legacy_dsl, query_list)))
+        rows.append(('{} / foil_id'.format(name), timed(dsl, query_list)))
+    get_ids = iter(request_ids)
+    rows.append(('complete / GET', time_calls(
+        lambda: es.get(index=index, doc_type='request', id=next(get_ids), _source=['title', 'status']),
+        len(request_ids), warmup=0)))
+    print_results('FOIL ID lookups ({} docs)'.format(args.docs), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+.. module:: benchmarks.search_dsl
+
+   :synopsis: Compare filter-context and query-context request search DSL
+
+Runs the agency, public and anonymous query shapes generated by
+RequestsDSLGenerator against a synthetic corpus, as generated (non-text
+clauses in filter context) and with every filter moved back into query
+context (the previous shape, where all clauses are scored and uncached).
+
+    python -m benchmarks.search_dsl [--docs N] [--iterations N]
+"""
+import argparse
+from copy import deepcopy
+from unittest.mock import patch
+
+from benchmarks import (
+    create_benchmark_app,
+    load_synthetic_corpus,
+    time_calls,
+    print_results,
+)
+
+
+class BenchmarkUser(object):
+    is_agency = False
+    is_anonymous = False
+    is_public = True
+
+    @staticmethod
+    def get_id():
+        return 'requester1|EDIRSSO'
+
+
+def to_query_context(clause):
+    """
+    Return a copy of a query dsl clause with every bool 'filter' moved into 'must'.
+    """
+    if isinstance(clause, list):
+        return [to_query_context(c) for c in clause]
+    if not isinstance(clause, dict):
+        return clause
+    clause = {key: to_query_context(value) for key, value in clause.items()}
+    bool_ = clause.get('bool')
+    if isinstance(bool_, dict) and 'filter' in bool_:
+        bool_['must'] = bool_.get('must', []) + bool_.pop('filter')
+    return clause
+
+
+def query_shapes():
+    from app.constants import request_status
+    from app.search.utils import RequestsDSLGenerator
+
+    statuses = [request_status.OPEN, request_status.IN_PROGRESS, request_status.DUE_SOON, request_status.OVERDUE]
+    date_ranges = [{'range': {'date_received': {'gte': '01/01/2017', 'format': 'MM/dd/yyyy'}}}]
+    fields = {
+        'title': True,
+        'description': True,
+        'agency_request_summary': True,
+        'requester_name': True,
+    }
+
+    with patch('app.search.utils.current_user', BenchmarkUser):
+        return {
+            'agency': RequestsDSLGenerator(
+                'police report', fields, statuses, date_ranges, '0002', 'match').agency_user(),
+            'public': RequestsDSLGenerator(
+                'police report', fields, statuses, date_ranges, None, 'match').public_user(),
+            'anonymous': RequestsDSLGenerator(
+                'police report', fields, statuses, date_ranges, None, 'match').anonymous_user(),
+            'queryless (agency)': RequestsDSLGenerator(
+                None, fields, statuses, date_ranges, '0002', 'match').queryless(),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    create_benchmark_app()
+    from app import es
+    index = load_synthetic_corpus(args.docs)
+
+    rows = []
+    for name, dsl in query_shapes().items():
+        for label, body in (('filter context', dsl), ('query context', to_query_context(deepcopy(dsl)))):
+            rows.append(('{} / {}'.format(name, label), time_calls(
+                lambda: es.search(index=index, doc_type='request', body=body, size=50,
+                                  sort=['date_received:desc'], _source=['title', 'status']),
+                args.iterations
+            )))
+    print_results('Request search DSL ({} docs)'.format(args.docs), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+.. module:: benchmarks.search_engines
+
+   :synopsis: Compare the elasticsearch and postgres search backends
+
+Loads the same synthetic corpus into elasticsearch and into the benchmark
+database (BENCHMARK_DATABASE_URL, every table of which is dropped and recreated) and runs
+the same searches through search_requests with each SEARCH_BACKEND.
+
+    python -m benchmarks.search_engines [--docs N] [--iterations N]
+"""
+import argparse
+from unittest.mock import patch
+
+from benchmarks import (
+    create_benchmark_app,
+    load_synthetic_corpus,
+    load_synthetic_corpus_postgres,
+    time_calls,
+    print_results,
+)
+
+
+class BenchmarkUser(object):
+    is_agency = False
+    is_anonymous = False
+    is_public = False
+    guid = None
+    auth_user_type = None
+
+    def get_id(self):
+        return '{}|{}'.format(self.guid, self.auth_user_type)
+
+
+class AgencyUser(BenchmarkUser):
+    is_agency = True
+
+
+class AnonymousUser(BenchmarkUser):
+    is_anonymous = True
+
+
+class PublicUser(BenchmarkUser):
+    is_public = True
+    guid = 'requester1'
+    auth_user_type = 'EDIRSSO'
+
+
+SEARCHES = {
+    'agency, query': (AgencyUser(), {'query': 'police report'}),
+    'agency, query, single agency': (AgencyUser(), {'query': 'police report', 'agency_ein': '0002'}),
+    'agency, no query': (AgencyUser(), {'query': ''}),
+    'agency, partial FOIL ID': (AgencyUser(), {'query': '002-001', 'foil_id': True}),
+    'public, query': (PublicUser(), {'query': 'police report'}),
+    'anonymous, query': (AnonymousUser(), {'query': 'police report'}),
+    'anonymous, no query': (AnonymousUser(), {'query': ''}),
+}
+
+
+def search(user, query, foil_id=False, agency_ein=None):
+    from app.search.utils import search_requests
+    with patch('app.search.utils.current_user', user), patch('app.search.postgres.current_user', user):
+        return search_requests(
+            query,
+            foil_id,
+            True,  # title
+            True,  # agency_request_summary
+            not user.is_anonymous,  # description
+            False,  # requester_name
+            None, None, None, None, None, None,  # date ranges
+            agency_ein,
+            True, True, True, True, True,  # statuses
+            50,
+            0,
+            None,
+            'desc',  # sort_date_due
+            None,
+            None,
+            source_profile='listing'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    app = create_benchmark_app()
+    load_synthetic_corpus(args.docs)
+    load_synthetic_corpus_postgres(args.docs)
+
+    rows = []
+    for name, (user, kwargs) in SEARCHES.items():
+        for backend in ('elasticsearch', 'postgres'):
+            app.config['SEARCH_BACKEND'] = backend
+            rows.append(('{} / {}'.format(name, backend),
+                         time_calls(lambda: search(user, **kwargs), args.iterations)))
+    print_results('Search backends ({} docs)'.format(args.docs), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,3 +9,5 @@ from app import celery, create_app
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default', jobs_enabled=False)  # FIXME: creating app twice?!
 app.app_context().push()
+
+import jobs  # registers the celery tasks of scheduled jobs
@@ -1,5 +1,5 @@
 import os
-from datetime import timedelta
+from datetime import date, timedelta
 
 from dotenv import load_dotenv
 
@@ -36,6 +36,13 @@ class Config:
                              os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app', 'constants', 'schemas'))
 
     DUE_SOON_DAYS_THRESHOLD = os.environ.get('DUE_SOON_DAYS_THRESHOLD') or 2
+    # Derive Due Soon and Overdue from due dates when requests are read instead of
+    # storing them nightly (see Requests.derive_status)
+    DERIVED_REQUEST_STATUSES = os.environ.get('DERIVED_REQUEST_STATUSES') == "True"
+
+    # Business-day calendar (years of the holiday list, see app.lib.calendar_utils)
+    BUSINESS_CALENDAR_FIRST_YEAR = int(os.environ.get('BUSINESS_CALENDAR_FIRST_YEAR') or date.today().year)
+    BUSINESS_CALENDAR_LAST_YEAR = int(os.environ.get('BUSINESS_CALENDAR_LAST_YEAR') or date.today().year + 4)
 
     # SFTP
     USE_SFTP = os.environ.get('USE_SFTP') == "True"
@@ -74,6 +81,8 @@ class Config:
     SESSION_REDIS_DB = 1
     UPLOAD_REDIS_DB = 2
     EMAIL_REDIS_DB = 3
+    SEARCH_REDIS_DB = 4
+    SCHEDULER_REDIS_DB = 5
 
     # Celery Settings
     CELERY_BROKER_URL = 'redis://{redis_host}:{redis_port}/{celery_redis_db}'.format(
@@ -124,7 +133,15 @@ class Config:
     # ElasticSearch settings
     ELASTICSEARCH_HOST = os.environ.get('ELASTICSEARCH_HOST') or "localhost:9200"
     ELASTICSEARCH_ENABLED = os.environ.get('ELASTICSEARCH_ENABLED') == "True"
-    ELASTICSEARCH_INDEX = os.environ.get('ELASTICSEARCH_INDEX') or "requests"
+    ELASTICSEARCH_INDEX = os.environ.get('ELASTICSEARCH_INDEX') or "requests"  # alias of the current index
+    ELASTICSEARCH_NUMBER_OF_REPLICAS = int(os.environ.get('ELASTICSEARCH_NUMBER_OF_REPLICAS', 1))
+    ELASTICSEARCH_REFRESH_INTERVAL = os.environ.get('ELASTICSEARCH_REFRESH_INTERVAL') or "1s"
+    ELASTICSEARCH_NUMBER_OF_SHARDS = int(os.environ.get('ELASTICSEARCH_NUMBER_OF_SHARDS', 5))  # new indices only
+    # Route request docs to shards by agency ein, so searches of a single agency hit a single shard.
+    # Only indices created while this is enabled are routed, so enabling it takes effect once the index
+    # has been recreated (`manage.py es_recreate`); docs are routed as their index requires either way
+    # (see app.search.utils.is_index_routed).
+    ELASTICSEARCH_ROUTE_BY_AGENCY = os.environ.get('ELASTICSEARCH_ROUTE_BY_AGENCY') == "True"
     ELASTICSEARCH_USE_SSL = os.environ.get('ELASTICSEARCH_USE_SSL') == "True"
     ELASTICSEARCH_VERIFY_CERTS = os.environ.get('ELASTICSEARCH_VERIFY_CERTS') == "True"
     ELASTICSEARCH_USERNAME = os.environ.get('ELASTICSEARCH_USERNAME')
@@ -134,6 +151,39 @@ class Config:
                                if ELASTICSEARCH_USERNAME and ELASTICSEARCH_PASSWORD
                                else None)
 
+    # client (see app.lib.es_client)
+    ELASTICSEARCH_MAX_CONNECTIONS = int(os.environ.get('ELASTICSEARCH_MAX_CONNECTIONS', 10))  # per node
+    ELASTICSEARCH_TIMEOUT = int(os.environ.get('ELASTICSEARCH_TIMEOUT', 10))  # seconds
+    ELASTICSEARCH_SNIFF = os.environ.get('ELASTICSEARCH_SNIFF') == "True"
+    ELASTICSEARCH_SNIFFER_TIMEOUT = int(os.environ.get('ELASTICSEARCH_SNIFFER_TIMEOUT', 60))  # seconds
+    ELASTICSEARCH_MAX_RETRIES = int(os.environ.get('ELASTICSEARCH_MAX_RETRIES', 3))
+    ELASTICSEARCH_RETRY_BACKOFF = float(os.environ.get('ELASTICSEARCH_RETRY_BACKOFF', 0.1))  # seconds
+    ELASTICSEARCH_LATENCY_METRICS = os.environ.get('ELASTICSEARCH_LATENCY_METRICS') == "True"
+
+    # queue request doc updates and flush them in bulk from a celery task
+    ELASTICSEARCH_ASYNC_UPDATES = os.environ.get('ELASTICSEARCH_ASYNC_UPDATES') == "True"
+    ELASTICSEARCH_ASYNC_UPDATES_DELAY = int(os.environ.get('ELASTICSEARCH_ASYNC_UPDATES_DELAY', 2))  # seconds
+    ELASTICSEARCH_SYNC_CHUNKSIZE = int(os.environ.get('ELASTICSEARCH_SYNC_CHUNKSIZE', 1000))
+    ELASTICSEARCH_SYNC_THREAD_COUNT = int(os.environ.get('ELASTICSEARCH_SYNC_THREAD_COUNT', 4))
+    # seconds re-checked by every sync, at least the longest transaction (see app.search.utils.update_docs)
+    ELASTICSEARCH_SYNC_WATERMARK_MARGIN = int(os.environ.get('ELASTICSEARCH_SYNC_WATERMARK_MARGIN', 300))
+
+    # Search backend ("elasticsearch" or "postgres"; see app.search.utils.get_search_backend)
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'elasticsearch'
+
+    # Seconds before another process takes over running scheduled jobs
+    # from a leader that stopped renewing its lock (see app.lib.scheduler_utils)
+    SCHEDULER_LEADER_TTL = int(os.environ.get('SCHEDULER_LEADER_TTL', 30))
+
+    # Minutes between emails of new requests matching saved searches
+    SAVED_SEARCH_DIGEST_INTERVAL = int(os.environ.get('SAVED_SEARCH_DIGEST_INTERVAL', 60))
+
+    # Search result cache (seconds; 0 disables caching)
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 60))  # anonymous and public users
+    SEARCH_CACHE_AGENCY_TTL = int(os.environ.get('SEARCH_CACHE_AGENCY_TTL', 0))
+    # seconds within which doc writes are visible to searches (at least ELASTICSEARCH_REFRESH_INTERVAL)
+    SEARCH_CACHE_REFRESH_DELAY = int(os.environ.get('SEARCH_CACHE_REFRESH_DELAY', 1))
+
     # https://www.elastic.co/blog/index-vs-type
 
     SENTRY_DSN = os.environ.get('SENTRY_DSN')
@@ -169,11 +219,14 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = (os.environ.get('TEST_DATABASE_URL') or
                                'postgresql://localhost:5432/openrecords_v2_0_test')
     ELASTICSEARCH_INDEX = os.environ.get('ELASTICSEARCH_INDEX') or "requests_test"
+    ELASTICSEARCH_ASYNC_UPDATES = False
+    SEARCH_CACHE_TTL = 0
 
 
 class ProductionConfig(Config):
     VIRUS_SCAN_ENABLED = True
     ELASTICSEARCH_ENABLED = True
+    ELASTICSEARCH_ASYNC_UPDATES = os.environ.get('ELASTICSEARCH_ASYNC_UPDATES', "True") == "True"
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
 
@@ -1,16 +1,27 @@
 import traceback
 from datetime import datetime
+from itertools import chain
 from flask import (
     render_template,
     current_app,
 )
-from app import calendar, scheduler
-from app.models import Requests, Events, Emails, Agencies
-from app.constants import request_status, OPENRECORDS_DL_EMAIL
+from sqlalchemy import and_
+from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import SQLAlchemyError
+from celery import chord
+from app import celery, db, scheduler
+from app.models import Requests, Events, Emails, Agencies, Determinations
+from app.constants import determination_type, request_status, OPENRECORDS_DL_EMAIL
 from app.constants.event_type import EMAIL_NOTIFICATION_SENT, REQ_STATUS_CHANGED
 from app.constants.response_privacy import PRIVATE
-from app.lib.db_utils import update_object, create_object
+from app.lib.date_utils import get_due_date_bounds
+from app.lib.db_utils import create_object
 from app.lib.email_utils import send_email
+from app.search.utils import (
+    bulk_update_docs,
+    queue_doc_updates,
+    send_saved_search_digests as _send_saved_search_digests,
+)
 
 # NOTE: (For Future Reference)
 # If we find ourselves in need of a request context, app.test_request_context() might come in handy.
@@ -43,132 +54,265 @@ def update_request_statuses():
             )
 
 
+def send_saved_search_digests():
+    """
+    Email agency users the new requests matching their saved searches.
+    """
+    with scheduler.app.app_context():
+        _send_saved_search_digests()
+
+
+def _transition_request_statuses(now, today, due_later_date):
+    """
+    Set the status of every open request (of an active agency) that is now
+    Overdue or Due Soon with one UPDATE ... RETURNING per status, and insert
+    their status change events at once, in a single transaction.
+    The docs of the changed requests are then updated in one bulk call.
+
+    :param now: current (utc) datetime
+    :param today: (utc) start of today (see get_due_date_bounds)
+    :param due_later_date: (utc) start of the first day after the due soon period
+    :return: ids of the requests whose status changed
+    """
+    active_agencies = db.session.query(Agencies.ein).filter(Agencies.is_active == True)
+    transitions = (
+        (request_status.OVERDUE, Requests.due_date < today),
+        (request_status.DUE_SOON, and_(Requests.due_date >= today, Requests.due_date < due_later_date)),
+    )
+    events = []
+    try:
+        for status, due_date_condition in transitions:
+            # previous statuses (locked until the status is updated)
+            previous = db.session.query(Requests.id, Requests.status).filter(
+                due_date_condition,
+                Requests.status.notin_((request_status.CLOSED, status)),
+                Requests.agency_ein.in_(active_agencies.subquery())
+            ).with_for_update().subquery()
+            changed = db.session.execute(
+                Requests.__table__.update().where(
+                    Requests.id == previous.c.id
+                ).values(
+                    status=status
+                ).returning(Requests.id, previous.c.status)
+            ).fetchall()
+            events.extend({
+                'request_id': request_id,
+                'user_guid': None,
+                'auth_user_type': None,
+                'type': REQ_STATUS_CHANGED,
+                'previous_value': {'status': previous_status},
+                'new_value': {'status': status},
+                'response_id': None,
+                'timestamp': now,
+            } for request_id, previous_status in changed)
+        if events:
+            db.session.bulk_insert_mappings(Events, events)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+
+    request_ids = [event['request_id'] for event in events]
+    if request_ids and current_app.config['ELASTICSEARCH_ENABLED']:
+        _, retry_ids = bulk_update_docs(request_ids)
+        if retry_ids:
+            queue_doc_updates(retry_ids)
+    return request_ids
+
+
+def _late_requests_query(today, due_later_date):
+    """
+    Return a query of the open requests of active agencies that are Overdue or Due Soon,
+    as derived by Requests.derive_status.
+
+    :param today: (utc) start of today (see get_due_date_bounds)
+    :param due_later_date: (utc) start of the first day after the due soon period
+    """
+    return Requests.query.join(
+        Agencies, Requests.agency_ein == Agencies.ein
+    ).filter(
+        Agencies.is_active == True,
+        Requests.status != request_status.CLOSED,
+        Requests.due_date < due_later_date
+    )
+
+
+def _get_late_requests(today, due_later_date, agency_ein=None):
+    """
+    Return the open requests of active agencies that are Overdue or Due Soon,
+    split by agency and by whether they were acknowledged, with one query
+    (acknowledgments are checked with an EXISTS subquery and requesters are
+    loaded along with the requests).
+
+    :param today: (utc) start of today (see get_due_date_bounds)
+    :param due_later_date: (utc) start of the first day after the due soon period
+    :param agency_ein: only return the requests of this agency
+    :return: dictionary of agency eins and the keyword arguments of
+        STATUSES_EMAIL_TEMPLATE (lists of requests ordered by due date):
+        {
+            "requests_overdue": [...],
+            "acknowledgments_overdue": [...],
+            "requests_due_soon": [...],
+            "acknowledgments_due_soon": [...],
+        }
+    """
+    acknowledged = db.session.query(Determinations.id).filter(
+        Determinations.request_id == Requests.id,
+        Determinations.dtype == determination_type.ACKNOWLEDGMENT
+    ).exists()
+    late_requests = _late_requests_query(today, due_later_date).add_columns(
+        acknowledged
+    ).options(
+        joinedload(Requests.requester)
+    ).order_by(
+        Requests.due_date.asc()
+    )
+    if agency_ein is not None:
+        late_requests = late_requests.filter(Requests.agency_ein == agency_ein)
+
+    agencies = {}
+    for request, was_acknowledged in late_requests:
+        agency_requests = agencies.setdefault(request.agency_ein, {
+            "requests_overdue": [],
+            "acknowledgments_overdue": [],
+            "requests_due_soon": [],
+            "acknowledgments_due_soon": [],
+        })
+        agency_requests["{}_{}".format(
+            "requests" if was_acknowledged else "acknowledgments",
+            "overdue" if request.due_date < today else "due_soon"
+        )].append(request)
+    return agencies
+
+
 def _update_request_statuses():
     """
     Update statuses for all requests that are now Due Soon or Overdue
     and send a notification email to agency admins listing the requests.
+
+    If DERIVED_REQUEST_STATUSES, statuses are derived from due dates when
+    requests are read (see Requests.derive_status) and only the emails are sent.
+
+    The emails are sent by one celery task per agency with late requests
+    (see send_agency_status_report), run in parallel; the completion of
+    all of them is reported by report_status_reports_sent.
     """
     now = datetime.utcnow()
-    due_soon_date = calendar.addbusdays(
-        now, current_app.config['DUE_SOON_DAYS_THRESHOLD']
-    ).replace(hour=23, minute=59, second=59)  # the entire day
-
-    agencies = Agencies.query.with_entities(Agencies.ein).filter_by(is_active=True).all()
-
-    for agency_ein, in agencies:
-        requests_overdue = Requests.query.filter(
-            Requests.due_date < now,
-            Requests.status != request_status.CLOSED,
-            Requests.agency_ein == agency_ein
-        ).order_by(
-            Requests.due_date.asc()
-        ).all()
-
-        requests_due_soon = Requests.query.filter(
-            Requests.due_date > now,
-            Requests.due_date <= due_soon_date,
-            Requests.status != request_status.CLOSED,
-            Requests.agency_ein == agency_ein
-        ).order_by(
-            Requests.due_date.asc()
-        ).all()
-
-        if not requests_overdue and not requests_due_soon:
-            continue
-
-        agency_requests_overdue = []
-        agency_acknowledgments_overdue = []
-        agency_requests_due_soon = []
-        agency_acknowledgments_due_soon = []
-
-        # OVERDUE
-        for request in requests_overdue:
-
-            if request.was_acknowledged:
-                agency_requests_overdue.append(request)
-            else:
-                agency_acknowledgments_overdue.append(request)
-
-            if request.status != request_status.OVERDUE:
-                create_object(
-                    Events(
-                        request.id,
-                        user_guid=None,
-                        auth_user_type=None,
-                        type_=REQ_STATUS_CHANGED,
-                        previous_value={"request": request.status},
-                        new_value={"status": request_status.OVERDUE},
-                        response_id=None,
-                    )
-                )
-                update_object(
-                    {"status": request_status.OVERDUE},
-                    Requests,
-                    request.id)
-
-        # DUE SOON
-        for request in requests_due_soon:
-
-            if request.was_acknowledged:
-                agency_requests_due_soon.append(request)
-            else:
-                agency_acknowledgments_due_soon.append(request)
-
-            if request.status != request_status.DUE_SOON:
-                create_object(
-                    Events(
-                        request.id,
-                        user_guid=None,
-                        auth_user_type=None,
-                        type_=REQ_STATUS_CHANGED,
-                        previous_value={"status": request.status},
-                        new_value={"status": request_status.DUE_SOON},
-                        response_id=None,
-                    )
-                )
-                update_object(
-                    {"status": request_status.DUE_SOON},
-                    Requests,
-                    request.id)
-
-        # mail to agency admins for each agency
-        user_emails = list(set(admin.notification_email or admin.email for admin
-                               in Agencies.query.filter_by(ein=agency_ein).one().administrators))
+    # local (app) days, as for derived statuses
+    today, due_later_date = get_due_date_bounds(now)
+
+    if not current_app.config['DERIVED_REQUEST_STATUSES']:
+        _transition_request_statuses(now, today, due_later_date)
+
+    agency_eins = [agency_ein for agency_ein, in _late_requests_query(
+        today, due_later_date
+    ).with_entities(
+        Requests.agency_ein
+    ).distinct().order_by(
+        Requests.agency_ein
+    )]
+    if not agency_eins:
+        return
+    chord(
+        [send_agency_status_report.s(agency_ein, today, due_later_date) for agency_ein in agency_eins]
+    )(report_status_reports_sent.s(now))
+
+
+@celery.task
+def send_agency_status_report(agency_ein, today, due_later_date):
+    """
+    Email the Overdue and Due Soon requests of an agency to its administrators
+    and record the email (the template is rendered once for both).
 
+    Failures are emailed to OPENRECORDS_DL_EMAIL so the reports
+    of other agencies are unaffected.
+
+    :param agency_ein: agency ein
+    :param today: (utc) start of today, as of the status update (see get_due_date_bounds)
+    :param due_later_date: (utc) start of the first day after the due soon period
+    :return: {"agency_ein": ..., "sent": <was a report sent?>, "failed": <did it fail?>, "num_requests": ...}
+    """
+    result = {"agency_ein": agency_ein, "sent": False, "failed": False, "num_requests": 0}
+    try:
+        late_requests = _get_late_requests(today, due_later_date, agency_ein).get(agency_ein)
+        if late_requests:
+            _send_agency_status_report(agency_ein, late_requests)
+            result["sent"] = True
+            result["num_requests"] = sum(len(requests) for requests in late_requests.values())
+    except Exception:
+        db.session.rollback()
+        result["failed"] = True
         send_email(
-            STATUSES_EMAIL_SUBJECT,
-            to=user_emails,
-            template=STATUSES_EMAIL_TEMPLATE,
-            requests_overdue=agency_requests_overdue,
-            acknowledgments_overdue=agency_acknowledgments_overdue,
-            requests_due_soon=agency_requests_due_soon,
-            acknowledgments_due_soon=agency_acknowledgments_due_soon
+            subject="Update Request Statuses Failure ({})".format(agency_ein),
+            to=[OPENRECORDS_DL_EMAIL],
+            email_content=traceback.format_exc().replace("\n", "<br/>").replace(" ", "&nbsp;")
         )
-        email = Emails(
+    finally:
+        db.session.remove()  # the app context of celery workers (and its session) outlives tasks
+    return result
+
+
+@celery.task
+def report_status_reports_sent(results, started):
+    """
+    Log the completion and total duration of the agency status reports
+    of a status update (see _update_request_statuses).
+
+    :param results: results of send_agency_status_report
+    :param started: (utc) datetime the status update started
+    :return: {"agencies": ..., "sent": ..., "failed": [<agency ein>, ...], "duration": <seconds>}
+    """
+    duration = (datetime.utcnow() - started).total_seconds()
+    summary = {
+        "agencies": len(results),
+        "sent": sum(result["sent"] for result in results),
+        "failed": [result["agency_ein"] for result in results if result["failed"]],
+        "duration": duration,
+    }
+    current_app.logger.info(
+        "Sent {sent} of {agencies} agency status reports in {duration:.1f} seconds.".format(**summary))
+    if summary["failed"]:
+        current_app.logger.error(
+            "Failed to send the status reports of agencies {}.".format(", ".join(summary["failed"])))
+    return summary
+
+
+def _send_agency_status_report(agency_ein, late_requests):
+    """
+    :param agency_ein: agency ein
+    :param late_requests: keyword arguments of STATUSES_EMAIL_TEMPLATE (see _get_late_requests)
+    """
+    request = max(chain(*late_requests.values()), key=lambda r: r.due_date)  # latest due
+
+    # mail to agency admins
+    user_emails = list(set(admin.notification_email or admin.email for admin
+                           in Agencies.query.filter_by(ein=agency_ein).one().administrators))
+
+    body = render_template(STATUSES_EMAIL_TEMPLATE + ".html", **late_requests)
+    send_email(
+        STATUSES_EMAIL_SUBJECT,
+        to=user_emails,
+        email_content=body
+    )
+    email = Emails(
+        request.id,
+        PRIVATE,
+        to=','.join(user_emails),
+        cc=None,
+        bcc=None,
+        subject=STATUSES_EMAIL_SUBJECT,
+        body=body
+    )
+    create_object(email)
+    create_object(
+        Events(
             request.id,
-            PRIVATE,
-            to=','.join(user_emails),
-            cc=None,
-            bcc=None,
-            subject=STATUSES_EMAIL_SUBJECT,
-            body=render_template(
-                STATUSES_EMAIL_TEMPLATE + ".html",
-                requests_overdue=agency_requests_overdue,
-                acknowledgments_overdue=agency_acknowledgments_overdue,
-                requests_due_soon=agency_requests_due_soon,
-                acknowledgments_due_soon=agency_acknowledgments_due_soon
-            )
-        )
-        create_object(email)
-        create_object(
-            Events(
-                request.id,
-                user_guid=None,
-                auth_user_type=None,
-                type_=EMAIL_NOTIFICATION_SENT,
-                previous_value=None,
-                new_value=email.val_for_events,
-                response_id=None,
-                timestamp=datetime.utcnow()
-            )
+            user_guid=None,
+            auth_user_type=None,
+            type_=EMAIL_NOTIFICATION_SENT,
+            previous_value=None,
+            new_value=email.val_for_events,
+            response_id=None,
+            timestamp=datetime.utcnow()
         )
+    )
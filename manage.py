@@ -196,6 +196,18 @@ def es_recreate():
     recreate()
 
 
+@manager.option('--full', dest='full', action='store_true', default=False, required=False,
+                help='Sync all request docs, ignoring the last sync time.')
+def es_sync(full=False):
+    """Update elasticsearch docs for requests changed since the last sync."""
+    from app.search.utils import update_docs
+
+    def progress(current, total):
+        print("{}/{} docs synced".format(current, total))
+
+    update_docs(full=full, progress=progress)
+
+
 @manager.command
 def fix_due_dates():  # for "America/New_York"
     """
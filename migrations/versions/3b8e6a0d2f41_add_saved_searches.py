@@ -0,0 +1,41 @@
+"""Add saved_searches table
+
+Revision ID: 3b8e6a0d2f41
+Revises: 7c2d9e4b1a3f
+Create Date: 2026-10-18 16:21:07.402153
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3b8e6a0d2f41'
+down_revision = '7c2d9e4b1a3f'
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table('saved_searches',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('user_guid', sa.String(length=64), nullable=False),
+                    sa.Column('auth_user_type',
+                              postgresql.ENUM('Saml2In:NYC Employees', 'LDAP:NYC Employees', 'FacebookSSO',
+                                              'MSLiveSSO', 'YahooSSO', 'LinkedInSSO', 'GoogleSSO', 'EDIRSSO',
+                                              'AnonymousUser', name='auth_user_type', create_type=False),
+                              nullable=False),
+                    sa.Column('name', sa.String(length=64), nullable=False),
+                    sa.Column('query_string', sa.String(length=256), nullable=False),
+                    sa.Column('query_fields', postgresql.JSONB(), nullable=False),
+                    sa.Column('agency_ein', sa.String(length=4), nullable=True),
+                    sa.Column('by_phrase', sa.Boolean(), nullable=False),
+                    sa.Column('date_created', sa.DateTime(), nullable=True),
+                    sa.ForeignKeyConstraint(['agency_ein'], ['agencies.ein'], ),
+                    sa.ForeignKeyConstraint(['user_guid', 'auth_user_type'], ['users.guid', 'users.auth_user_type'],
+                                            onupdate='CASCADE'),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+
+
+def downgrade():
+    op.drop_table('saved_searches')
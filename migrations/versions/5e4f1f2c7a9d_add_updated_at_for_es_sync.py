@@ -0,0 +1,29 @@
+"""Add updated_at to tables used by request docs
+
+Revision ID: 5e4f1f2c7a9d
+Revises: 13de5f42768b
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5e4f1f2c7a9d'
+down_revision = '13de5f42768b'
+
+from alembic import op
+import sqlalchemy as sa
+
+TABLES = ('agencies', 'users', 'requests', 'responses', 'user_requests')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True,
+                                       server_default=sa.text("(now() at time zone 'utc')")))
+        op.create_index(op.f('ix_{}_updated_at'.format(table)), table, ['updated_at'], unique=False)
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index(op.f('ix_{}_updated_at'.format(table)), table_name=table)
+        op.drop_column(table, 'updated_at')
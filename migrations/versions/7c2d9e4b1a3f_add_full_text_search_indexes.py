@@ -0,0 +1,65 @@
+"""Add full-text search indexes for the postgres search backend
+
+Revision ID: 7c2d9e4b1a3f
+Revises: 5e4f1f2c7a9d
+Create Date: 2026-10-18 14:03:52.118940
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c2d9e4b1a3f'
+down_revision = '5e4f1f2c7a9d'
+
+import logging
+
+from alembic import op
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger('alembic.env')
+
+# expressions must match app.search.postgres.tsvector
+TSVECTOR_COLUMNS = ('title', 'description', 'agency_request_summary')
+
+
+def upgrade():
+    for column in TSVECTOR_COLUMNS:
+        op.execute(
+            "CREATE INDEX ix_requests_{column}_tsv ON requests "
+            "USING gin (to_tsvector('english'::regconfig, coalesce({column}, '')))".format(column=column)
+        )
+    if create_trigram_extension():
+        op.execute("CREATE INDEX ix_requests_id_trgm ON requests USING gin (id gin_trgm_ops)")
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_requests_id_trgm")
+    for column in TSVECTOR_COLUMNS:
+        op.execute("DROP INDEX ix_requests_{column}_tsv".format(column=column))
+
+
+def create_trigram_extension():
+    """
+    Create the pg_trgm extension (for partial FOIL ID searches of the postgres
+    search backend) if it does not exist.
+
+    Creating an extension requires superuser or database owner rights. Without
+    them the trigram index is skipped so the upgrade still succeeds; deployments
+    using the postgres search backend then have a DBA run:
+
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX ix_requests_id_trgm ON requests USING gin (id gin_trgm_ops);
+
+    :return: whether the extension exists
+    """
+    bind = op.get_bind()
+    if bind.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar():
+        return True
+    savepoint = bind.begin_nested()
+    try:
+        bind.execute("CREATE EXTENSION pg_trgm")
+    except DBAPIError as e:
+        savepoint.rollback()
+        logger.warning("Skipping the trigram index of request ids, pg_trgm could not be created: {}".format(e.orig))
+        return False
+    savepoint.commit()
+    return True
@@ -0,0 +1,46 @@
+from datetime import date, datetime, timedelta
+
+from business_calendar import Calendar, MO, TU, WE, TH, FR
+
+from tests.lib.base import BaseTestCase
+from app import holidays
+from app.lib.calendar_utils import BusinessCalendar
+
+
+class BusinessCalendarTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+        self.year = date.today().year
+        self.calendar = BusinessCalendar(holidays.keys(), self.year - 1, self.year + 1)
+        self.reference = Calendar(
+            workdays=[MO, TU, WE, TH, FR],
+            holidays=[str(key) for key in holidays.keys()]
+        )
+        self.dates = [datetime(self.year, 1, 2) + timedelta(days=days) for days in range(0, 600, 3)]
+
+    def test_addbusdays(self):
+        for date_ in self.dates:
+            for offset in (-10, -1, 0, 1, 2, 10, 20):
+                self.assertEqual(self.calendar.addbusdays(date_, offset),
+                                 self.reference.addbusdays(date_, offset))
+
+    def test_busdaycount(self):
+        now = datetime(self.year, 1, 2, 9)
+        for date_ in self.dates:
+            due_date = date_.replace(hour=23, minute=59, second=59)
+            self.assertEqual(self.calendar.busdaycount(now, due_date),
+                             self.reference.busdaycount(now, due_date))
+
+    def test_outside_of_span(self):
+        # no holidays: work days only
+        friday = date(self.year + 3, 1, 1)
+        friday += timedelta(days=(4 - friday.weekday()) % 7)
+        self.assertEqual(self.calendar.addbusdays(friday, 1), friday + timedelta(days=3))
+        self.assertEqual(self.calendar.busdaycount(friday, friday + timedelta(days=14)), 10)
+
+    def test_batch(self):
+        self.assertEqual(self.calendar.addbusdays_many(self.dates, 5),
+                         [self.calendar.addbusdays(date_, 5) for date_ in self.dates])
+        self.assertEqual(self.calendar.busdaycount_many(self.dates, self.dates[-1]),
+                         [self.calendar.busdaycount(date_, self.dates[-1]) for date_ in self.dates])
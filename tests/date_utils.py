@@ -0,0 +1,24 @@
+from datetime import datetime
+from unittest.mock import patch
+
+from tests.lib.base import BaseTestCase
+from app.lib.date_utils import get_due_date_bounds
+
+
+class DueDateBoundsTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+        config = patch.dict(self.app.config, APP_TIMEZONE='US/Eastern', DUE_SOON_DAYS_THRESHOLD=2)
+        config.start()
+        self.addCleanup(config.stop)
+        # Tuesday 2017-03-07 00:00 EST, and the start of Friday 2017-03-10 (2 business days later)
+        self.bounds = (datetime(2017, 3, 7, 5), datetime(2017, 3, 10, 5))
+
+    def test_local_day(self):
+        # Tuesday 10:00 EST
+        self.assertEqual(get_due_date_bounds(datetime(2017, 3, 7, 15)), self.bounds)
+
+    def test_local_day_after_utc_midnight(self):
+        # Tuesday 21:00 EST, already Wednesday in utc
+        self.assertEqual(get_due_date_bounds(datetime(2017, 3, 8, 2)), self.bounds)
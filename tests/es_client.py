@@ -0,0 +1,56 @@
+from unittest.mock import Mock, patch
+
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, TransportError
+
+from tests.lib.base import BaseTestCase
+from app import es
+
+
+class ElasticsearchClientTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+
+    @patch('app.lib.es_client.time.sleep')
+    def test_transient_error_retried(self, sleep):
+        method = Mock(side_effect=[TransportError(503, 'unavailable'), {'count': 1}])
+        self.assertEqual(es._call_with_retries('count', method), {'count': 1})
+        self.assertEqual(method.call_count, 2)
+        sleep.assert_called_once_with(self.app.config['ELASTICSEARCH_RETRY_BACKOFF'])
+
+    @patch('app.lib.es_client.time.sleep')
+    def test_timeout_not_retried_for_writes(self, sleep):
+        method = Mock(side_effect=ConnectionTimeout('TIMEOUT', 'timed out', None))
+        with self.assertRaises(ConnectionTimeout):
+            es._call_with_retries('create', method)
+        self.assertEqual(method.call_count, 1)
+
+    @patch('app.lib.es_client.time.sleep')
+    def test_transient_error_not_retried_for_writes(self, sleep):
+        for operation in ('bulk', 'index', 'create'):
+            method = Mock(side_effect=TransportError(503, 'unavailable'))
+            with self.assertRaises(TransportError):
+                es._call_with_retries(operation, method)
+            self.assertEqual(method.call_count, 1)
+        sleep.assert_not_called()
+
+    @patch('app.lib.es_client.time.sleep')
+    def test_scroll_not_retried(self, sleep):
+        method = Mock(side_effect=ConnectionError('N/A', 'refused', None))
+        with self.assertRaises(ConnectionError):
+            es._call_with_retries('scroll', method)
+        self.assertEqual(method.call_count, 1)
+        sleep.assert_not_called()
+
+    @patch('app.lib.es_client.time.sleep')
+    def test_retries_exhausted(self, sleep):
+        method = Mock(side_effect=ConnectionError('N/A', 'refused', None))
+        with self.assertRaises(ConnectionError):
+            es._call_with_retries('search', method)
+        self.assertEqual(method.call_count, self.app.config['ELASTICSEARCH_MAX_RETRIES'] + 1)
+
+    def test_client_error_not_retried(self):
+        method = Mock(side_effect=TransportError(400, 'bad request'))
+        with self.assertRaises(TransportError):
+            es._call_with_retries('search', method)
+        self.assertEqual(method.call_count, 1)
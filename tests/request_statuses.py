@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+from unittest.mock import ANY, patch
+
+from tests.lib.base import BaseTestCase
+from tests.lib.tools import RequestFactory
+from app import db
+from app.models import Agencies, Events, Requests
+from app.constants import request_status, OPENRECORDS_DL_EMAIL
+from app.constants.event_type import REQ_STATUS_CHANGED
+from app.lib.date_utils import get_due_date_bounds
+
+
+class TransitionRequestStatusesTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        config = patch.dict(self.app.config, ELASTICSEARCH_ENABLED=True)
+        config.start()
+        self.addCleanup(config.stop)
+        self.now = datetime.utcnow()
+        self.today, self.due_later_date = get_due_date_bounds(self.now)
+        rf = RequestFactory(Agencies.query.filter_by(is_active=True).first().ein)
+        date_created = self.now - timedelta(days=30)
+        self.overdue = rf.create_request_as_anonymous_user(
+            date_created=date_created, due_date=self.today - timedelta(days=1))
+        self.due_soon = rf.create_request_as_anonymous_user(
+            date_created=date_created, due_date=self.today + timedelta(hours=12))
+        self.open = rf.create_request_as_anonymous_user(
+            date_created=date_created, due_date=self.due_later_date + timedelta(days=5))
+        self.closed = rf.create_request_as_anonymous_user(
+            date_created=date_created, due_date=self.today - timedelta(days=1), status=request_status.CLOSED)
+
+    def __status(self, request):
+        return Requests.query.filter_by(id=request.id).one().status
+
+    @patch('jobs.queue_doc_updates')
+    @patch('jobs.bulk_update_docs', return_value=(2, []))
+    def test_transitions(self, bulk_update_docs, queue_doc_updates):
+        from jobs import _transition_request_statuses
+        request_ids = _transition_request_statuses(self.now, self.today, self.due_later_date)
+        self.assertEqual(sorted(request_ids), sorted([self.overdue.id, self.due_soon.id]))
+        db.session.expire_all()
+        self.assertEqual(self.__status(self.overdue), request_status.OVERDUE)
+        self.assertEqual(self.__status(self.due_soon), request_status.DUE_SOON)
+        self.assertEqual(self.__status(self.open), request_status.OPEN)
+        self.assertEqual(self.__status(self.closed), request_status.CLOSED)
+
+        events = Events.query.filter_by(type=REQ_STATUS_CHANGED).all()
+        self.assertEqual(
+            sorted((e.request_id, e.previous_value['status'], e.new_value['status']) for e in events),
+            sorted([
+                (self.overdue.id, request_status.OPEN, request_status.OVERDUE),
+                (self.due_soon.id, request_status.OPEN, request_status.DUE_SOON),
+            ])
+        )
+        # one bulk update
+        bulk_update_docs.assert_called_once_with(request_ids)
+        queue_doc_updates.assert_not_called()
+
+    @patch('jobs.queue_doc_updates')
+    @patch('jobs.bulk_update_docs', return_value=(2, []))
+    def test_transitions_once(self, bulk_update_docs, queue_doc_updates):
+        from jobs import _transition_request_statuses
+        _transition_request_statuses(self.now, self.today, self.due_later_date)
+        self.assertEqual(_transition_request_statuses(self.now, self.today, self.due_later_date), [])
+        self.assertEqual(Events.query.filter_by(type=REQ_STATUS_CHANGED).count(), 2)
+        self.assertEqual(bulk_update_docs.call_count, 1)
+
+    @patch('jobs.queue_doc_updates')
+    @patch('jobs.bulk_update_docs')
+    def test_failed_doc_updates_queued(self, bulk_update_docs, queue_doc_updates):
+        from jobs import _transition_request_statuses
+        bulk_update_docs.return_value = (1, [self.overdue.id])
+        _transition_request_statuses(self.now, self.today, self.due_later_date)
+        queue_doc_updates.assert_called_once_with([self.overdue.id])
+
+
+class AgencyStatusReportsTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        config = patch.dict(self.app.config, DERIVED_REQUEST_STATUSES=True)
+        config.start()
+        self.addCleanup(config.stop)
+        self.now = datetime.utcnow()
+        self.today, self.due_later_date = get_due_date_bounds(self.now)
+        self.agency_eins = [agency.ein for agency in Agencies.query.filter_by(
+            is_active=True).order_by(Agencies.ein).limit(2)]
+        for agency_ein in self.agency_eins:
+            RequestFactory(agency_ein).create_request_as_anonymous_user(
+                date_created=self.now - timedelta(days=30), due_date=self.today - timedelta(days=1))
+
+    @patch('jobs.chord')
+    def test_one_report_per_agency(self, chord):
+        from jobs import _update_request_statuses, report_status_reports_sent
+        _update_request_statuses()
+        chord.assert_called_once_with(ANY)
+        signatures = chord.call_args[0][0]
+        self.assertEqual([signature.args[0] for signature in signatures], self.agency_eins)
+        callback = chord.return_value.call_args[0][0]
+        self.assertEqual(callback.task, report_status_reports_sent.name)
+
+    @patch('jobs._send_agency_status_report')
+    def test_report_sent(self, send_agency_status_report_patch):
+        from jobs import send_agency_status_report
+        result = send_agency_status_report(self.agency_eins[0], self.today, self.due_later_date)
+        self.assertEqual(result, {"agency_ein": self.agency_eins[0], "sent": True, "failed": False, "num_requests": 1})
+        send_agency_status_report_patch.assert_called_once_with(self.agency_eins[0], ANY)
+
+    @patch('jobs.send_email')
+    @patch('jobs._send_agency_status_report', side_effect=Exception)
+    def test_report_failed(self, send_agency_status_report_patch, send_email_patch):
+        from jobs import send_agency_status_report
+        result = send_agency_status_report(self.agency_eins[0], self.today, self.due_later_date)
+        self.assertEqual(result, {"agency_ein": self.agency_eins[0], "sent": False, "failed": True, "num_requests": 0})
+        # failures are reported by email
+        send_email_patch.assert_called_once_with(
+            subject="Update Request Statuses Failure ({})".format(self.agency_eins[0]),
+            to=[OPENRECORDS_DL_EMAIL],
+            email_content=ANY
+        )
+
+    def test_summary(self):
+        from jobs import report_status_reports_sent
+        summary = report_status_reports_sent([
+            {"agency_ein": "0001", "sent": True, "failed": False, "num_requests": 3},
+            {"agency_ein": "0002", "sent": False, "failed": False, "num_requests": 0},
+            {"agency_ein": "0003", "sent": False, "failed": True, "num_requests": 0},
+        ], self.now)
+        self.assertEqual(summary["agencies"], 3)
+        self.assertEqual(summary["sent"], 1)
+        self.assertEqual(summary["failed"], ["0003"])
+        self.assertGreaterEqual(summary["duration"], 0)
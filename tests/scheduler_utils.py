@@ -0,0 +1,56 @@
+from unittest.mock import Mock, patch
+
+from tests.lib.base import BaseTestCase
+from app import scheduler_redis
+from app.lib.scheduler_utils import (
+    SchedulerLeader,
+    SCHEDULER_LEADER_KEY,
+    get_scheduler_leader,
+)
+
+
+class SchedulerLeaderTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+        scheduler_redis.delete(SCHEDULER_LEADER_KEY)
+        self.first = SchedulerLeader(Mock(), scheduler_redis, 30, Mock())
+        self.second = SchedulerLeader(Mock(), scheduler_redis, 30, Mock())
+
+    def tearDown(self):
+        scheduler_redis.delete(SCHEDULER_LEADER_KEY)
+        super().tearDown()
+
+    def test_single_leader(self):
+        self.first.heartbeat()
+        self.second.heartbeat()
+        self.assertTrue(self.first.is_leader)
+        self.assertFalse(self.second.is_leader)
+        self.first.scheduler.start.assert_called_once_with()
+        self.second.scheduler.start.assert_not_called()
+        self.assertEqual(get_scheduler_leader(scheduler_redis)['node'], self.first.node_id)
+
+    def test_takeover(self):
+        self.first.heartbeat()
+        scheduler_redis.delete(SCHEDULER_LEADER_KEY)  # lock expired
+        self.second.heartbeat()
+        self.first.heartbeat()
+        self.assertTrue(self.second.is_leader)
+        self.assertFalse(self.first.is_leader)
+        self.first.scheduler.scheduler.pause.assert_called_once_with()
+
+    def test_stop_hands_over(self):
+        self.first.heartbeat()
+        self.first.stop()
+        self.second.heartbeat()
+        self.assertTrue(self.second.is_leader)
+
+    def test_forked_process_does_not_release(self):
+        self.first.heartbeat()
+        with patch('app.lib.scheduler_utils.os.getpid', return_value=-1):
+            # e.g. the exit hook of a gunicorn worker forked from the leader
+            self.first.stop()
+            self.first.heartbeat()
+        self.assertTrue(self.first.is_leader)
+        self.first.scheduler.shutdown.assert_not_called()
+        self.assertEqual(get_scheduler_leader(scheduler_redis)['node'], self.first.node_id)
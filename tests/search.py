@@ -1,8 +1,548 @@
+import csv
+import json
+from datetime import datetime, timedelta
+from io import StringIO
 from unittest.mock import patch
 from tests.lib.base import BaseTestCase
+from tests.lib.tools import RequestFactory, UserFactory, login_user_with_client
+from app import db, es, search_redis
+from app.lib.redis_utils import redis_get_search_generation
+from app.search.constants import (
+    AGENCY_ONLY_FIELDS,
+    DIRTY_REQUESTS_KEY,
+    FLUSH_SCHEDULED_KEY,
+    GENERATION_BUMP_SCHEDULED_KEY,
+    PUBLIC_SOURCE_FIELDS,
+)
 
 
 class SearchViewsTests(BaseTestCase):
 
     def setUp(self):
         super().setup()
+
+
+class SearchRequestsSourceTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        RequestFactory().create_request_as_anonymous_user(title_privacy=False)
+        es.indices.refresh(index=self.app.config['ELASTICSEARCH_INDEX'])
+
+    def test_anonymous_api_profile_has_public_fields_only(self):
+        response = self.client.get('/search/requests', query_string={
+            'query': '',
+            'start': '0',
+            'open': 'true',
+            'closed': 'true',
+            'source_profile': 'api',
+        })
+        self.assertEqual(response.status_code, 200)
+        hits = json.loads(response.data.decode())['results']
+        self.assertEqual(len(hits), 1)
+        self.assertTrue(hits[0]['_source'])
+        for field in hits[0]['_source']:
+            self.assertIn(field, PUBLIC_SOURCE_FIELDS)
+        for field in ['requester_id', 'requester_name', 'title', 'description'] + AGENCY_ONLY_FIELDS:
+            self.assertNotIn(field, hits[0]['_source'])
+
+
+class SearchRequestsCsvTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.agency_admin = UserFactory().create_agency_admin()
+        rf = RequestFactory()
+        self.requests = [rf.create_request_as_anonymous_user() for _ in range(3)]
+        es.indices.refresh(index=self.app.config['ELASTICSEARCH_INDEX'])
+        self.query_string = {
+            'query': '',
+            'open': 'true',
+            'closed': 'true',
+            'tz_name': self.app.config['APP_TIMEZONE'],
+        }
+
+    @patch('app.search.utils.ALL_RESULTS_CHUNKSIZE', 1)
+    @patch('app.search.views.ALL_RESULTS_CHUNKSIZE', 1)
+    def test_csv_streamed(self):
+        with self.client as client:
+            login_user_with_client(client, self.agency_admin.get_id())
+            response = client.get('/search/requests/csv', query_string=self.query_string)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'text/csv')
+            rows = list(csv.reader(StringIO(response.data.decode())))
+        self.assertEqual(rows[0][0], 'FOIL ID')
+        # every hit is written, not just the first scroll page
+        self.assertEqual(sorted(row[0] for row in rows[1:]), sorted(r.id for r in self.requests))
+
+    def test_csv_empty_results(self):
+        with self.client as client:
+            login_user_with_client(client, self.agency_admin.get_id())
+            self.query_string.update(open='false', closed='false')
+            response = client.get('/search/requests/csv', query_string=self.query_string)
+            self.assertEqual(response.status_code, 400)
+
+    def test_csv_anonymous(self):
+        response = self.client.get('/search/requests/csv', query_string=self.query_string)
+        self.assertEqual(response.status_code, 400)
+
+
+class GenerateCsvTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rf = RequestFactory()
+        self.requests = [rf.create_request_as_anonymous_user() for _ in range(3)]
+        es.indices.refresh(index=self.app.config['ELASTICSEARCH_INDEX'])
+        self.hits = es.search(
+            index=self.app.config['ELASTICSEARCH_INDEX'],
+            doc_type='request',
+            body={'query': {'match_all': {}}}
+        )['hits']['hits']
+
+    @patch('app.search.views.ALL_RESULTS_CHUNKSIZE', 2)
+    def test_hydrated_per_page(self):
+        from app.search.utils import hydrate_requests
+        from app.search.views import _generate_csv
+        for hit in self.hits:
+            # indexed before agency-only fields were added
+            hit['_source'].pop('assigned_user_emails', None)
+        with patch('app.search.views.hydrate_requests', wraps=hydrate_requests) as hydrate_requests_patch:
+            lines = list(_generate_csv(self.hits, None))
+        self.assertEqual(len(lines), len(self.requests) + 1)
+        self.assertEqual(hydrate_requests_patch.call_count, 2)
+        self.assertEqual(
+            sorted(id_ for call in hydrate_requests_patch.call_args_list for id_ in call[0][0]),
+            sorted(r.id for r in self.requests)
+        )
+
+    @patch('app.search.views.hydrate_requests', return_value={})
+    def test_indexed_fields_not_hydrated(self, hydrate_requests_patch):
+        from app.search.views import _generate_csv
+        lines = list(_generate_csv(self.hits, None))
+        self.assertEqual(len(lines), len(self.requests) + 1)
+        hydrate_requests_patch.assert_called_once_with([])
+
+
+class RequestsDSLGeneratorTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+        self.query_fields = {
+            'title': True,
+            'agency_request_summary': True,
+            'description': True,
+            'requester_name': False,
+        }
+
+    def __generator(self, agency_ein=None):
+        from app.search.utils import RequestsDSLGenerator
+        return RequestsDSLGenerator(
+            'records',
+            self.query_fields,
+            ['Open'],
+            [{'range': {'date_received': {'gte': '01/01/2017'}}}],
+            agency_ein,
+            'match'
+        )
+
+    def test_agency_user(self):
+        bool_ = self.__generator('0002').agency_user()['query']['bool']
+        self.assertEqual(bool_['minimum_should_match'], 1)
+        self.assertEqual(bool_['filter'], [
+            {'terms': {'status': ['Open']}},
+            {'range': {'date_received': {'gte': '01/01/2017'}}},
+            {'term': {'agency_ein': '0002'}},
+        ])
+        self.assertEqual(len(bool_['should']), 3)
+        for condition in bool_['should']:
+            self.assertNotIn('filter', condition['bool'])
+
+    def test_anonymous_user_queries_public_fields(self):
+        generator = self.__generator()
+        conditions = generator.anonymous_user()['query']['bool']['should']
+        self.assertEqual(conditions, [
+            {'bool': {'must': [{'match': {'public_title': 'records'}}]}},
+            {'bool': {'must': [{'match': {'public_agency_request_summary': 'records'}}]}},
+        ])
+        self.assertEqual(generator.highlight_fields, ['public_title', 'public_agency_request_summary'])
+
+    def test_public_user_description_restricted_to_requester(self):
+        with patch('app.search.utils.current_user') as current_user:
+            current_user.get_id.return_value = 'requester:EDIRSSO'
+            generator = self.__generator()
+            conditions = generator.public_user()['query']['bool']['should']
+        self.assertEqual(conditions[-1], {'bool': {
+            'must': [{'match': {'description': 'records'}}],
+            'filter': [{'term': {'requester_id': 'requester:EDIRSSO'}}]
+        }})
+        self.assertNotIn('description', generator.highlight_fields)
+
+    def test_queryless_has_no_scored_clauses(self):
+        bool_ = self.__generator().queryless()['query']['bool']
+        self.assertEqual(list(bool_), ['filter'])
+
+
+class FormatAggregationsTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+
+    def test_format_aggregations(self):
+        from app.search.utils import format_aggregations
+        results = {
+            'aggregations': {
+                'statuses': {'buckets': [{'key': 'Open', 'doc_count': 3}, {'key': 'Closed', 'doc_count': 1}]},
+                'agencies': {'buckets': [{'key': '0002', 'doc_count': 4}]},
+                'due_dates': {'doc_count': 3, 'buckets': {'buckets': {
+                    'overdue': {'doc_count': 1},
+                    'due_soon': {'doc_count': 0},
+                    'due_later': {'doc_count': 2},
+                }}},
+            }
+        }
+        self.assertEqual(format_aggregations(results), {
+            'statuses': {'Open': 3, 'Closed': 1},
+            'agencies': {'0002': 4},
+            'due_dates': {'overdue': 1, 'due_soon': 0, 'due_later': 2},
+        })
+
+
+class FoilIdDSLTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+
+    @staticmethod
+    def __condition(query):
+        from app.search.utils import RequestsDSLGenerator
+        return RequestsDSLGenerator(query, {}, ['Open'], [], None, 'match').foil_id()['query']['bool']['filter'][0]
+
+    def test_complete_foil_id(self):
+        self.assertEqual(self.__condition('2017-002-00123'), {'ids': {'values': ['FOIL-2017-002-00123']}})
+
+    def test_short_partial_foil_id(self):
+        self.assertEqual(self.__condition('20'), {'prefix': {'foil_id': 'FOIL-20'}})
+
+    def test_partial_foil_id(self):
+        self.assertEqual(self.__condition('002-001'), {'match': {'foil_id.ngram': '002-001'}})
+
+
+class SearchCursorTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+
+    def test_cursor_round_trip(self):
+        from app.search.utils import encode_cursor, decode_cursor
+        sort = ['date_due:desc', 'foil_id:asc']
+        cursor = encode_cursor(sort, [1483228800000, 'FOIL-2017-002-00001'])
+        self.assertEqual(decode_cursor(cursor, sort), [1483228800000, 'FOIL-2017-002-00001'])
+
+    def test_cursor_for_another_sort(self):
+        from app.search.utils import encode_cursor, decode_cursor
+        cursor = encode_cursor(['date_due:desc', 'foil_id:asc'], [1483228800000, 'FOIL-2017-002-00001'])
+        self.assertIsNone(decode_cursor(cursor, ['_score:desc', 'foil_id:asc']))
+
+    def test_invalid_cursor(self):
+        from app.search.utils import decode_cursor
+        self.assertIsNone(decode_cursor('not a cursor', ['_score:desc', 'foil_id:asc']))
+
+    def test_sort_dsl_tolerates_unmapped_foil_id(self):
+        from app.search.utils import get_sort_dsl
+        self.assertEqual(get_sort_dsl(['_score:desc', 'foil_id:asc']), [
+            {'_score': {'order': 'desc'}},
+            {'foil_id': {'order': 'asc', 'unmapped_type': 'keyword'}},
+        ])
+
+
+class SavedSearchQueryTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+
+    def __saved_search(self, query_string):
+        from app.models import SavedSearches
+        return SavedSearches(
+            name='Parking',
+            query_string=query_string,
+            query_fields={
+                'title': True,
+                'agency_request_summary': False,
+                'description': True,
+                'requester_name': False,
+            },
+            agency_ein='0002',
+            by_phrase=False,
+        )
+
+    def test_query_matches_new_requests_of_agency(self):
+        bool_ = self.__saved_search('parking tickets').es_query['bool']
+        self.assertEqual(len(bool_['should']), 2)
+        self.assertEqual(bool_['filter'], [
+            {'terms': {'status': ['Open']}},
+            {'term': {'agency_ein': '0002'}},
+        ])
+
+    def test_empty_query_matches_every_new_request(self):
+        bool_ = self.__saved_search('').es_query['bool']
+        self.assertNotIn('should', bool_)
+
+
+class DerivedStatusTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+        self.app.config['DERIVED_REQUEST_STATUSES'] = True
+
+    def tearDown(self):
+        self.app.config['DERIVED_REQUEST_STATUSES'] = False
+        super().tearDown()
+
+    def test_derive_status(self):
+        from datetime import datetime
+        from app.constants import request_status
+        from app.models import Requests
+        today, due_later_date = datetime(2017, 3, 1), datetime(2017, 3, 4)
+        for status, due_date, derived in (
+            (request_status.OPEN, datetime(2017, 2, 28, 22), request_status.OVERDUE),
+            (request_status.IN_PROGRESS, datetime(2017, 3, 3, 22), request_status.DUE_SOON),
+            (request_status.OPEN, datetime(2017, 3, 4, 22), request_status.OPEN),
+            (request_status.DUE_SOON, datetime(2017, 3, 10, 22), request_status.IN_PROGRESS),
+            (request_status.CLOSED, datetime(2017, 2, 1, 22), request_status.CLOSED),
+        ):
+            self.assertEqual(Requests.derive_status(status, due_date, today, due_later_date), derived)
+
+    def test_saved_search_filters_stored_statuses(self):
+        from app.search.utils import RequestsDSLGenerator, get_status_filter
+        self.assertIn('bool', get_status_filter(['Open']))
+        dsl = RequestsDSLGenerator('', {}, ['Open'], [], None, 'match', stored_statuses=True).queryless()
+        self.assertEqual(dsl['query']['bool']['filter'], [{'terms': {'status': ['Open']}}])
+
+
+class RecreateTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.rf = RequestFactory()
+        self.rf.create_request_as_anonymous_user()
+
+    def test_request_created_during_rebuild(self):
+        from app.search.utils import recreate, create_saved_search_docs, get_aliased_indices, get_routing
+        old_indices = get_aliased_indices()
+        created = []
+
+        def load_saved_search_docs(index=None, since=None):
+            create_saved_search_docs(index, since)
+            if not created:
+                # after the request docs were loaded, before the index is verified
+                created.append(self.rf.create_request_as_anonymous_user())
+
+        with patch('app.search.utils.create_saved_search_docs', side_effect=load_saved_search_docs):
+            recreate()
+
+        new_indices = get_aliased_indices()
+        self.assertEqual(len(new_indices), 1)
+        self.assertNotIn(new_indices[0], old_indices)
+        # synced once the new index was aliased
+        self.assertTrue(es.exists(
+            index=self.app.config['ELASTICSEARCH_INDEX'],
+            doc_type='request',
+            id=created[0].id,
+            routing=get_routing(created[0].agency_ein)
+        ))
+
+
+class SearchCacheInvalidationTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+        search_redis.delete(GENERATION_BUMP_SCHEDULED_KEY)
+
+    def tearDown(self):
+        search_redis.delete(GENERATION_BUMP_SCHEDULED_KEY)
+        super().tearDown()
+
+    @patch('app.search.utils.bump_search_generation_task.apply_async')
+    def test_delayed_invalidations_coalesced(self, apply_async):
+        from app.search.utils import bump_search_generation
+        generation = redis_get_search_generation()
+        bump_search_generation()
+        bump_search_generation()
+        self.assertEqual(redis_get_search_generation(), generation + 2)
+        apply_async.assert_called_once_with(countdown=self.app.config['SEARCH_CACHE_REFRESH_DELAY'] * 2)
+
+
+class AgencyRoutingTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.request = RequestFactory().create_request_as_anonymous_user()
+        config = patch.dict(self.app.config, ELASTICSEARCH_ROUTE_BY_AGENCY=True)
+        config.start()
+        self.addCleanup(config.stop)
+
+    def test_index_created_without_routing(self):
+        from app.search.utils import get_routing, set_index_routed
+        set_index_routed(None)  # read from the mapping
+        self.assertIsNone(get_routing(self.request.agency_ein))
+        # the doc indexed without routing is still found
+        self.request.es_update()
+
+    def test_recreated_index_routed(self):
+        from app.search.utils import recreate, get_routing
+        recreate()
+        self.assertEqual(get_routing(self.request.agency_ein), self.request.agency_ein)
+        self.assertTrue(es.exists(
+            index=self.app.config['ELASTICSEARCH_INDEX'],
+            doc_type='request',
+            id=self.request.id,
+            routing=self.request.agency_ein
+        ))
+        self.request.es_update()
+
+
+class SyncWatermarkTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.request = RequestFactory().create_request_as_anonymous_user()
+
+    def __get_doc(self):
+        from app.search.utils import get_routing
+        return es.get(
+            index=self.app.config['ELASTICSEARCH_INDEX'],
+            doc_type='request',
+            id=self.request.id,
+            routing=get_routing(self.request.agency_ein)
+        )['_source']
+
+    def test_watermark_before_sync_start(self):
+        from app.search.utils import update_docs, get_sync_watermark
+        margin = timedelta(seconds=self.app.config['ELASTICSEARCH_SYNC_WATERMARK_MARGIN'])
+        before = datetime.utcnow()
+        update_docs(full=True)
+        after = datetime.utcnow()
+        self.assertTrue(before - margin <= get_sync_watermark() <= after - margin)
+
+    def test_late_commit_synced(self):
+        from app.models import Requests
+        from app.search.utils import update_docs
+        before = datetime.utcnow()
+        update_docs(full=True)
+        # updated before the sync started, committed after it
+        Requests.query.filter_by(id=self.request.id).update({'title': 'Late commit', 'updated_at': before})
+        db.session.commit()
+        self.assertEqual(update_docs(), 1)
+        self.assertEqual(self.__get_doc()['title'], 'Late commit')
+
+    def test_unchanged_requests_not_synced(self):
+        from app.search.utils import update_docs, set_sync_watermark
+        set_sync_watermark(datetime.utcnow())
+        self.assertEqual(update_docs(), 0)
+
+
+class AgencyOnlyFieldsTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.request = RequestFactory().create_request_as_anonymous_user()
+        config = patch.dict(self.app.config, ELASTICSEARCH_ASYNC_UPDATES=False)
+        config.start()
+        self.addCleanup(config.stop)
+
+    def __get_doc(self):
+        from app.search.utils import get_routing
+        return es.get(
+            index=self.app.config['ELASTICSEARCH_INDEX'],
+            doc_type='request',
+            id=self.request.id,
+            routing=get_routing(self.request.agency_ein)
+        )['_source']
+
+    def test_doc_has_agency_only_fields(self):
+        doc = self.__get_doc()
+        for field in AGENCY_ONLY_FIELDS:
+            self.assertIn(field, doc)
+        self.assertEqual(doc['requester_email'], self.request.requester.email)
+        self.assertEqual(doc['assigned_user_emails'], [u.email for u in self.request.agency_users])
+
+    def test_requester_update(self):
+        requester = self.request.requester
+        requester.email = 'updated@email.com'
+        db.session.commit()
+        requester.es_update()
+        self.assertEqual(self.__get_doc()['requester_email'], 'updated@email.com')
+
+
+class DocUpdateQueueTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp(populate=False)
+        search_redis.delete(DIRTY_REQUESTS_KEY, FLUSH_SCHEDULED_KEY)
+
+    def tearDown(self):
+        search_redis.delete(DIRTY_REQUESTS_KEY, FLUSH_SCHEDULED_KEY)
+        super().tearDown()
+
+    @patch('app.search.utils.flush_doc_updates.apply_async')
+    def test_updates_coalesced(self, apply_async):
+        from app.search.utils import queue_doc_update
+        queue_doc_update('FOIL-2017-001-00001')
+        queue_doc_update('FOIL-2017-001-00002')
+        queue_doc_update('FOIL-2017-001-00001')
+        apply_async.assert_called_once_with(countdown=self.app.config['ELASTICSEARCH_ASYNC_UPDATES_DELAY'])
+        self.assertEqual(
+            search_redis.smembers(DIRTY_REQUESTS_KEY),
+            {b'FOIL-2017-001-00001', b'FOIL-2017-001-00002'}
+        )
+
+    @patch('app.search.utils.flush_doc_updates.apply_async')
+    @patch('app.search.utils.bulk_update_docs', return_value=(1, ['FOIL-2017-001-00002']))
+    def test_flush(self, bulk_update_docs, apply_async):
+        from app.search.utils import queue_doc_updates, flush_doc_updates
+        queue_doc_updates(['FOIL-2017-001-00001', 'FOIL-2017-001-00002'])
+        self.assertEqual(flush_doc_updates(), 1)
+        bulk_update_docs.assert_called_once_with(['FOIL-2017-001-00001', 'FOIL-2017-001-00002'])
+        # transient failures are queued again, with a new flush
+        self.assertEqual(search_redis.smembers(DIRTY_REQUESTS_KEY), {b'FOIL-2017-001-00002'})
+        self.assertEqual(apply_async.call_count, 2)
+
+    @patch('app.search.utils.bulk_update_docs')
+    def test_flush_empty(self, bulk_update_docs):
+        from app.search.utils import flush_doc_updates
+        self.assertEqual(flush_doc_updates(), 0)
+        bulk_update_docs.assert_not_called()
+
+
+class PostgresBackendTests(BaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        rf = RequestFactory()
+        self.public_request = rf.create_request_as_anonymous_user(title='Zebra crossings', title_privacy=False)
+        rf.create_request_as_anonymous_user(title='Giraffe enclosures', title_privacy=True)
+        config = patch.dict(self.app.config, SEARCH_BACKEND='postgres')
+        config.start()
+        self.addCleanup(config.stop)
+
+    def __search(self, query):
+        response = self.client.get('/search/requests', query_string={
+            'query': query,
+            'title': 'true',
+            'start': '0',
+            'open': 'true',
+            'closed': 'true',
+            'source_profile': 'api',
+        })
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data.decode())
+
+    def test_public_title_matched(self):
+        results = self.__search('zebra')
+        self.assertEqual(results['total'], 1)
+        self.assertEqual(results['results'][0]['_id'], self.public_request.id)
+        self.assertEqual(results['results'][0]['_source']['public_title'], 'Zebra crossings')
+
+    def test_private_title_not_matched(self):
+        self.assertEqual(self.__search('giraffe')['total'], 0)